@@ -1,6 +1,8 @@
 import argparse
+from pathlib import Path
 from report_eb_autoscaling_alarms import cw_describe_alarm_history, cw_describe_alarms, asg_describe_scaling, \
-    eb_by_resource, eb_refresh_cache
+    eb_by_resource, alarm_scaling_join, alarm_timeline, aws_cache, aws_replay, aws_target, async_fetch, daemon, \
+    output_sink, run_stats, time_windows, util
 
 
 # Parses command-line arguments and returns them as 'options'.
@@ -16,28 +18,102 @@ def parse():
                         'simply delete the cache dir before running.',
                         choices=['envs', 'resources', 'alarms', 'alarm_history', 'scaling'], nargs='+', default=[])
     parser.add_argument('--write-csv', help='Write one or more output CSV files.',
-                        choices=['cw_alarms', 'cw_alarm_history', 'asg_activities', 'all'], nargs='+', default=[])
-    parser.add_argument('--aws-profile', help='Profile name in your AWS credentials file.', default='default')
-    parser.add_argument('--aws-region', help='AWS Region to query.', default='us-west-2')
+                        choices=['cw_alarms', 'cw_alarm_history', 'asg_activities', 'alarm_scaling', 'all'], nargs='+',
+                        default=[])
+    parser.add_argument('--aws-profile', help='Profile name in your AWS credentials file, or several names to ' +
+                        'report on several accounts.', nargs='+', default=['default'])
+    parser.add_argument('--aws-region', help='AWS Region to query, or several Regions.', nargs='+',
+                        default=['us-west-2'])
+    parser.add_argument('--aws-endpoint-url', help='Send all AWS requests to this URL instead, e.g. a local stand-in ' +
+                        'like moto_server for testing offline.', default=None)
+    parser.add_argument('--cache-backend', help='Where to keep the cache: "file" is one JSON file per object in ' +
+                        aws_cache.cache_dir + ', "sqlite" is a single compressed database file ' + aws_cache.cache_db +
+                        '.  See also python -m report_eb_autoscaling_alarms.cache_migrate.',
+                        choices=aws_cache.BACKEND_NAMES, default='file')
+    parser.add_argument('--workers', help='Number of AWS requests to run concurrently when filling the cache.',
+                        type=int, default=1)
+    parser.add_argument('--async-fetch', help='Fill the cache for all object types up front as one overlapped set ' +
+                        'of requests on an asyncio event loop, with up to --workers requests in flight per service.',
+                        action='store_true')
+    parser.add_argument('--jobs', help='Number of worker processes summarizing alarm history and scaling activity ' +
+                        'for the output CSVs.  Everything is fetched into the cache first, and each worker reads the ' +
+                        'cache itself.', type=int, default=1)
+    parser.add_argument('--incremental', help='When refreshing alarm_history or scaling, fetch only items newer ' +
+                        'than those already cached and merge them in, instead of downloading the full history again.',
+                        action='store_true')
+    parser.add_argument('--refresh-stale', help='Refresh only those cached objects older than the TTL of their ' +
+                        'object type (see --ttl), and write output/cache_refresh_report.csv listing which objects ' +
+                        'were refreshed and which were served from the cache.', action='store_true')
+    parser.add_argument('--ttl', help='With --refresh-stale or --serve, override the TTL in seconds of one or ' +
+                        'more object types, like alarm_history=900.  Defaults: ' +
+                        ' '.join('{}={}'.format(k, v) for k, v in sorted(aws_cache.DEFAULT_TTLS.items())),
+                        type=parse_ttl, nargs='+', default=[])
+    parser.add_argument('--server-side-filter', help='For cw_alarm_history, ask AWS only for the beanstalk alarms ' +
+                        '(by name prefix) and only for their StateUpdate and Action history items, instead of every ' +
+                        'alarm and item and filtering here.  The filtered objects are cached apart from the full ones.',
+                        action='store_true')
+    parser.add_argument('--since', help='Report cw_alarm_history and asg_activities only from this time on: a date ' +
+                        'and time like 2017-03-01T12:00 (UTC unless given an offset), or a time ago like 24h or 7d ' +
+                        '(units m, h, d, w).', type=time_windows.parse_time, default=None)
+    parser.add_argument('--until', help='Report cw_alarm_history and asg_activities only up to this time, given ' +
+                        'as for --since.', type=time_windows.parse_time, default=None)
+    parser.add_argument('--window', help='Also write cw_alarm_history-<name> and asg_activities-<name> for ' +
+                        'each of these windows, given as [name=]since[..until] with times as for --since, e.g. 24h ' +
+                        '7d deploy=2017-03-01T12:00..2017-03-08T09:30.  All the windows are computed in one pass.',
+                        type=time_windows.parse_window, nargs='+', default=[])
+    parser.add_argument('--write-timeline', help='Also write ' + util.OUTPUT_DIR + '/cw_alarm_timeline.npz, the ' +
+                        'time each of the cw_alarm_history alarms spent in each state in each bucket of this ' +
+                        'duration, like 1h, from --since (or the earliest history) to --until (or now).',
+                        type=time_windows.parse_duration, default=None)
+    parser.add_argument('--output-format', help='Format of the output files: csv, or for loading into other tools ' +
+                        'jsonl (a JSON object per row) or columnar (JSON Lines of batches of rows, each an object of ' +
+                        'column name => values).', choices=output_sink.FORMATS, default='csv')
+    parser.add_argument('--output-gzip', help='Gzip the output files, adding .gz to their names.', action='store_true')
+    parser.add_argument('--serve', help='Instead of writing output files, keep running and serve the reports ' +
+                        'from memory over HTTP at [host:]port (host ' + daemon.DEFAULT_HOST + ' unless given), e.g. ' +
+                        'GET /cw_alarm_history?since=24h&format=jsonl, refreshing the cache incrementally in the ' +
+                        'background.  See daemon.py.', type=daemon.parse_address, default=None)
+    parser.add_argument('--refresh-interval', help='With --serve, seconds between refreshes of the alarm ' +
+                        'histories and scaling activities; the other objects are refreshed once older than their ' +
+                        'TTL.  With --refresh-stale, so are these.', type=int, default=300)
+    parser.add_argument('--record-aws', help='Record every AWS response into ' + aws_replay.RECORDING_FILE_NAME +
+                        ' in this dir, to replay later, e.g. with bench_fetch --replay.', default=None)
+    parser.add_argument('--stats', help='Record AWS call counts and latencies, cache hits, misses and bytes, and ' +
+                        'the wall-clock time of each stage, and write them to ' + util.OUTPUT_DIR +
+                        '/run_stats.json.', action='store_true')
     options = parser.parse_args()
     if 'all' in options.write_csv:
-        options.write_csv = ['cw_alarms', 'cw_alarm_history', 'asg_activities']
+        options.write_csv = ['cw_alarms', 'cw_alarm_history', 'asg_activities', 'alarm_scaling']
     elif options.recache is None and options.write_csv is None:
         raise Exception('Please specify at least one recache or csv target')
     return options
 
 
-# Initializes the Boto AWS clients.
+# Parses an object_type=seconds argument into a (object_type, seconds) pair.
+def parse_ttl(arg):
+    object_type, sep, seconds = arg.partition('=')
+    if not sep or object_type not in aws_cache.DEFAULT_TTLS or not seconds.isdigit():
+        raise argparse.ArgumentTypeError('expected object_type=seconds with object_type one of {}, not {}'
+                                         .format(sorted(aws_cache.DEFAULT_TTLS), arg))
+    return object_type, int(seconds)
+
+
+# Returns an aws_target.Target for every combination of profile and region.  A lone target has the usual cache and
+# output dirs; with several, each has its own subdirs, named <profile>/<region>.
 #
-# aws_profile: string name, like 'default'
-# aws_region: string name, like 'us-west-2'
+# aws_profiles: list of string names, like ['default']
+# aws_regions: list of string names, like ['us-west-2']
+# aws_endpoint_url: string URL to use instead of the AWS endpoints, or None
+# workers: int: max concurrent AWS requests per service, for sizing the connection pools
 #
-def init_clients(aws_profile, aws_region):
-    asg_describe_scaling.init_client(aws_profile, aws_region)
-    cw_describe_alarm_history.init_client(aws_profile, aws_region)
-    cw_describe_alarms.init_client(aws_profile, aws_region)
-    eb_by_resource.init_client(aws_profile, aws_region)
-    eb_refresh_cache.init_client(aws_profile, aws_region)
+def make_targets(aws_profiles, aws_regions, aws_endpoint_url=None, workers=1):
+    max_pool_connections = max(aws_target.DEFAULT_MAX_POOL_CONNECTIONS, workers)
+    if len(aws_profiles) == 1 and len(aws_regions) == 1:
+        return [aws_target.Target(aws_profiles[0], aws_regions[0], aws_endpoint_url,
+                                  max_pool_connections=max_pool_connections)]
+    return [aws_target.Target(aws_profile, aws_region, aws_endpoint_url, '{}/{}'.format(aws_profile, aws_region),
+                              max_pool_connections)
+            for aws_profile in aws_profiles for aws_region in aws_regions]
 
 
 # Refreshes the cache (or fills it for the first time), for the "easy" cache object types: envs, resources, alarms.
@@ -45,43 +121,171 @@ def init_clients(aws_profile, aws_region):
 # arguments to pass to boto.
 #
 # recache: list of string: object types
+# workers: int: max concurrent AWS requests
+# refresh_stale: bool: also refresh whichever of these objects have outlived their TTL
+# all_alarms: bool: whether the full list of alarms is needed; else with server-side filtering only the report's
+#   alarms are refreshed
 #
-def refresh_cache(recache):
+def refresh_cache(recache, workers=1, refresh_stale=False, all_alarms=True):
     # Recache describe_environments
     envs = []
-    if 'envs' in recache or 'resources' in recache:
-        envs = eb_by_resource.get_envs(True)
+    if 'envs' in recache or 'resources' in recache or refresh_stale:
+        envs = eb_by_resource.get_envs('envs' in recache or 'resources' in recache)
 
     # Recache describe_environment_resources-<envname>
-    if 'resources' in recache:
-        for env in envs['Environments']:
-            eb_by_resource.get_resources(env['EnvironmentName'], True)
+    if 'resources' in recache or refresh_stale:
+        eb_by_resource.get_all_resources(envs, 'resources' in recache, workers)
 
     # Recache describe_alarms
-    if 'alarms' in recache:
-        cw_describe_alarms.get_alarm_pages(True)
+    if 'alarms' in recache or refresh_stale:
+        if cw_describe_alarm_history.server_side_filter and not all_alarms:
+            cw_describe_alarm_history.get_report_alarms('alarms' in recache)
+        else:
+            cw_describe_alarms.get_alarm_pages('alarms' in recache)
 
 
 # Writes CSV files for the specified object types.
 #
 # write_csv: list of string: object types
+# recache: list of string: object types
+# workers: int: max concurrent AWS requests
+# incremental: bool: refresh cached history by fetching only what is new
+# jobs: int: max worker processes summarizing history and activities
+# windows: list of time_windows.Window to write cw_alarm_history and asg_activities for, or None for all of the history
+# timeline_bucket_us: int microseconds per bucket of the alarm timeline to write too, or None for no timeline.  It
+#   covers the first of the windows.
 #
-def write_csvs(write_csv, recache):
+def write_csvs(write_csv, recache, workers=1, incremental=False, jobs=1, windows=None, timeline_bucket_us=None):
     # Write output/cw_alarms.csv
     if 'cw_alarms' in write_csv:
-        cw_describe_alarms.write_alarms()
+        with run_stats.stage('cw_alarms'):
+            cw_describe_alarms.write_alarms()
 
     # Write output/cw_alarm_history.csv
     if 'cw_alarm_history' in write_csv:
-        cw_describe_alarm_history.calc_and_write_alarm_history_for_eb_autoscaling('alarm_history' in recache)
+        with run_stats.stage('cw_alarm_history'):
+            cw_describe_alarm_history.calc_and_write_alarm_history_for_eb_autoscaling('alarm_history' in recache,
+                                                                                      workers, incremental, jobs,
+                                                                                      windows)
 
     # Write output/asg_activities.csv
     if 'asg_activities' in write_csv:
-        asg_describe_scaling.calc_and_write_scaling_activity_for_beanstalk_asgs('scaling' in recache)
+        with run_stats.stage('asg_activities'):
+            asg_describe_scaling.calc_and_write_scaling_activity_for_beanstalk_asgs('scaling' in recache, workers,
+                                                                                    incremental, jobs, windows)
+
+    # Write output/alarm_scaling.csv
+    if 'alarm_scaling' in write_csv:
+        with run_stats.stage('alarm_scaling'):
+            # The history and activities are refreshed already if the CSVs above were written.
+            alarm_scaling_join.calc_and_write_alarm_scaling('alarm_history' in recache and
+                                                            'cw_alarm_history' not in write_csv,
+                                                            'scaling' in recache and 'asg_activities' not in write_csv,
+                                                            workers, incremental, windows[0] if windows else None)
+
+    # Write output/cw_alarm_timeline.npz
+    if timeline_bucket_us:
+        with run_stats.stage('cw_alarm_timeline'):
+            since_us, until_us = (windows[0].since_us, windows[0].until_us) if windows else (None, None)
+            # The history is refreshed already if cw_alarm_history or alarm_scaling was written.
+            alarm_timeline.calc_and_write_alarm_timeline(timeline_bucket_us,
+                                                         'alarm_history' in recache and
+                                                         'cw_alarm_history' not in write_csv and
+                                                         'alarm_scaling' not in write_csv,
+                                                         workers, incremental, since_us, until_us)
+
+
+# Returns the time windows of the options, or None for all of the history.
+def get_windows(options):
+    return time_windows.make_windows(options.since, options.until, options.window)
+
+
+# Refreshes the cache and writes the CSVs for the current aws_target.
+def run_target(options):
+    aws_cache.init_backend(options.cache_backend)
+    if options.record_aws:
+        aws_replay.record_target(aws_target.current(), options.record_aws)
+    if options.async_fetch:
+        with run_stats.stage('async_fetch'):
+            async_fetch.fill_cache(options.recache,
+                                   options.write_csv + (['cw_alarm_timeline'] if options.write_timeline else []),
+                                   options.workers, options.incremental)
+        # Everything is cached now, so the CSVs need not refresh anything.
+        write_csvs(options.write_csv, [], options.workers, options.incremental, options.jobs, get_windows(options),
+                   options.write_timeline)
+    else:
+        with run_stats.stage('refresh_cache'):
+            refresh_cache(options.recache, options.workers, options.refresh_stale, 'cw_alarms' in options.write_csv)
+        write_csvs(options.write_csv, options.recache, options.workers, options.incremental, options.jobs,
+                   get_windows(options), options.write_timeline)
+    if options.refresh_stale:
+        aws_cache.write_refresh_report()
+
+
+# Merges each of the outputs of the targets into one output of that name in util.OUTPUT_DIR, with the target's
+# Region and Account (profile name) as the first two columns of every row.  The rows are streamed from the targets'
+# files to the merged one.
+#
+# targets: list of aws_target.Target, each with a namespace
+# output_names: list of string: report names, like 'cw_alarms' (see output_sink.file_name)
+#
+def merge_target_outputs(targets, output_names):
+    for output_name in output_names:
+        target_filenames = []
+        for target in targets:
+            target_filename = Path(aws_target.run(target, util.output_dir) + '/' + output_sink.file_name(output_name))
+            if target_filename.is_file():
+                target_filenames.append((target, target_filename))
+            else:
+                print('WARNING: no {} for {}'.format(output_sink.file_name(output_name), target))
+        columns = next(filter(None, (output_sink.read_columns(target_filename)
+                                     for target, target_filename in target_filenames)), [])
+        output_filename, num_written = output_sink.write_rows(output_name, ['Region', 'Account'] + columns,
+                                                              merged_rows(target_filenames), util.OUTPUT_DIR)
+        print('merged {} rows from {} targets into {}'.format(num_written, len(targets), output_filename))
+
+
+def merged_rows(target_filenames):
+    for target, target_filename in target_filenames:
+        for row in output_sink.read_rows(target_filename):
+            row['Region'] = target.region_name
+            row['Account'] = target.profile_name
+            yield row
+
+
+# Returns the names of the outputs that run_target writes in the output dir.
+def output_names(options):
+    output_names = list(options.write_csv)
+    for window in options.window:
+        output_names += [window.output_name(csv_name) for csv_name in options.write_csv
+                         if csv_name in ['cw_alarm_history', 'asg_activities']]
+    if options.refresh_stale:
+        output_names.append('cache_refresh_report')
+    return output_names
 
 
 if __name__ == '__main__':
     options = parse()
-    init_clients(options.aws_profile, options.aws_region)
-    refresh_cache(options.recache)
-    write_csvs(options.write_csv, options.recache)
+    if options.stats:
+        run_stats.enable()
+    cw_describe_alarm_history.init_server_side_filter(options.server_side_filter)
+    output_sink.init_output(options.output_format, options.output_gzip)
+    aws_cache.init_ttls(dict(options.ttl), options.refresh_stale)
+    targets = make_targets(options.aws_profile, options.aws_region, options.aws_endpoint_url, options.workers)
+    if options.serve:
+        if len(targets) == 1:
+            aws_target.set_default(targets[0])
+        for target in targets:
+            aws_target.run(target, aws_cache.init_backend, options.cache_backend)
+        daemon.serve(targets, options, options.serve)
+    elif len(targets) == 1:
+        aws_target.set_default(targets[0])
+        run_target(options)
+    else:
+        # The targets run concurrently, each in a thread of its own that sees that target as the current one.
+        util.parallel_map(lambda target: aws_target.run(target, run_target, options), targets, len(targets))
+        with run_stats.stage('merge_target_outputs'):
+            merge_target_outputs(targets, output_names(options))
+    aws_cache.print_memo_counts()
+    if options.stats:
+        run_stats.write_stats(util.OUTPUT_DIR + '/run_stats.json', aws_cache.memo_counts)
@@ -0,0 +1,136 @@
+# Writes a CSV joining each alarm's Action history items with the ASG scaling activities they invoked, which
+# cw_alarm_history.csv and asg_activities.csv only count separately: how many instances each alarm launched or
+# terminated, and how long after the alarm's action each activity started.
+#
+# An activity names the alarm that invoked it (see asg_describe_scaling.extract_alarm_name), and starts shortly after
+# that alarm's successful Action history item.  The actions of all the alarms, and the activities of all the ASGs, are
+# each sorted once by (alarm name, time), and then merged in one pass: each activity is matched to the latest action of
+# its alarm at or before its start, if that is no more than MAX_LAG earlier.  That is O(n log n) for the two sorts and
+# linear for the merge, over the whole fleet at once.
+#
+# CSV row format:
+# AlarmName EnvName ASGName #ActionSuccess #Launching #Terminating #Matched Lag-p50 Lag-p90 Lag-p99 Lag-max
+#
+
+import math
+from datetime import timedelta
+from report_eb_autoscaling_alarms import asg_describe_scaling, cw_describe_alarm_history, cw_describe_alarms, \
+    history_records, output_sink
+
+MAX_LAG = timedelta(minutes=15)
+LAG_PERCENTILES = [50, 90, 99]
+COLUMNS = ['AlarmName', 'EnvName', 'ASGName', 'NumActionSuccess', 'NumActivityLaunching', 'NumActivityTerminating',
+           'NumActivityMatched'] + ['LagP{}Secs'.format(percent) for percent in LAG_PERCENTILES] + ['LagMaxSecs']
+
+
+# window: time_windows.Window of the actions and activities to count, or None for all of them
+def calc_and_write_alarm_scaling(refresh_history=False, refresh_scaling=False, workers=1, incremental=False,
+                                 window=None):
+    alarms = cw_describe_alarm_history.get_report_alarms()
+    asg_env_pairs = asg_describe_scaling.lookup_beanstalk_asg_env_pairs(refresh_scaling, workers)
+    asg_names = [asg_env_pair['ASG']['AutoScalingGroups'][0]['AutoScalingGroupName'] for asg_env_pair in asg_env_pairs]
+    if workers > 1:
+        cw_describe_alarm_history.fetch_history_pages([alarm['AlarmName'] for alarm in alarms], refresh_history,
+                                                      workers, incremental)
+        asg_describe_scaling.fetch_scaling_activity_pages(asg_names, refresh_scaling, workers, incremental)
+        refresh_history = refresh_scaling = False
+
+    alarm_records = (cw_describe_alarm_history.get_history_records(alarm['AlarmName'], refresh_history, incremental)
+                     for alarm in alarms)
+    asg_records = (asg_describe_scaling.get_scaling_activity_records(asg_name, refresh_scaling, incremental)
+                   for asg_name in asg_names)
+    write_alarm_scaling(summarize_alarm_scaling(alarms, alarm_records, asg_records, window))
+
+
+# Returns a summary row of each alarm, in alarm order.
+#
+# alarm_records: iterable in the same order as alarms, of each alarm's iterable of history_records.HistoryRecord
+# asg_records: iterable of each ASG's iterable of history_records.ActivityRecord
+# window: time_windows.Window of the actions and activities to count, or None for all of them
+# dimensions: list in the same order as alarms of each alarm's cw_describe_alarms.get_alarm_dimension(), or None to
+#   look them up
+#
+def summarize_alarm_scaling(alarms, alarm_records, asg_records, window=None, dimensions=None):
+    actions = []
+    num_action_success = []
+    for alarm, records in zip(alarms, alarm_records):
+        num_action_success.append(0)
+        for record in records:
+            if record.kind == history_records.KIND_ACTION and record.action_state == history_records.ACTION_SUCCEEDED:
+                actions.append((alarm['AlarmName'], record.timestamp_us))
+                if in_window(record.timestamp_us, window):
+                    num_action_success[-1] += 1
+    activities = []
+    for records in asg_records:
+        for record in records:
+            if record.launch_or_term != history_records.ACTIVITY_OTHER and in_window(record.start_us, window):
+                activities.append((record.alarm_name, record.start_us, record.launch_or_term))
+
+    joined = join_actions_and_activities(actions, activities)
+    if dimensions is None:
+        dimensions = [cw_describe_alarms.get_alarm_dimension(alarm) for alarm in alarms]
+    return [summarize_alarm(alarm, dimensions[alarm_id], joined.get(alarm['AlarmName']), num_action_success[alarm_id])
+            for alarm_id, alarm in enumerate(alarms)]
+
+
+def in_window(time_us, window):
+    return window is None or ((window.since_us is None or time_us >= window.since_us)
+                              and (window.until_us is None or time_us < window.until_us))
+
+
+# Sorts actions, a list of (alarm name, timestamp us), and activities, a list of (alarm name, start us,
+# history_records.ACTIVITY_*), and merges them.  Returns a dict of alarm name => {'Launching': count,
+# 'Terminating': count, 'Lags': sorted list of the microseconds from action to activity of the matched activities}.
+def join_actions_and_activities(actions, activities):
+    actions.sort()
+    activities.sort()
+    max_lag_us = int(MAX_LAG.total_seconds()) * 1000000
+    joined = {}
+    i = 0
+    for alarm_name, start_us, launch_or_term in activities:
+        # Move past the actions up to this activity, in (alarm name, time) order, so actions[i - 1] is the latest of
+        # them.  The activities are in the same order, so i only ever moves forward.
+        while i < len(actions) and actions[i] <= (alarm_name, start_us):
+            i += 1
+        if alarm_name not in joined:
+            joined[alarm_name] = {'Launching': 0, 'Terminating': 0, 'Lags': []}
+        alarm_joined = joined[alarm_name]
+        alarm_joined['Launching' if launch_or_term == history_records.ACTIVITY_LAUNCHING else 'Terminating'] += 1
+        if i > 0 and actions[i - 1][0] == alarm_name and start_us - actions[i - 1][1] <= max_lag_us:
+            alarm_joined['Lags'].append(start_us - actions[i - 1][1])
+    for alarm_joined in joined.values():
+        alarm_joined['Lags'].sort()
+    return joined
+
+
+# Returns the nearest-rank percentile of the sorted values.
+def percentile(sorted_values, percent):
+    return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+
+def summarize_alarm(alarm, dimension, alarm_joined, num_action_success):
+    dimension_name, dimension_value, env_name = dimension
+    alarm_joined = alarm_joined or {'Launching': 0, 'Terminating': 0, 'Lags': []}
+    lags = alarm_joined['Lags']
+    summary_row = {
+        'AlarmName': alarm['AlarmName'],
+        'EnvName': env_name,
+        'ASGName': dimension_value if dimension_name == 'AutoScalingGroupName' else '',
+        'NumActionSuccess': num_action_success,
+        'NumActivityLaunching': alarm_joined['Launching'],
+        'NumActivityTerminating': alarm_joined['Terminating'],
+        'NumActivityMatched': len(lags),
+        'LagMaxSecs': lag_seconds(lags[-1]) if lags else None
+    }
+    for percent in LAG_PERCENTILES:
+        summary_row['LagP{}Secs'.format(percent)] = lag_seconds(percentile(lags, percent)) if lags else None
+    return summary_row
+
+
+def lag_seconds(lag_us):
+    return round(lag_us / 1000000, 3)
+
+
+def write_alarm_scaling(summary_rows):
+    output_filename, num_written = output_sink.write_rows('alarm_scaling', COLUMNS, summary_rows)
+    print('wrote action to scaling activity lags of {} alarms into {}'.format(num_written, output_filename))
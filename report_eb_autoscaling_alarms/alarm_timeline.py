@@ -0,0 +1,199 @@
+# Writes a timeline of the report's alarms: how long each alarm spent in each state in each fixed bucket of time, like
+# each hour, to see when alarms were flapping rather than only their totals as in cw_alarm_history.csv.
+#
+# The timeline is computed from the StateUpdate history items already decoded for cw_alarm_history (see
+# history_records), and written to output/cw_alarm_timeline.npz, a zip of arrays in numpy's .npy format, each one
+# compressed:
+#
+#   seconds_in_state: uint32, shape (alarms, states, buckets): whole seconds each alarm spent in each state per bucket
+#   bucket_start: int64, shape (buckets,): start of each bucket, in seconds since the epoch
+#   alarm_name, env_name: unicode, shape (alarms,)
+#   state_name: unicode, shape (states,): 'OK', 'ALARM', 'INSUFFICIENT_DATA'
+#
+# so numpy.load('cw_alarm_timeline.npz')['seconds_in_state'][:, 1, :] is a heatmap of every alarm's time in ALARM.
+# Writing it takes no numpy, only the standard library.
+#
+# A row of buckets is computed for a whole column of intervals at once.  The time covered in bucket b, from edge E to
+# E + bucket_us, is bucket_us times the number of intervals open at its end, less the offsets from E of the starts in
+# it, plus the offsets of the ends in it (an interval that starts and ends in b adds e - s, one that starts in b and
+# ends later adds bucket_us - (s - E), and so on).  The numbers of intervals open are running sums of a difference
+# array of how many start and end in each bucket, so a bucket in which no interval starts or ends is simply bucket_us
+# times that.  Only the buckets in which intervals start or end need the offsets, which come from running sums of the
+# sorted starts and ends, found by binary search.  All of that is done by sorted, bisect, itertools and operator over
+# whole columns, so the rows cost O(intervals log intervals + buckets) at C speed however many buckets each interval
+# spans.  Rows are computed and written one at a time, so memory use does not grow with the number of
+# alarms.
+
+import bisect
+import itertools
+import operator
+import sys
+import zipfile
+from array import array
+from datetime import datetime
+from pathlib import Path
+import pytz
+from report_eb_autoscaling_alarms import cw_describe_alarm_history, cw_describe_alarms, history_records, \
+    state_durations, util
+
+MAX_BUCKETS = 100000
+US_PER_SECOND = 1000000
+
+
+# Fetches the history of the report's alarms if need be, and writes their timeline.
+#
+# bucket_us: int microseconds per bucket
+# since_us, until_us: int microseconds since the epoch to start and end the timeline at, or None to start at the
+#   earliest state interval and end now.  The buckets are aligned to multiples of bucket_us since the epoch.
+#
+def calc_and_write_alarm_timeline(bucket_us, refresh_cache=False, workers=1, incremental=False, since_us=None,
+                                  until_us=None, now=None):
+    alarms = cw_describe_alarm_history.get_report_alarms()
+    if workers > 1:
+        cw_describe_alarm_history.fetch_history_pages([alarm['AlarmName'] for alarm in alarms], refresh_cache, workers,
+                                                      incremental)
+        refresh_cache = False
+    now = now or datetime.now(pytz.utc)
+    durations = state_durations.StateDurations(len(alarms))
+    env_names = []
+    for alarm_id, alarm in enumerate(alarms):
+        env_name = cw_describe_alarms.get_alarm_dimension(alarm)[2]
+        env_names.append(env_name)
+        for record in cw_describe_alarm_history.get_history_records(alarm['AlarmName'], refresh_cache, incremental):
+            if record.kind == history_records.KIND_STATE_UPDATE:
+                durations.add_state_update(alarm_id, record)
+        error_context = 'alarm {} (beanstalk env {}): StateUpdate history item'.format(alarm['AlarmName'], env_name)
+        cw_describe_alarm_history.add_current_state(durations, alarm_id, alarm, now, error_context)
+
+    if since_us is None:
+        since_us = min(durations.start_us) if durations.start_us else history_records.to_epoch_us(now)
+    if until_us is None:
+        until_us = history_records.to_epoch_us(now)
+    assert bucket_us % US_PER_SECOND == 0
+    start_us = since_us - since_us % bucket_us
+    num_buckets = max(0, -(-(until_us - start_us) // bucket_us))
+    if num_buckets > MAX_BUCKETS:
+        raise ValueError('A timeline of {} buckets is too long, the max is {}: use longer buckets or --since'
+                         .format(num_buckets, MAX_BUCKETS))
+
+    util.ensure_path_exists(util.output_dir())
+    output_filename = Path(util.output_dir() + '/cw_alarm_timeline.npz')
+    rows = spread_rows(durations, start_us, bucket_us, num_buckets, since_us, until_us)
+    write_timeline(output_filename, rows, durations.num_alarms, start_us, bucket_us, num_buckets,
+                   [alarm['AlarmName'] for alarm in alarms], env_names)
+    print('wrote the timeline of {} alarms in {} buckets from {} into {}'
+          .format(len(alarms), num_buckets, history_records.from_epoch_us(start_us), output_filename))
+
+
+# rows: iterable of array('I'), each of num_buckets seconds in state, for each alarm and state in turn
+def write_timeline(output_filename, rows, num_alarms, start_us, bucket_us, num_buckets, alarm_names, env_names):
+    with zipfile.ZipFile(str(output_filename), 'w', zipfile.ZIP_DEFLATED) as npz_file:
+        with npz_file.open('seconds_in_state.npy', 'w') as npy_file:
+            npy_file.write(npy_header('<u4', (num_alarms, state_durations.NUM_STATES, num_buckets)))
+            for row in rows:
+                npy_file.write(little_endian(row).tobytes())
+        bucket_start = array('q', [(start_us + bucket * bucket_us) // US_PER_SECOND for bucket in range(num_buckets)])
+        npz_file.writestr('bucket_start.npy', npy_header('<i8', (num_buckets,)) + little_endian(bucket_start).tobytes())
+        npz_file.writestr('alarm_name.npy', npy_strings(alarm_names))
+        npz_file.writestr('env_name.npy', npy_strings(env_names))
+        npz_file.writestr('state_name.npy', npy_strings(history_records.STATE_NAMES))
+
+
+# Yields for each alarm and state in turn (the groups of durations, in order) an array('I') of the whole seconds spent
+# in that state in each bucket, counting only the time from since_us to until_us, which must be within the buckets.
+#
+# The starts and ends are each sorted on their own, by group and then time as one int key, and cut into groups by
+# binary search.  Clipping an interval to since_us and until_us keeps its start no later than its end, and clips a
+# prefix and a suffix of each group's sorted times, which binary search finds as well.
+def spread_rows(durations, start_us, bucket_us, num_buckets, since_us, until_us):
+    # Each group's keys are its offset plus the time, with its offset past any int64 time in the group before.
+    group_offsets = list(map(operator.mul, range(durations.num_alarms * state_durations.NUM_STATES + 1),
+                             itertools.repeat(1 << 64)))
+    start_keys = sorted(map(operator.add, map(group_offsets.__getitem__, durations.groups), durations.start_us))
+    end_keys = sorted(map(operator.add, map(group_offsets.__getitem__, durations.groups), durations.end_us))
+    group_firsts = list(map(operator.sub, group_offsets, itertools.repeat(1 << 63)))
+    start_bounds = list(map(bisect.bisect_left, itertools.repeat(start_keys), group_firsts))
+    end_bounds = list(map(bisect.bisect_left, itertools.repeat(end_keys), group_firsts))
+    since_us, until_us = since_us - start_us, until_us - start_us
+    for group_offset, start_lo, start_hi, end_lo, end_hi in zip(group_offsets, start_bounds, start_bounds[1:],
+                                                                end_bounds, end_bounds[1:]):
+        yield spread_row(clip(start_keys, start_lo, start_hi, group_offset + start_us, since_us, until_us),
+                         clip(end_keys, end_lo, end_hi, group_offset + start_us, since_us, until_us), bucket_us,
+                         num_buckets)
+
+
+# Returns keys[lo:hi], which are sorted, less base (the key of the group at the start of the first bucket), clipped to
+# since_us to until_us.
+def clip(keys, lo, hi, base, since_us, until_us):
+    first = bisect.bisect_left(keys, base + since_us, lo, hi)
+    last = bisect.bisect_right(keys, base + until_us, first, hi)
+    return [since_us] * (first - lo) + list(map(operator.sub, keys[first:last], itertools.repeat(base))) \
+        + [until_us] * (hi - last)
+
+
+# Returns an array('I') of the whole seconds in each bucket of the intervals with the given starts and ends, relative
+# to the start of the first bucket, each sorted and within the buckets.  bucket_us must be whole seconds, so that only
+# the buckets in which intervals start or end need rounding down.
+def spread_row(starts_us, ends_us, bucket_us, num_buckets):
+    if not starts_us:
+        return array('I', [0]) * num_buckets
+    # The buckets in which intervals start or end, but all of them when that is about as many.  A start or end at the
+    # end of the last bucket adds no time to any bucket.
+    if len(starts_us) + len(ends_us) >= num_buckets:
+        touched = range(num_buckets)
+    else:
+        touched = list(set(map(operator.floordiv, starts_us, itertools.repeat(bucket_us)))
+                       .union(map(operator.floordiv, ends_us, itertools.repeat(bucket_us))) - {num_buckets})
+    bucket_starts_us = list(map(operator.mul, touched, itertools.repeat(bucket_us)))
+    num_starts, start_offsets_us = sum_by_bucket(starts_us, bucket_starts_us, bucket_us)
+    num_ends, end_offsets_us = sum_by_bucket(ends_us, bucket_starts_us, bucket_us)
+
+    # The difference array is of bucket_us times the number of intervals opened in each bucket, in seconds.
+    open_diff = array('q', [0]) * num_buckets
+    bucket_seconds = bucket_us // US_PER_SECOND
+    for bucket, num_opened in zip(touched, map(operator.sub, num_starts, num_ends)):
+        open_diff[bucket] = num_opened * bucket_seconds
+    row = array('I', itertools.accumulate(open_diff))
+    # So far row holds bucket_us times the number of intervals open at the end of each bucket, in seconds.
+    touched_us = map(operator.add, map(operator.mul, map(row.__getitem__, touched), itertools.repeat(US_PER_SECOND)),
+                     map(operator.sub, end_offsets_us, start_offsets_us))
+    for bucket, us in zip(touched, touched_us):
+        row[bucket] = us // US_PER_SECOND
+    return row
+
+
+# Returns (list of the number of times, list of the sums of their offsets from the bucket's start) of the sorted times
+# within each bucket.
+def sum_by_bucket(times_us, bucket_starts_us, bucket_us):
+    time_sums_us = list(itertools.accumulate(itertools.chain([0], times_us)))
+    firsts = list(map(bisect.bisect_left, itertools.repeat(times_us), bucket_starts_us))
+    lasts = list(map(bisect.bisect_left, itertools.repeat(times_us),
+                     map(operator.add, bucket_starts_us, itertools.repeat(bucket_us))))
+    counts = list(map(operator.sub, lasts, firsts))
+    return counts, list(map(operator.sub,
+                            map(operator.sub, map(time_sums_us.__getitem__, lasts),
+                                map(time_sums_us.__getitem__, firsts)),
+                            map(operator.mul, counts, bucket_starts_us)))
+
+
+def little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+# Returns the header of a version 1.0 .npy file of an array with the dtype descr and shape, which its data follows in
+# C order.  See numpy.lib.format.
+def npy_header(descr, shape):
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': tuple(shape)})
+    # The magic string, version and header length take 10 bytes, and the data must start at a multiple of 64.
+    header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+# Returns a .npy file of a 1-d unicode array of the strings.
+def npy_strings(strings):
+    width = max([len(string) for string in strings] + [1])
+    data = b''.join(string.ljust(width, '\0').encode('utf-32-le') for string in strings)
+    return npy_header('<U{}'.format(width), (len(strings),)) + data
@@ -2,174 +2,397 @@
 # You could use Excel afterwards on the CSV to sort descending NumActivityStatusSuccessful.
 # Compare to the cloudwatch alarm history.
 
-import boto3.session
-from pathlib import Path
 from datetime import datetime, timedelta
 import pytz
 import re
+import functools
+import itertools
 import json
 import operator
-from report_eb_autoscaling_alarms import eb_by_resource, aws_cache, util
+from report_eb_autoscaling_alarms import eb_by_resource, aws_cache, aws_target, history_records, output_sink, \
+    time_windows, util
 
 MAX_PAGES = 10000
-_asg_client = None
+# http://docs.aws.amazon.com/AutoScaling/latest/APIReference/API_Activity.html
+FINAL_STATUS_CODES = ['Successful', 'Failed', 'Cancelled']
+# http://docs.aws.amazon.com/AutoScaling/latest/APIReference/API_DescribeAutoScalingGroups.html
+ASG_NAMES_PER_REQUEST = 50
+ASG_MAX_RECORDS = 100
+
+
+# Returns an iterator over the describe_scaling_activities paginated responses.  Pages are streamed to the cache as
+# they are fetched, and read back from the cache as the iterator is consumed.
+#
+# With incremental, a refresh of an already-cached ASG stops paginating once it reaches activities that are already
+# cached, since AWS returns the newest first.  See merge_new_activity_pages.
+#
+def get_scaling_activity_pages(asg_name, refresh_cache=False, incremental=False):
+    key = 'describe_scaling_activities-' + asg_name
+    if not aws_cache.should_refresh(key, refresh_cache):
+        activity_pages = aws_cache.cache_lookup_pages(key)
+        if activity_pages is not None:
+            return activity_pages
+    if incremental and aws_cache.has_key(key):
+        activity_pages = merge_new_activity_pages(asg_name, key)
+        if activity_pages is None:
+            aws_cache.cache_touch(key)
+            return aws_cache.cache_get_pages(key, False)
+    else:
+        activity_pages = paginate_scaling_activities(asg_name)
+    aws_cache.cache_put_pages(key, activity_pages)
+    return aws_cache.cache_get_pages(key, False)
 
 
-def init_client(profile_name, region_name):
-    asg_session = boto3.session.Session(profile_name=profile_name, region_name=region_name)
-    global _asg_client
-    _asg_client = asg_session.client('autoscaling')
+# Returns an iterator over the decoded ActivityRecords of this ASG's scaling activities (see history_records).  The
+# records are decoded from the activity pages only when the cached records are missing or out of date.
+def get_scaling_activity_records(asg_name, refresh_cache=False, incremental=False):
+    activity_pages = get_scaling_activity_pages(asg_name, refresh_cache, incremental)
+    return history_records.get_records('describe_scaling_activities-' + asg_name, activity_pages,
+                                       decode_activity_page, history_records.ActivityRecord)
 
 
-# Returns list of describe_scaling_activities paginated responses.
-def get_scaling_activity_pages(asg_name, refresh_cache=False):
-    key = 'describe_scaling_activities-' + asg_name
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key)
-    done = False
+def decode_activity_page(activity_page):
+    return [decode_activity(scaling_activity) for scaling_activity in activity_page['Activities']]
+
+
+# http://docs.aws.amazon.com/AutoScaling/latest/APIReference/API_Activity.html
+def decode_activity(scaling_activity):
+    m = re.match('^(Launching|Terminating)', scaling_activity['Description'])
+    if not m:
+        launch_or_term = history_records.ACTIVITY_OTHER
+    elif m.group(1) == 'Launching':
+        launch_or_term = history_records.ACTIVITY_LAUNCHING
+    else:
+        launch_or_term = history_records.ACTIVITY_TERMINATING
+    return history_records.ActivityRecord(scaling_activity['ActivityId'],
+                                          history_records.to_epoch_us(scaling_activity['StartTime']),
+                                          scaling_activity['StatusCode'],
+                                          launch_or_term,
+                                          extract_alarm_name(scaling_activity))
+
+
+# Fills the cache with describe_scaling_activities for each of the ASG names, fetching up to 'workers' ASGs at once.
+# ASGs already cached are skipped unless refresh_cache is set.
+def fetch_scaling_activity_pages(asg_names, refresh_cache=False, workers=1, incremental=False):
+    def fetch_one(asg_name):
+        get_scaling_activity_pages(asg_name, True, incremental)
+
+    to_fetch = []
+    for asg_name in asg_names:
+        key = 'describe_scaling_activities-' + asg_name
+        if aws_cache.should_refresh(key, refresh_cache) or not aws_cache.has_key(key):
+            to_fetch.append(asg_name)
+    if to_fetch:
+        print('Fetching scaling activities for {} ASGs with {} workers'.format(len(to_fetch), workers))
+        util.parallel_map(fetch_one, to_fetch, workers)
+
+
+# Makes the describe_scaling_activities requests, yielding each response as it arrives.  If given, is_done is called
+# with each response, and pagination stops early when it returns True.
+def paginate_scaling_activities(asg_name, is_done=None):
     next_token = None
-    activity_pages = []
-    while not done and len(activity_pages) < MAX_PAGES:
+    num_pages = 0
+    while num_pages < MAX_PAGES:
         if next_token:
-            history_page = _asg_client.describe_scaling_activities(AutoScalingGroupName=asg_name, NextToken=next_token)
+            history_page = aws_target.client('autoscaling').describe_scaling_activities(AutoScalingGroupName=asg_name, NextToken=next_token)
         else:
-            history_page = _asg_client.describe_scaling_activities(AutoScalingGroupName=asg_name)
-        activity_pages.append(history_page)
-        if 'NextToken' in history_page and history_page['NextToken']:
+            history_page = aws_target.client('autoscaling').describe_scaling_activities(AutoScalingGroupName=asg_name)
+        yield history_page
+        num_pages += 1
+        if is_done and is_done(history_page):
+            return
+        elif 'NextToken' in history_page and history_page['NextToken']:
             next_token = history_page['NextToken']
         else:
-            done = True
-    if len(activity_pages) == MAX_PAGES:
-        print('WARNING: {} results truncated at {} pages'.format(key, MAX_PAGES))
-    aws_cache.cache_put(key, activity_pages)
-    return activity_pages
+            return
+    print('WARNING: describe_scaling_activities-{} results truncated at {} pages'.format(asg_name, MAX_PAGES))
+
+
+# Fetches the activities newer than the cached ones, and returns an iterator over the cached pages with a new page of
+# those prepended.  Cached activities that were still in progress are replaced by their fresh version.  Only the new
+# and updated activities are held in memory; the cached pages are streamed.  Returns None if no activity is new or has
+# progressed, so that the cached pages, and their stamp, are left as they are, and the entry is only touched (see
+# aws_cache.cache_touch).
+#
+# Pagination stops at the first page that contains an already-cached activity, unless some cached in-progress
+# activity has not been seen again yet; those are older than the newest cached activity, so we keep paginating
+# until each of them has been seen (or the results run out).
+#
+def merge_new_activity_pages(asg_name, key):
+    cached_ids = set()
+    pending_ids = set()
+    pending_progress = {}  # activity id => (StatusCode, Progress) as cached
+    for activity_page in aws_cache.cache_get_pages(key, False):
+        for scaling_activity in activity_page['Activities']:
+            cached_ids.add(scaling_activity['ActivityId'])
+            if scaling_activity['StatusCode'] not in FINAL_STATUS_CODES:
+                pending_ids.add(scaling_activity['ActivityId'])
+                pending_progress[scaling_activity['ActivityId']] = activity_progress(scaling_activity)
+    new_activities = []
+    updated_activities = {}
+    reached_cached = False
+
+    def is_done(activity_page):
+        nonlocal reached_cached
+        for scaling_activity in activity_page['Activities']:
+            activity_id = scaling_activity['ActivityId']
+            if activity_id not in cached_ids:
+                new_activities.append(scaling_activity)
+                cached_ids.add(activity_id)
+            else:
+                reached_cached = True
+                if activity_id in pending_ids:
+                    if activity_progress(scaling_activity) != pending_progress[activity_id]:
+                        updated_activities[activity_id] = scaling_activity
+                    pending_ids.discard(activity_id)
+        return reached_cached and not pending_ids
+
+    for activity_page in paginate_scaling_activities(asg_name, is_done):
+        pass  # is_done collects the activities
+    print('Found {} new and {} updated scaling activities for {}'
+          .format(len(new_activities), len(updated_activities), asg_name))
+    if not new_activities and not updated_activities:
+        return None
+    new_pages = [{'Activities': new_activities}] if new_activities else []
+    return itertools.chain(new_pages, update_activity_pages(aws_cache.cache_get_pages(key, False),
+                                                            updated_activities))
+
+
+def activity_progress(scaling_activity):
+    return scaling_activity['StatusCode'], scaling_activity.get('Progress')
+
+
+# Yields the pages with any activities found in updated_activities (activity id => activity) replaced.
+def update_activity_pages(activity_pages, updated_activities):
+    for activity_page in activity_pages:
+        if updated_activities:
+            activity_page = dict(activity_page)
+            activity_page['Activities'] = [updated_activities.get(scaling_activity['ActivityId'], scaling_activity)
+                                           for scaling_activity in activity_page['Activities']]
+        yield activity_page
 
 
-# Returns list of describe_auto_scaling_groups paginated responses.
+# Returns the describe_auto_scaling_groups response for the one ASG, or None if AWS does not know about it.
 def get_asg(asg_name, refresh_cache=False):
-    key = 'describe_auto_scaling_groups-' + asg_name
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key)
-    asg = _asg_client.describe_auto_scaling_groups(AutoScalingGroupNames=[asg_name])
-    aws_cache.cache_put(key, asg)
-    return asg
+    return get_asgs([asg_name], refresh_cache).get(asg_name)
+
+
+# Returns a dict of asg name => describe_auto_scaling_groups response for that one ASG, which is also what is cached
+# under describe_auto_scaling_groups-<asg name>.
+#
+# The ASGs that need fetching are requested ASG_NAMES_PER_REQUEST at a time, with up to 'workers' requests at once,
+# and each batch response is split back into per-ASG cache entries.  An ASG that AWS does not know about (e.g. one
+# deleted since the env resources were cached) is left out of the result, and not cached, so it is asked for again
+# next time rather than remembered as missing.
+#
+def get_asgs(asg_names, refresh_cache=False, workers=1):
+    asgs = {}
+    to_fetch = []
+    for asg_name in asg_names:
+        if asg_name in asgs or asg_name in to_fetch:
+            continue
+        key = 'describe_auto_scaling_groups-' + asg_name
+        asg = None if aws_cache.should_refresh(key, refresh_cache) else aws_cache.cache_lookup(key)
+        # An entry without AutoScalingGroups is a miss cached by an older version, so fetch it again.
+        if asg is not None and asg['AutoScalingGroups']:
+            asgs[asg_name] = asg
+        else:
+            to_fetch.append(asg_name)
+    batches = [to_fetch[i:i + ASG_NAMES_PER_REQUEST] for i in range(0, len(to_fetch), ASG_NAMES_PER_REQUEST)]
+    for batch_asgs in util.parallel_map(describe_asg_batch, batches, workers):
+        for asg_name, asg in batch_asgs.items():
+            aws_cache.cache_put('describe_auto_scaling_groups-' + asg_name, asg)
+            asgs[asg_name] = asg
+    return asgs
+
+
+# Describes the named ASGs, paginating if need be, and returns a dict of asg name => single-ASG response, for those
+# ASGs that AWS knows about.
+def describe_asg_batch(asg_names):
+    asgs = {}
+    next_token = None
+    while True:
+        if next_token:
+            asg_page = aws_target.client('autoscaling').describe_auto_scaling_groups(AutoScalingGroupNames=asg_names,
+                                                                MaxRecords=ASG_MAX_RECORDS, NextToken=next_token)
+        else:
+            asg_page = aws_target.client('autoscaling').describe_auto_scaling_groups(AutoScalingGroupNames=asg_names,
+                                                                MaxRecords=ASG_MAX_RECORDS)
+        for asg in asg_page['AutoScalingGroups']:
+            asgs[asg['AutoScalingGroupName']] = {
+                'AutoScalingGroups': [asg],
+                'ResponseMetadata': asg_page.get('ResponseMetadata', {})
+            }
+        if 'NextToken' in asg_page and asg_page['NextToken']:
+            next_token = asg_page['NextToken']
+        else:
+            break
+    for asg_name in asg_names:
+        if asg_name not in asgs:
+            print('WARNING: ASG not found: {}'.format(asg_name))
+    return asgs
 
 
-def calc_and_write_scaling_activity_for_beanstalk_asgs(refresh_cache=False):
+# windows: list of time_windows.Window to write a CSV for each of, or None to write the one CSV of all the activities
+def calc_and_write_scaling_activity_for_beanstalk_asgs(refresh_cache=False, workers=1, incremental=False, jobs=1,
+                                                       windows=None):
     # refresh_cache applies here to asg and scaling_activity, but not envs, resources, or alarms (those are
     # refreshed at module start).
-    asg_env_pairs = lookup_beanstalk_asg_env_pairs(refresh_cache)
-    summary_rows = []
-    for asg_env_pair in asg_env_pairs:
-        asg, env_name = asg_env_pair['ASG']['AutoScalingGroups'][0], asg_env_pair['EnvName']
-        activity_pages = get_scaling_activity_pages(asg['AutoScalingGroupName'], refresh_cache)
-        summary_rows.append( calc_scaling_activity_one_asg(activity_pages, asg, env_name) )
-    write_scaling_activity_for_beanstalk_asgs(summary_rows)
-
-
-def write_scaling_activity_for_beanstalk_asgs(summary_rows):
-    util.ensure_path_exists(util.OUTPUT_DIR)
-    output_filename = Path(util.OUTPUT_DIR + '/asg_activities.csv')
-    with output_filename.open(mode='w', encoding='UTF-8') as output_file:
-        write_column_headers(output_file)
-        num_written = 0
-        for summary_row in summary_rows:
-            write_summary_row(summary_row, output_file)
-            num_written += 1
+    asg_env_pairs = [(asg_env_pair['ASG']['AutoScalingGroups'][0], asg_env_pair['EnvName'])
+                     for asg_env_pair in lookup_beanstalk_asg_env_pairs(refresh_cache, workers)]
+    if workers > 1 or jobs > 1:
+        # Fetch everything up front in parallel, then summarize from the cache in ASG order as usual.
+        fetch_scaling_activity_pages([asg['AutoScalingGroupName'] for asg, env_name in asg_env_pairs], refresh_cache,
+                                     workers, incremental)
+        refresh_cache = False
+    if jobs > 1:
+        # Worker processes summarize chunks of ASGs, each reading its ASGs' activities from the cache.
+        summary_rows = util.process_map_chunks(functools.partial(summarize_asg_chunk, now=datetime.now(pytz.utc),
+                                                                 windows=windows),
+                                               asg_env_pairs, jobs, aws_cache.init_worker,
+                                               (aws_cache.worker_config(),))
+    elif windows is None:
+        # Each ASG's row is written as soon as it is summarized.
+        summary_rows = (calc_scaling_activity_one_asg(get_scaling_activity_records(asg['AutoScalingGroupName'],
+                                                                                   refresh_cache, incremental),
+                                                      asg, env_name)
+                        for asg, env_name in asg_env_pairs)
+    else:
+        summary_rows = [calc_scaling_activity_in_windows(get_scaling_activity_records(asg['AutoScalingGroupName'],
+                                                                                      refresh_cache, incremental),
+                                                         asg, env_name, windows)
+                        for asg, env_name in asg_env_pairs]
+    if windows is None:
+        write_scaling_activity_for_beanstalk_asgs(summary_rows)
+    else:
+        for window_id, window in enumerate(windows):
+            write_scaling_activity_for_beanstalk_asgs([asg_rows[window_id] for asg_rows in summary_rows],
+                                                      window.output_name('asg_activities'))
+
+
+# Summarizes a chunk of (asg, env name) pairs whose activities are already cached.  Runs in a worker process with
+# --jobs.
+def summarize_asg_chunk(asg_env_pairs, now=None, windows=None):
+    if windows is not None:
+        return [calc_scaling_activity_in_windows(get_scaling_activity_records(asg['AutoScalingGroupName']), asg,
+                                                 env_name, windows, now)
+                for asg, env_name in asg_env_pairs]
+    return [calc_scaling_activity_one_asg(get_scaling_activity_records(asg['AutoScalingGroupName']), asg, env_name, now)
+            for asg, env_name in asg_env_pairs]
+
+
+COLUMNS = [
+    'ASGName',
+    'EnvName',
+    'ASGMin',
+    'ASGMax',
+    'ActivityMaxAge',
+    'NumActivity',
+    'NumActivityStatusSuccessful',
+    'NumActivityStatusFailed',
+    'NumActivityDescLaunching',
+    'NumActivityDescTerminating',
+    'NumAlarmsCauseLaunching',
+    'NumAlarmsCauseTerminating',
+    'NameAlarmsCauseLaunching',
+    'NameAlarmsCauseTerminating'
+]
+
+
+def write_scaling_activity_for_beanstalk_asgs(summary_rows, output_name='asg_activities'):
+    output_filename, num_written = output_sink.write_rows(output_name, COLUMNS, summary_rows)
     print('wrote scaling activity for {} ASGs into {}'.format(num_written, output_filename))
 
 
-def write_column_headers(output_file):
-    columns = [
-        'ASGName',
-        'EnvName',
-        'ASGMin',
-        'ASGMax',
-        'ActivityMaxAge',
-        'NumActivity',
-        'NumActivityStatusSuccessful',
-        'NumActivityStatusFailed',
-        'NumActivityDescLaunching',
-        'NumActivityDescTerminating',
-        'NumAlarmsCauseLaunching',
-        'NumAlarmsCauseTerminating',
-        'NameAlarmsCauseLaunching',
-        'NameAlarmsCauseTerminating'
-    ]
-    output_file.write(','.join(columns) + '\n')
-
-
-def write_summary_row(row, output_file):
-    columns = [
-        row['ASGName'],
-        row['EnvName'],
-        str(row['ASGMin']),
-        str(row['ASGMax']),
-        util.quote(row['ActivityMaxAge']),
-        str(row['NumActivity']),
-        str(row['NumActivityStatusSuccessful']),
-        str(row['NumActivityStatusFailed']),
-        str(row['NumActivityDescLaunching']),
-        str(row['NumActivityDescTerminating']),
-        str(row['NumAlarmsCauseLaunching']),
-        str(row['NumAlarmsCauseTerminating']),
-        util.quote(row['NameAlarmsCauseLaunching']),
-        util.quote(row['NameAlarmsCauseTerminating'])
-    ]
-    output_file.write(','.join(columns) + '\n')
-
-
-def lookup_beanstalk_asg_env_pairs(refresh_cache):
-    asg_env_pairs = []
+# Returns the ASGs of every beanstalk env, in env order.  The resource lookups fan out over up to 'workers'
+# concurrent requests, and the ASGs are then described in batches (see get_asgs).  ASGs that AWS does not know about
+# are left out, so each pair's ASG has exactly one AutoScalingGroups entry.
+def lookup_beanstalk_asg_env_pairs(refresh_cache, workers=1):
+    asg_name_env_pairs = []
     envs = eb_by_resource.get_envs()
-    for env in envs['Environments']:
-        env_name = env['EnvironmentName']
-        resources = eb_by_resource.get_resources(env_name)
+    for env_name, resources in eb_by_resource.get_all_resources(envs, False, workers):
         for asg_resource in resources['EnvironmentResources']['AutoScalingGroups']:
-            asg_name = asg_resource['Name']
-            asg = get_asg(asg_name, refresh_cache)
-            asg_env_pairs.append({
-                'ASG': asg,
-                'EnvName': env_name
-            })
-    return asg_env_pairs
+            asg_name_env_pairs.append((asg_resource['Name'], env_name))
+    asgs = get_asgs([asg_name for asg_name, env_name in asg_name_env_pairs], refresh_cache, workers)
+    return [{'ASG': asgs[asg_name], 'EnvName': env_name} for asg_name, env_name in asg_name_env_pairs
+            if asg_name in asgs]
 
 
 # Returns a summary of the asg and its scaling activity.
-def calc_scaling_activity_one_asg(activity_pages, asg, env_name):
-    far_in_the_future = pytz.utc.localize(datetime(2999, 12, 31))
-    oldest_start_time = far_in_the_future
+#
+# activity_records: iterable of history_records.ActivityRecord
+# now: datetime from which ActivityMaxAge is measured; default is the current time
+#
+def calc_scaling_activity_one_asg(activity_records, asg, env_name, now=None):
+    oldest_start_us = None
     total_activity_count = 0
     activity_counts = {'Successful': 0, 'Failed': 0, 'Launching': 0, 'Terminating': 0}
     alarm_causes = {'Launching': {}, 'Terminating': {}}
-    for activity_page in activity_pages:
-        for scaling_activity in activity_page['Activities']:
-
-            # http://docs.aws.amazon.com/AutoScaling/latest/APIReference/API_Activity.html
-
-            total_activity_count += 1
-
-            start_time = util.ensure_tz(scaling_activity['StartTime'])
-            if start_time < oldest_start_time:
-                oldest_start_time = start_time
-
-            status_code = scaling_activity['StatusCode']
-            if status_code == 'Successful' or status_code == 'Failed':
-                increment_activity_count(activity_counts, status_code)
-
-            alarm_name = extract_alarm_name(scaling_activity)
-
-            m = re.match('^(Launching|Terminating)', scaling_activity['Description'])
-            if m:
-                launch_or_term = m.group(1)
-                increment_activity_count(activity_counts, launch_or_term)
-                increment_alarm_causes(alarm_causes, launch_or_term, alarm_name)
-
-    if oldest_start_time == far_in_the_future:
+    for record in activity_records:
+        total_activity_count += 1
+
+        if oldest_start_us is None or record.start_us < oldest_start_us:
+            oldest_start_us = record.start_us
+
+        if record.status_code == 'Successful' or record.status_code == 'Failed':
+            increment_activity_count(activity_counts, record.status_code)
+
+        if record.launch_or_term != history_records.ACTIVITY_OTHER:
+            launch_or_term = 'Launching' if record.launch_or_term == history_records.ACTIVITY_LAUNCHING \
+                else 'Terminating'
+            increment_activity_count(activity_counts, launch_or_term)
+            increment_alarm_causes(alarm_causes, launch_or_term, record.alarm_name)
+
+    now = now or datetime.now(pytz.utc)
+    return summarize_asg(asg, env_name, history_records.to_epoch_us(now), oldest_start_us, total_activity_count,
+                         activity_counts, alarm_causes)
+
+
+# Returns a list of summaries of the asg and its scaling activity, one for each of the windows.  The activities are
+# indexed by start time, so each window is counted by binary search.
+#
+# activity_records: iterable of history_records.ActivityRecord
+# windows: list of time_windows.Window
+# now: datetime from which ActivityMaxAge is measured, unless a window ends earlier; default is the current time
+#
+def calc_scaling_activity_in_windows(activity_records, asg, env_name, windows, now=None):
+    activity_index = time_windows.EventIndex()
+    for record in activity_records:
+        activity_index.add('All', record.start_us)
+        if record.status_code == 'Successful' or record.status_code == 'Failed':
+            activity_index.add(record.status_code, record.start_us)
+        if record.launch_or_term != history_records.ACTIVITY_OTHER:
+            launch_or_term = 'Launching' if record.launch_or_term == history_records.ACTIVITY_LAUNCHING \
+                else 'Terminating'
+            activity_index.add(launch_or_term, record.start_us)
+            activity_index.add((launch_or_term, record.alarm_name), record.start_us)
+    activity_index.sort()
+
+    now_us = history_records.to_epoch_us(now or datetime.now(pytz.utc))
+    summaries = []
+    for window in windows:
+        activity_counts = {key: activity_index.count(key, window)
+                           for key in ['Successful', 'Failed', 'Launching', 'Terminating']}
+        alarm_causes = {'Launching': {}, 'Terminating': {}}
+        for group in activity_index.groups():
+            if isinstance(group, tuple):
+                count = activity_index.count(group, window)
+                if count:
+                    launch_or_term, alarm_name = group
+                    alarm_causes[launch_or_term][alarm_name] = count
+        summaries.append(summarize_asg(asg, env_name, window.end_us(now_us), activity_index.earliest('All', window),
+                                       activity_index.count('All', window), activity_counts, alarm_causes))
+    return summaries
+
+
+# now_us: int microseconds since the epoch, from which ActivityMaxAge is measured
+# oldest_start_us: int microseconds since the epoch of the oldest activity, or None if there were none
+#
+def summarize_asg(asg, env_name, now_us, oldest_start_us, total_activity_count, activity_counts, alarm_causes):
+    if oldest_start_us is None:
         activity_max_age = timedelta(0)
     else:
-        now = datetime.now(oldest_start_time.tzinfo)
-        activity_max_age = now - oldest_start_time
+        activity_max_age = timedelta(microseconds=now_us - oldest_start_us)
 
     num_alarms_launching, name_alarms_launching = summarize_alarm_causes(alarm_causes, 'Launching')
     num_alarms_terminating, name_alarms_terminating = summarize_alarm_causes(alarm_causes, 'Terminating')
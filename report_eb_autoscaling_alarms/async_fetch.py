@@ -0,0 +1,115 @@
+# Fills the cache for every object type as one overlapped set of requests, on a single asyncio event loop.
+#
+# The boto3 clients are blocking, so each fetch runs the module's usual getter (get_envs, get_resources,
+# get_alarm_pages, get_history_pages, get_asgs, get_scaling_activity_pages) on a thread pool, awaited from the event
+# loop.  A semaphore per service caps how many of that service's getters are in flight at once, so each of
+# CloudWatch, Auto Scaling and Elastic Beanstalk sees at most that many concurrent requests, independently of the
+# others.  Each fetch starts as soon as what it depends on is cached: the alarm histories once the alarms are, and
+# meanwhile the env resources, then the ASGs and their scaling activities.
+#
+# The getters decide as usual whether to use the cache or fetch (recache, --refresh-stale), and write the same cache
+# entries, so the CSVs written afterwards are the same as with the sync path.
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from report_eb_autoscaling_alarms import asg_describe_scaling, cw_describe_alarm_history, cw_describe_alarms, \
+    eb_by_resource
+
+SERVICES = ['cloudwatch', 'autoscaling', 'elasticbeanstalk']
+
+
+class FetchEngine:
+
+    # concurrency: int: max getters in flight per service
+    def __init__(self, loop, concurrency=1):
+        self.loop = loop
+        self.semaphores = {service: asyncio.Semaphore(concurrency) for service in SERVICES}
+        # One more thread for the local work done by run
+        self.executor = ThreadPoolExecutor(max_workers=concurrency * len(SERVICES) + 1)
+
+    # Runs fn(*args) on the thread pool once the service has a free slot, and returns its result.
+    async def call(self, service, fn, *args):
+        async with self.semaphores[service]:
+            return await self.run(fn, *args)
+
+    # Runs fn(*args) on the thread pool, outside of any service limit, e.g. to read the cache without blocking the
+    # event loop.  fn runs in a copy of the calling task's context, so it sees the same aws_target.
+    async def run(self, fn, *args):
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# Fills the cache for the object types that the CSVs in write_csv need, refreshing those in recache, as __main__
+# does with refresh_cache and write_csvs but with all the requests overlapped.
+#
+# recache: list of string: object types
+# write_csv: list of string: CSV names, and 'cw_alarm_timeline' for alarm_timeline
+# concurrency: int: max concurrent requests per service
+# incremental: bool: refresh cached history by fetching only what is new
+#
+def fill_cache(recache, write_csv, concurrency=1, incremental=False):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(fill_all(loop, recache, write_csv, concurrency, incremental))
+    finally:
+        loop.close()
+
+
+async def fill_all(loop, recache, write_csv, concurrency, incremental):
+    engine = FetchEngine(loop, concurrency)
+    try:
+        await asyncio.gather(
+            fill_envs_and_scaling(engine, recache, 'asg_activities' in write_csv or 'alarm_scaling' in write_csv,
+                                  incremental),
+            fill_alarms_and_history(engine, recache,
+                                    'cw_alarm_history' in write_csv or 'cw_alarm_timeline' in write_csv
+                                    or 'alarm_scaling' in write_csv, incremental, 'cw_alarms' in write_csv))
+    finally:
+        engine.close()
+
+
+async def fill_envs_and_scaling(engine, recache, with_scaling, incremental):
+    refresh_resources = 'resources' in recache
+    envs = await engine.call('elasticbeanstalk', eb_by_resource.get_envs, 'envs' in recache or refresh_resources)
+    all_resources = await asyncio.gather(*[
+        engine.call('elasticbeanstalk', eb_by_resource.get_resources, env['EnvironmentName'], refresh_resources)
+        for env in envs['Environments']])
+    if not with_scaling:
+        return
+
+    asg_names = []
+    for resources in all_resources:
+        for asg_resource in resources['EnvironmentResources']['AutoScalingGroups']:
+            if asg_resource['Name'] not in asg_names:
+                asg_names.append(asg_resource['Name'])
+    refresh_scaling = 'scaling' in recache
+    batch_size = asg_describe_scaling.ASG_NAMES_PER_REQUEST
+    asg_fetches = [engine.call('autoscaling', asg_describe_scaling.get_asgs, asg_names[i:i + batch_size],
+                               refresh_scaling)
+                   for i in range(0, len(asg_names), batch_size)]
+    activity_fetches = [engine.call('autoscaling', asg_describe_scaling.get_scaling_activity_pages, asg_name,
+                                    refresh_scaling, incremental)
+                        for asg_name in asg_names]
+    await asyncio.gather(*(asg_fetches + activity_fetches))
+
+
+# With server-side filtering, the full list of alarms is only fetched if all_alarms are needed.
+async def fill_alarms_and_history(engine, recache, with_history, incremental, all_alarms=True):
+    if all_alarms or not cw_describe_alarm_history.server_side_filter:
+        await engine.call('cloudwatch', cw_describe_alarms.get_alarm_pages, 'alarms' in recache)
+    if not with_history:
+        return
+
+    # With server-side filtering, this fetches the report's alarms if they are not cached.
+    alarms = await engine.call('cloudwatch', cw_describe_alarm_history.get_report_alarms,
+                               'alarms' in recache and cw_describe_alarm_history.server_side_filter and not all_alarms)
+    refresh_history = 'alarm_history' in recache
+    await asyncio.gather(*[
+        engine.call('cloudwatch', cw_describe_alarm_history.get_history_pages, alarm['AlarmName'], refresh_history,
+                    incremental)
+        for alarm in alarms])
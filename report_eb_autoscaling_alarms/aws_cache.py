@@ -1,37 +1,346 @@
-# The cache consists of files whose path is of the form "<cache_dir>/<key>.json".
-# If the cache dir does not exist, we create it on the first put action.
+# The cache stores AWS responses by key, in one of the backends from cache_backends:
+#   'file' (default): files whose path is of the form "<cache_dir>/<key>.json".
+#   'sqlite': a single SQLite file at cache_db, holding compressed compact JSON.
+# Call init_backend to choose; otherwise the file backend is used.  A worker process opens the same cache with
+# init_worker(worker_config()).
+#
+# Each aws_target has a cache of its own, in the dir (or sqlite file) above for the default target, or in the
+# subdir (or a file in the subdir) named by the target's namespace.  Every function here works on the current
+# target's cache.
+#
+# Reads go through an in-process memo of decoded values, so an entry read many times in one run (describe_alarms,
+# describe_environment_resources-*) is parsed once.  A memo entry is reused only while the backend's stamp for the key
+# (size and mtime, or size and fetched_at) is unchanged, and is dropped when this process puts or deletes the key.
+# The memo is bounded by MEMO_MAX_BYTES of stored entry size, evicting least recently used entries first.
+#
+# Values returned by cache_get and cache_lookup may be shared with other callers, so treat them as read-only.
+#
+# Paginated responses (describe_alarms, describe_alarm_history-*, describe_scaling_activities-*) go through
+# cache_put_pages and cache_lookup_pages instead, which stream the pages to and from the backend one at a time and
+# bypass the memo, so that the memory needed does not grow with the number of pages.
+#
+# Each entry's fetch time is recorded by the backend.  With init_ttls(refresh_stale=True), should_refresh also says
+# yes for entries older than the TTL of their object type, so only the expired keys are refetched.  An incremental
+# refresh that finds nothing new calls cache_touch rather than rewriting the entry, which makes it fresh again without
+# changing its stamp.  Every key that is refetched or served from the cache is noted for write_refresh_report.
+#
+# With run_stats enabled (--stats), lookups and backend reads and writes are counted there by object type.
 
-import json
-from pathlib import Path
-from lib.json_datetime import DateTimeEncoder, DateTimeDecoder
-from report_eb_autoscaling_alarms import util
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import pytz
+from report_eb_autoscaling_alarms import aws_target, cache_backends, output_sink, run_stats
 
 cache_dir = './cache'
+cache_db = './cache.sqlite'
+BACKEND_NAMES = ['file', 'sqlite']
+MEMO_MAX_BYTES = 256 * 1024 * 1024
+_memo = OrderedDict()  # (backend, key) => (stamp, value), least recently used first
+_memo_bytes = 0
+_memo_lock = threading.RLock()
+memo_counts = {'hits': 0, 'misses': 0, 'evictions': 0}
 
+# Cache key prefix (see cache_backends.object_type) => the object type named on the command line.
+OBJECT_TYPES = {
+    'describe_environments': 'envs',
+    'describe_environment_resources': 'resources',
+    'describe_alarms': 'alarms',
+    'describe_alarm_history': 'alarm_history',
+    'describe_auto_scaling_groups': 'scaling',
+    'describe_scaling_activities': 'scaling'
+}
+# Object type => seconds an entry stays fresh, when refreshing stale entries.
+DEFAULT_TTLS = {
+    'envs': 24 * 3600,
+    'resources': 24 * 3600,
+    'alarms': 3600,
+    'alarm_history': 3600,
+    'scaling': 3600
+}
+ttls = dict(DEFAULT_TTLS)
+_refresh_stale = False
+_refresh_report_lock = threading.Lock()
 
-# Updates the cache on disk with the given value.
+
+# Chooses the backend of the current target's cache.
+def init_backend(backend_name='file'):
+    if backend_name not in BACKEND_NAMES:
+        raise ValueError('Unknown cache backend {}, expected one of {}'.format(backend_name, BACKEND_NAMES))
+    target = aws_target.current()
+    with target.lock:
+        target.backend_name = backend_name
+        target.cache_backend = None
+    memo_clear()
+
+
+# Returns what a worker process needs to open the same cache as this one, for the current target, to pass to
+# init_worker.
+def worker_config():
+    target = aws_target.current()
+    return (target.profile_name, target.region_name, target.endpoint_url, target.namespace, target.backend_name,
+            cache_dir, cache_db)
+
+
+# Initializes the cache in a worker process (see util.process_map_chunks), making the target of worker_config the
+# worker's default target.  Workers only read what this process has already fetched, so stale entries are not
+# refreshed there.  A forked worker gets a backend of its own rather than sharing the parent's sqlite connections.
+def init_worker(config):
+    global cache_dir, cache_db
+    profile_name, region_name, endpoint_url, namespace, backend_name, cache_dir, cache_db = config
+    aws_target.set_default(aws_target.Target(profile_name, region_name, endpoint_url, namespace))
+    init_backend(backend_name)
+    init_ttls()
+
+
+def make_backend(backend_name, namespace=None):
+    if backend_name == 'file':
+        return cache_backends.FileCacheBackend(cache_dir + '/' + namespace if namespace else cache_dir)
+    elif backend_name == 'sqlite':
+        if namespace:
+            return cache_backends.SqliteCacheBackend('{}/{}.sqlite'.format(cache_dir, namespace))
+        return cache_backends.SqliteCacheBackend(cache_db)
+    raise ValueError('Unknown cache backend {}, expected one of {}'.format(backend_name, BACKEND_NAMES))
+
+
+def get_backend():
+    target = aws_target.current()
+    with target.lock:
+        if target.cache_backend is None:
+            target.cache_backend = make_backend(target.backend_name, target.namespace)
+        return target.cache_backend
+
+
+# ttl_overrides: dict of object type => seconds, replacing those DEFAULT_TTLS
+# refresh_stale: bool: whether should_refresh is true for expired entries
+#
+def init_ttls(ttl_overrides=None, refresh_stale=False):
+    global ttls, _refresh_stale
+    ttls = dict(DEFAULT_TTLS)
+    ttls.update(ttl_overrides or {})
+    _refresh_stale = refresh_stale
+    with _refresh_report_lock:
+        get_refresh_report().clear()
+
+
+# Returns True if the caller should fetch key from AWS rather than use the cache: because refresh_cache is set, or
+# because we are refreshing stale entries and this one has outlived its TTL.  (A key that is not cached at all is
+# fetched regardless, when cache_lookup returns None.)
+def should_refresh(key, refresh_cache=False):
+    if refresh_cache:
+        return True
+    if not _refresh_stale:
+        return False
+    ttl = ttls.get(OBJECT_TYPES.get(cache_backends.object_type(key)))
+    if ttl is None:
+        return False
+    fetched_at = get_backend().fetched_at(key)
+    return fetched_at is not None and time.time() - fetched_at > ttl
+
+
+# Updates the cache with the given value.
 def cache_put(key, value):
-    util.ensure_path_exists(cache_dir)
-    cfile = Path('{}/{}.json'.format(cache_dir, key))
-    if cfile.is_file():
+    if get_backend().has_key(key):
         print('Updating existing cache entry for {}'.format(key))
     else:
         print('New cache entry for {}'.format(key))
-    with cfile.open(mode='w', encoding='UTF-8') as f:
-        json.dump(value, f, indent=4, sort_keys=True, cls=DateTimeEncoder)
+    memo_discard(key)
+    get_backend().put(key, value)
+    note_refresh(key, 'refreshed')
+    if run_stats.enabled:
+        note_written(key)
+
+
+# Updates the cache with the given iterable of pages, consuming it one page at a time.
+def cache_put_pages(key, pages):
+    if get_backend().has_key(key):
+        print('Updating existing cache entry for {}'.format(key))
+    else:
+        print('New cache entry for {}'.format(key))
+    memo_discard(key)
+    if run_stats.enabled:
+        pages = run_stats.count_pages(cache_backends.object_type(key), 'pages_written', pages)
+    get_backend().put_pages(key, pages)
+    note_refresh(key, 'refreshed')
+    if run_stats.enabled:
+        note_written(key)
+
+
+# Records that key was just fetched again and found unchanged.  The entry is fresh again for should_refresh, and its
+# stamp stays the same, so the memo and anything decoded from the entry (see history_records) stay current.
+def cache_touch(key):
+    print('Cache entry for {} is up to date'.format(key))
+    get_backend().touch(key)
+    note_refresh(key, 'refreshed')
 
 
 def cache_get(key, verbose=True):
-    cfile = Path('{}/{}.json'.format(cache_dir, key))
-    if cfile.is_file():
+    value = cache_lookup(key, verbose)
+    if value is None:
+        print('ERROR: object is not cached: {}'.format(key))
+    return value
+
+
+# Like cache_get, but a missing key is not an error.  Returns None if the key is not cached.  This is one stamp check
+# plus at most one backend read, so prefer it to has_key followed by cache_get.
+def cache_lookup(key, verbose=True):
+    value = memo_get(key)
+    if value is not None:
+        note_refresh(key, 'served')
+        if verbose:
+            print('Found cache entry for {}'.format(key))
+    if run_stats.enabled:
+        run_stats.note_cache(cache_backends.object_type(key), **{'hits' if value is not None else 'misses': 1})
+    return value
+
+
+# Returns an iterator over the cached pages for key, which reads them as it is consumed, or None if the key is not
+# cached.
+def cache_lookup_pages(key, verbose=True):
+    pages = get_backend().get_pages(key)
+    if pages is not None:
+        note_refresh(key, 'served')
         if verbose:
             print('Found cache entry for {}'.format(key))
-        with cfile.open() as f:
-            return json.load(f, cls=DateTimeDecoder)
-    print('ERROR: object is not cached: {}'.format(key))
-    return None
+    if run_stats.enabled:
+        pages = note_pages_read(key, pages)
+    return pages
+
+
+def cache_get_pages(key, verbose=True):
+    pages = cache_lookup_pages(key, verbose)
+    if pages is None:
+        print('ERROR: object is not cached: {}'.format(key))
+    return pages
+
+
+# Returns the backend stamp for key (see cache_backends), or None if the key is not cached.
+def cache_stamp(key):
+    return get_backend().stamp(key)
+
+
+# Returns the epoch seconds when key was fetched, or None if the key is not cached.
+def cache_fetched_at(key):
+    return get_backend().fetched_at(key)
+
+
+def cache_delete(key):
+    memo_discard(key)
+    if get_backend().has_key(key):
+        print('Deleting cache entry for {}'.format(key))
+        get_backend().delete(key)
 
 
 def has_key(key):
-    cfile = Path('{}/{}.json'.format(cache_dir, key))
-    return cfile.is_file()
+    return get_backend().has_key(key)
+
+
+# Returns the decoded value for key from the memo if its stamp is current, else reads it from the backend and
+# memoizes it.  Returns None if the key is not cached.
+def memo_get(key):
+    global _memo_bytes
+    backend = get_backend()
+    memo_key = (backend, key)
+    stamp = backend.stamp(key)
+    with _memo_lock:
+        if stamp is None:
+            memo_discard(key)
+            return None
+        if memo_key in _memo and _memo[memo_key][0] == stamp:
+            _memo.move_to_end(memo_key)
+            memo_counts['hits'] += 1
+            return _memo[memo_key][1]
+        memo_counts['misses'] += 1
+    value = backend.get(key)
+    if value is None:
+        return None
+    size = stamp[0]
+    if run_stats.enabled:
+        run_stats.note_cache(cache_backends.object_type(key), entries_read=1, bytes_read=size)
+    with _memo_lock:
+        memo_discard(key)
+        if size <= MEMO_MAX_BYTES:
+            _memo[memo_key] = (stamp, value)
+            _memo_bytes += size
+            while _memo_bytes > MEMO_MAX_BYTES:
+                evicted_key, (evicted_stamp, evicted_value) = _memo.popitem(last=False)
+                _memo_bytes -= evicted_stamp[0]
+                memo_counts['evictions'] += 1
+    return value
+
+
+def memo_discard(key):
+    global _memo_bytes
+    memo_key = (get_backend(), key)
+    with _memo_lock:
+        if memo_key in _memo:
+            stamp, value = _memo.pop(memo_key)
+            _memo_bytes -= stamp[0]
+
+
+def memo_clear():
+    global _memo_bytes
+    with _memo_lock:
+        _memo.clear()
+        _memo_bytes = 0
+
+
+# Counts the entry just written for key in run_stats, with its size.
+def note_written(key):
+    stamp = get_backend().stamp(key)
+    run_stats.note_cache(cache_backends.object_type(key), entries_written=1, bytes_written=stamp[0] if stamp else 0)
+
+
+# Counts a lookup of the pages of key in run_stats, as a hit or miss, and returns the pages, counted as they are read.
+# The bytes read are the size of the whole entry.
+def note_pages_read(key, pages):
+    object_type = cache_backends.object_type(key)
+    if pages is None:
+        run_stats.note_cache(object_type, misses=1)
+        return None
+    stamp = get_backend().stamp(key)
+    run_stats.note_cache(object_type, hits=1, entries_read=1, bytes_read=stamp[0] if stamp else 0)
+    return run_stats.count_pages(object_type, 'pages_read', pages)
+
+
+def print_memo_counts():
+    print('cache memo: {} hits, {} misses, {} evictions, {} entries ({} bytes) held'
+          .format(memo_counts['hits'], memo_counts['misses'], memo_counts['evictions'], len(_memo), _memo_bytes))
+
+
+# Notes that key was refetched from AWS ('refreshed') or used from the cache ('served').  Only the AWS object types
+# are noted, and refreshed wins over served.
+def note_refresh(key, outcome):
+    if cache_backends.object_type(key) in OBJECT_TYPES:
+        refresh_report = get_refresh_report()
+        with _refresh_report_lock:
+            if refresh_report.get(key) != 'refreshed':
+                refresh_report[key] = outcome
+
+
+# Returns the current target's dict of key => 'refreshed' or 'served'.
+def get_refresh_report():
+    return aws_target.current().get_state('refresh_report', dict)
+
+
+# Writes a CSV of the keys refreshed or served from the cache in this run, with their object type and fetch time.
+def write_refresh_report():
+    refresh_report = get_refresh_report()
+    num_refreshed = sum(1 for outcome in refresh_report.values() if outcome == 'refreshed')
+    output_filename, num_written = output_sink.write_rows('cache_refresh_report',
+                                                          ['Key', 'ObjectType', 'Outcome', 'FetchedAt'],
+                                                          refresh_report_rows(refresh_report))
+    print('refreshed {} cache entries and served {} from the cache, listed in {}'
+          .format(num_refreshed, len(refresh_report) - num_refreshed, output_filename))
+
+
+def refresh_report_rows(refresh_report):
+    for key, outcome in sorted(refresh_report.items()):
+        fetched_at = get_backend().fetched_at(key)
+        yield {
+            'Key': key,
+            'ObjectType': OBJECT_TYPES[cache_backends.object_type(key)],
+            'Outcome': outcome,
+            'FetchedAt': str(datetime.fromtimestamp(fetched_at, pytz.utc)) if fetched_at is not None else ''
+        }
@@ -0,0 +1,293 @@
+# Stand-ins for the boto3 clients, to drive the fetch code offline, e.g. to tune --workers and pagination or to see how
+# it behaves under throttling (see bench_fetch --replay).
+#
+# RecordingClient wraps a real client and appends every response to a recording, one JSON line per call:
+#   {"service": ..., "operation": ..., "params": {...}, "response": {...}}
+# __main__ --record-aws writes one for each target.
+#
+# ReplayClient answers the calls from ReplayData, which is loaded from a recording, or from a cache dir or sqlite file
+# (e.g. one written by synthetic_fleet, or by a real run): a cache holds the same responses, by object.  The items of
+# each paginated response are joined up and served again in pages of the replay's page size, with NextTokens of its
+# own, and the request parameters that filter items (AutoScalingGroupNames, AlarmNames, AlarmNamePrefix,
+# HistoryItemType, StartDate, EndDate) are applied, so a replay need not make exactly the recorded calls.
+#
+# Every call can be made to take a given latency, and to be throttled with a given probability, or whenever calls of its
+# operation come faster than a given rate, as AWS's API rate limits do.  A throttled call is retried after an
+# exponential backoff, as botocore does: each throttled attempt is emitted as a needs-retry event on the client's
+# meta.events, and the response's RetryAttempts says how many times; a call still throttled after max_attempts raises a
+# Throttling ClientError.
+
+import json
+import random
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+from lib.json_datetime import DateTimeEncoder, DateTimeDecoder
+from report_eb_autoscaling_alarms import cache_backends, util
+
+RECORDING_FILE_NAME = 'aws_recording.jsonl'
+
+# Operation => (service, the parameter that names the object described or None, the list of items in the response
+# or None if it is not paginated).
+OPERATIONS = {
+    'describe_environments': ('elasticbeanstalk', None, None),
+    'describe_environment_resources': ('elasticbeanstalk', 'EnvironmentName', None),
+    'describe_alarms': ('cloudwatch', None, 'MetricAlarms'),
+    'describe_alarm_history': ('cloudwatch', 'AlarmName', 'AlarmHistoryItems'),
+    'describe_auto_scaling_groups': ('autoscaling', None, 'AutoScalingGroups'),
+    'describe_scaling_activities': ('autoscaling', 'AutoScalingGroupName', 'Activities')
+}
+# AWS's default page size of each paginated operation, used unless the request or the replay sets one.
+DEFAULT_PAGE_SIZES = {
+    'describe_alarms': 50,
+    'describe_alarm_history': 100,
+    'describe_auto_scaling_groups': 50,
+    'describe_scaling_activities': 100
+}
+# Request parameters that set the page size.
+PAGE_SIZE_PARAMS = ['MaxRecords', 'MaxItems']
+# Request parameters that select some of the items (see filter_items).
+FILTER_PARAMS = ['AlarmNames', 'AlarmNamePrefix', 'HistoryItemType', 'StartDate', 'EndDate']
+# Operation => the time of its items, newest first
+ITEM_TIMES = {'describe_alarm_history': 'Timestamp', 'describe_scaling_activities': 'StartTime'}
+
+
+class RecordingClient:
+
+    # lock: threading.Lock held while appending to the recording file, shared by the clients writing to it
+    def __init__(self, service_name, client, recording_filename, lock):
+        self.service_name = service_name
+        self.client = client
+        self.recording_filename = recording_filename
+        self.lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in OPERATIONS:
+            return attr
+
+        def record_call(**params):
+            response = attr(**params)
+            line = json.dumps({'service': self.service_name, 'operation': name, 'params': params,
+                               'response': response}, separators=(',', ':'), sort_keys=True, cls=DateTimeEncoder)
+            with self.lock:
+                with open(self.recording_filename, mode='a', encoding='UTF-8') as recording_file:
+                    recording_file.write(line + '\n')
+            return response
+
+        return record_call
+
+
+# Makes the target's clients record all their responses into the recording file in recording_dir, or in its subdir
+# named by the target's namespace.  Returns the recording file name.
+def record_target(target, recording_dir):
+    recording_dir = recording_dir + '/' + target.namespace if target.namespace else recording_dir
+    util.ensure_path_exists(recording_dir)
+    recording_filename = recording_dir + '/' + RECORDING_FILE_NAME
+    lock = threading.Lock()
+    for service_name in set(service for service, name_param, items_name in OPERATIONS.values()):
+        target.set_client(service_name, RecordingClient(service_name, target.client(service_name), recording_filename,
+                                                        lock))
+    print('recording AWS responses for {} into {}'.format(target, recording_filename))
+    return recording_filename
+
+
+class ReplayData:
+
+    def __init__(self):
+        # (operation, name or None) => list of items for a paginated operation, or the response otherwise.
+        # describe_auto_scaling_groups items are kept in a dict by ASG name instead.
+        self.responses = {}
+
+    # Adds the response to a call, after any earlier pages of the same pagination.  A call without a NextToken starts
+    # the items over, so a later recording of the same object replaces an earlier one, except that a call that
+    # selects some of the items (e.g. an incremental fetch with a StartDate) adds those not recorded yet.
+    def add_response(self, operation, params, response):
+        service, name_param, items_name = OPERATIONS[operation]
+        key = (operation, params.get(name_param) if name_param else None)
+        if items_name is None:
+            self.responses[key] = response
+        elif operation == 'describe_auto_scaling_groups':
+            asgs = self.responses.setdefault(key, {})
+            for asg in response[items_name]:
+                asgs[asg['AutoScalingGroupName']] = asg
+        elif any(param in params for param in FILTER_PARAMS):
+            items = self.responses.setdefault(key, [])
+            recorded_ids = set(map(item_id, items))
+            items.extend(item for item in response[items_name] if item_id(item) not in recorded_ids)
+            if operation in ITEM_TIMES:
+                items.sort(key=lambda item: util.ensure_tz(item[ITEM_TIMES[operation]]), reverse=True)
+        elif 'NextToken' in params:
+            self.responses.setdefault(key, []).extend(response[items_name])
+        else:
+            self.responses[key] = list(response[items_name])
+
+    # Returns the recorded items or response of the call, or None if there are none.
+    def lookup(self, operation, name):
+        value = self.responses.get((operation, name))
+        if operation == 'describe_auto_scaling_groups' and value is not None:
+            return list(value.values())
+        return value
+
+    def __len__(self):
+        return len(self.responses)
+
+
+def item_id(item):
+    return json.dumps(item, sort_keys=True, cls=DateTimeEncoder)
+
+
+# Returns ReplayData from a recording file, or a cache: a dir (file backend) or a .sqlite file.
+def load_replay_data(path):
+    if Path(path).is_dir():
+        return load_cache(cache_backends.FileCacheBackend(path))
+    elif path.endswith('.sqlite'):
+        return load_cache(cache_backends.SqliteCacheBackend(path))
+    return load_recording(path)
+
+
+def load_recording(recording_filename):
+    data = ReplayData()
+    with open(recording_filename, encoding='UTF-8') as recording_file:
+        for line in recording_file:
+            call = json.loads(line, cls=DateTimeDecoder)
+            data.add_response(call['operation'], call['params'], call['response'])
+    print('loaded {} AWS objects to replay from {}'.format(len(data), recording_filename))
+    return data
+
+
+# Loads the AWS responses in a cache backend; the other entries (records-*, eb_resource_index, ...) are skipped.
+def load_cache(backend):
+    data = ReplayData()
+    for key in backend.keys():
+        operation, sep, name = key.partition('-')
+        # An entry fetched with a server-side filter, like describe_alarms@AlarmNamePrefix=awseb, adds its items
+        operation, sep, filter_tag = operation.partition('@')
+        if operation not in OPERATIONS:
+            continue
+        name_param = OPERATIONS[operation][1]
+        params = {name_param: name} if name_param else {}
+        if filter_tag:
+            params.update(param.split('=', 1) for param in filter_tag.split('&'))
+        # A paged entry gets as the list of its pages
+        value = backend.get(key)
+        for page_num, page in enumerate(value if isinstance(value, list) else [value]):
+            data.add_response(operation, dict(params, NextToken=page_num) if page_num else params, page)
+    print('loaded {} AWS objects to replay from the cache'.format(len(data)))
+    return data
+
+
+class ReplayClient:
+
+    # data: ReplayData
+    # latency: float: seconds each call takes
+    # throttle_rate: float: probability that an attempt is throttled
+    # max_rate: float: calls per second of each operation above which attempts are throttled, or None for no limit
+    # page_size: int: items per page of paginated responses, or None for AWS's defaults
+    # max_attempts: int: attempts at a throttled call before giving up, as botocore's retry config
+    # seed: random seed for the throttling and backoff
+    #
+    def __init__(self, service_name, data, latency=0.0, throttle_rate=0.0, max_rate=None, page_size=None,
+                 max_attempts=5, seed=None):
+        self.service_name = service_name
+        self.data = data
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_rate = max_rate
+        self.buckets = {}  # Operation => [tokens, time of last refill], for max_rate
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS or OPERATIONS[name][0] != self.service_name:
+            raise AttributeError('{} replay client has no operation {}'.format(self.service_name, name))
+        return lambda **params: self.call(name, params)
+
+    def call(self, operation, params):
+        attempt = 0
+        while True:
+            if self.latency:
+                time.sleep(self.latency)
+            if not self.is_throttled(operation):
+                break
+            self.meta.events.emit('needs-retry.{}.{}'.format(self.service_name, operation),
+                                  response=(None, {'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}),
+                                  attempts=attempt + 1, caught_exception=None)
+            attempt += 1
+            if attempt >= self.max_attempts:
+                raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'},
+                                   'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': attempt - 1}},
+                                  operation)
+            time.sleep(self.backoff(attempt))
+        response = self.respond(operation, params)
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': attempt}
+        return response
+
+    def is_throttled(self, operation):
+        with self.random_lock:
+            if self.max_rate:
+                # A token bucket holding up to a second's worth of calls
+                now = time.monotonic()
+                bucket = self.buckets.setdefault(operation, [self.max_rate, now])
+                bucket[0] = min(self.max_rate, bucket[0] + (now - bucket[1]) * self.max_rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    return True
+                bucket[0] -= 1
+            return self.throttle_rate and self.random.random() < self.throttle_rate
+
+    # Seconds to wait before retry number attempt: up to 2 ** attempt tenths of a second, like botocore's legacy mode.
+    def backoff(self, attempt):
+        with self.random_lock:
+            return self.random.random() * 0.1 * 2 ** attempt
+
+    def respond(self, operation, params):
+        service, name_param, items_name = OPERATIONS[operation]
+        name = params.get(name_param) if name_param else None
+        recorded = self.data.lookup(operation, name)
+        if items_name is None:
+            if recorded is None:
+                raise ClientError({'Error': {'Code': 'InvalidParameterValue',
+                                             'Message': 'No recorded {} for {}'.format(operation, name)}}, operation)
+            return dict(recorded)
+        items = filter_items(recorded or [], params)
+        page_size = next((params[p] for p in PAGE_SIZE_PARAMS if p in params), None) or self.page_size or \
+            DEFAULT_PAGE_SIZES[operation]
+        start = int(params['NextToken'].rpartition('-')[2]) if params.get('NextToken') else 0
+        response = {items_name: items[start:start + page_size]}
+        if start + page_size < len(items):
+            response['NextToken'] = 'replay-{}'.format(start + page_size)
+        return response
+
+
+# Returns the items that the request parameters select.
+def filter_items(items, params):
+    if 'AutoScalingGroupNames' in params:
+        asg_names = set(params['AutoScalingGroupNames'])
+        items = [item for item in items if item['AutoScalingGroupName'] in asg_names]
+    if 'AlarmNames' in params:
+        alarm_names = set(params['AlarmNames'])
+        items = [item for item in items if item['AlarmName'] in alarm_names]
+    if 'AlarmNamePrefix' in params:
+        items = [item for item in items if item['AlarmName'].startswith(params['AlarmNamePrefix'])]
+    if 'HistoryItemType' in params:
+        items = [item for item in items if item['HistoryItemType'] == params['HistoryItemType']]
+    if 'StartDate' in params:
+        start_date = util.ensure_tz(params['StartDate'])
+        items = [item for item in items if util.ensure_tz(item['Timestamp']) >= start_date]
+    if 'EndDate' in params:
+        end_date = util.ensure_tz(params['EndDate'])
+        items = [item for item in items if util.ensure_tz(item['Timestamp']) <= end_date]
+    return items
+
+
+# Makes the target's clients replay the data, with the given ReplayClient options.
+def replay_target(target, data, **replay_options):
+    for service_name in set(service for service, name_param, items_name in OPERATIONS.values()):
+        target.set_client(service_name, ReplayClient(service_name, data, **replay_options))
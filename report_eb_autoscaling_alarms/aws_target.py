@@ -0,0 +1,101 @@
+# A target is one AWS account (--aws-profile) and region to report on.  Everything that belongs to a target, i.e. its
+# boto3 clients, its cache backend and the per-target state of other modules, hangs off a Target object, and the
+# target being worked on is held in a context variable.  So several targets can be reported on at once in one
+# process: each thread (see util.parallel_map) or asyncio task sees the target it was started with.
+#
+# Code that runs outside of run() gets the default target, which is what a single-target run uses.  A target with a
+# namespace, like 'prod/us-east-1', has its cache and output in a subdir of that name (see aws_cache.get_backend and
+# util.output_dir); the default target has none, so its cache and output are the usual ./cache and ./output.
+#
+# A target has one session and one client per service, shared by all modules and threads, with a connection pool big
+# enough for the number of concurrent requests (--workers).  client() hands them out rate limited per API operation
+# (see rate_limit), and instrumented if run_stats is enabled.
+
+import contextvars
+import threading
+import boto3.session
+import botocore.config
+from report_eb_autoscaling_alarms import rate_limit, run_stats
+
+# botocore's default
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+class Target:
+
+    # profile_name, region_name: as for boto3.session.Session; None means boto3's default
+    # endpoint_url: URL to send all requests to instead of AWS, e.g. a local stand-in; or None
+    # namespace: subdir of the cache and output dirs for this target, or None for the dirs themselves
+    # max_pool_connections: size of each client's connection pool, at least the number of concurrent requests
+    #
+    def __init__(self, profile_name=None, region_name=None, endpoint_url=None, namespace=None,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+        self.profile_name = profile_name
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self.namespace = namespace
+        self.max_pool_connections = max_pool_connections
+        self.backend_name = 'file'
+        self.cache_backend = None  # Made on first use by aws_cache.get_backend
+        self.state = {}  # Per-target state of other modules, by name
+        self.lock = threading.RLock()
+        self._session = None
+        self._clients = {}
+
+    # Returns this target's client for the service, e.g. 'cloudwatch', creating it on first use.  boto3 clients are
+    # thread-safe, but sessions are not, so the clients are created under the lock.
+    def client(self, service_name):
+        with self.lock:
+            if service_name not in self._clients:
+                if self._session is None:
+                    self._session = boto3.session.Session(profile_name=self.profile_name, region_name=self.region_name)
+                config = botocore.config.Config(max_pool_connections=self.max_pool_connections)
+                self._clients[service_name] = self._session.client(service_name, endpoint_url=self.endpoint_url,
+                                                                   config=config)
+            return self._clients[service_name]
+
+    # Uses the given object as this target's client for the service, e.g. a stand-in for testing.
+    def set_client(self, service_name, client):
+        with self.lock:
+            self._clients[service_name] = client
+
+    # Returns the per-target state of the given name, first setting it to default() if there is none yet.
+    def get_state(self, name, default):
+        with self.lock:
+            if name not in self.state:
+                self.state[name] = default()
+            return self.state[name]
+
+    def __repr__(self):
+        return 'Target({}, {})'.format(self.profile_name, self.region_name)
+
+
+_default_target = Target()
+_current_target = contextvars.ContextVar('aws_target', default=None)
+
+
+def current():
+    target = _current_target.get()
+    return _default_target if target is None else target
+
+
+def set_default(target):
+    global _default_target
+    _default_target = target
+
+
+# Calls fn(*args) with target as the current target, and returns its result.  The current target of the caller is
+# unaffected.
+def run(target, fn, *args):
+    return contextvars.copy_context().run(_run_with, target, fn, args)
+
+
+def _run_with(target, fn, args):
+    _current_target.set(target)
+    return fn(*args)
+
+
+# Returns the current target's client for the service, rate limited, and instrumented if run_stats is enabled.
+def client(service_name):
+    target = current()
+    return rate_limit.limit(target, service_name, run_stats.instrument(service_name, target.client(service_name)))
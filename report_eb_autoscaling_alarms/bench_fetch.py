@@ -0,0 +1,113 @@
+# Times filling an empty cache for all the CSVs, first the sync way (the getters as a normal run calls them, with
+# --workers) and then with async_fetch, and prints the wall-clock times and speedup.  Point it at a local stand-in to
+# run offline, e.g. with moto:
+#
+#   moto_server -p 5000 &
+#   python -m report_eb_autoscaling_alarms.bench_fetch --aws-endpoint-url http://127.0.0.1:5000 --workers 8
+#
+# Or replay a recording (__main__ --record-aws) or a cache (e.g. from synthetic_fleet) with aws_replay, with a latency
+# and throttling rate of your choosing:
+#
+#   python -m report_eb_autoscaling_alarms.bench_fetch --replay ./synthetic/cache --replay-latency 0.05 \
+#     --replay-throttle-rate 0.1 --workers 8
+#
+# Each run fills a fresh temporary cache dir, which is deleted afterwards.
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_replay, aws_target, async_fetch, \
+    cw_describe_alarm_history, cw_describe_alarms, eb_by_resource
+
+ALL_OBJECT_TYPES = ['envs', 'resources', 'alarms', 'alarm_history', 'scaling']
+ALL_CSVS = ['cw_alarms', 'cw_alarm_history', 'asg_activities']
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        prog='report_eb_autoscaling_alarms.bench_fetch',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Compares the time to fill an empty cache with the sync getters and with async_fetch.'
+    )
+    parser.add_argument('--aws-profile', help='Profile name in your AWS credentials file.', default='default')
+    parser.add_argument('--aws-region', help='AWS Region to query.', default='us-west-2')
+    parser.add_argument('--aws-endpoint-url', help='Send all AWS requests to this URL, e.g. a local moto_server.',
+                        default=None)
+    parser.add_argument('--workers', help='Concurrent requests: --workers for the sync fill, and per service for ' +
+                        'the async fill.', type=int, default=1)
+    parser.add_argument('--replay', help='Instead of AWS, replay this recording file (__main__ --record-aws) or ' +
+                        'cache dir or .sqlite file.', default=None)
+    parser.add_argument('--replay-latency', help='Seconds each replayed call takes.', type=float, default=0.0)
+    parser.add_argument('--replay-throttle-rate', help='Probability that a replayed call is throttled (and retried).',
+                        type=float, default=0.0)
+    parser.add_argument('--replay-max-rate', help='Calls per second of each replayed API operation above which ' +
+                        'calls are throttled, like an AWS rate limit.', type=float, default=None)
+    parser.add_argument('--replay-page-size', help='Items per page of replayed paginated responses; by default ' +
+                        'AWS\'s default page size of each operation.', type=int, default=None)
+    parser.add_argument('--replay-seed', help='Random seed of the replay throttling.', type=int, default=1)
+    parser.add_argument('--repeat', help='Number of timed fills of each kind; the median is reported.',
+                        type=int, default=3)
+    return parser.parse_args()
+
+
+# Fills the cache the way refresh_cache and write_csvs do, one object type after another.
+def fill_sync(workers):
+    envs = eb_by_resource.get_envs(True)
+    eb_by_resource.get_all_resources(envs, True, workers)
+    cw_describe_alarms.get_alarm_pages(True)
+    alarms = cw_describe_alarm_history.get_report_alarms()
+    cw_describe_alarm_history.fetch_history_pages([alarm['AlarmName'] for alarm in alarms], True, workers)
+    asg_env_pairs = asg_describe_scaling.lookup_beanstalk_asg_env_pairs(True, workers)
+    asg_names = [asg_env_pair['ASG']['AutoScalingGroups'][0]['AutoScalingGroupName'] for asg_env_pair in asg_env_pairs]
+    asg_describe_scaling.fetch_scaling_activity_pages(asg_names, True, workers)
+
+
+def fill_async(workers):
+    async_fetch.fill_cache(ALL_OBJECT_TYPES, ALL_CSVS, workers)
+
+
+# Returns the wall-clock seconds of fill(workers) into an empty cache.
+def time_fill(fill, workers):
+    saved_cache_dir = aws_cache.cache_dir
+    aws_cache.cache_dir = tempfile.mkdtemp(prefix='bench_fetch_cache.')
+    try:
+        aws_cache.init_backend('file')
+        eb_by_resource.invalidate_resource_index()
+        start = time.perf_counter()
+        fill(workers)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(aws_cache.cache_dir)
+        aws_cache.cache_dir = saved_cache_dir
+        aws_cache.init_backend('file')
+
+
+def run_bench(workers, repeat):
+    results = []
+    for name, fill in (('sync', fill_sync), ('async', fill_async)):
+        seconds = statistics.median(time_fill(fill, workers) for _ in range(repeat))
+        results.append((name, seconds))
+    return results
+
+
+def print_results(results, workers):
+    sync_seconds = results[0][1]
+    print('{:<8}{:>10}{:>10}'.format('fill', 'seconds', 'speedup'))
+    for name, seconds in results:
+        print('{:<8}{:>10.3f}{:>9.2f}x'.format(name, seconds, sync_seconds / seconds))
+    print('(workers = {})'.format(workers))
+
+
+if __name__ == '__main__':
+    options = parse()
+    aws_target.set_default(aws_target.Target(options.aws_profile, options.aws_region, options.aws_endpoint_url,
+                                             max_pool_connections=max(aws_target.DEFAULT_MAX_POOL_CONNECTIONS,
+                                                                      options.workers)))
+    if options.replay:
+        aws_replay.replay_target(aws_target.current(), aws_replay.load_replay_data(options.replay),
+                                 latency=options.replay_latency, throttle_rate=options.replay_throttle_rate,
+                                 max_rate=options.replay_max_rate, page_size=options.replay_page_size,
+                                 seed=options.replay_seed)
+    print_results(run_bench(options.workers, options.repeat), options.workers)
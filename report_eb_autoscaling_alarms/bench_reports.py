@@ -0,0 +1,155 @@
+# Times the three reports on a cache written by synthetic_fleet (or any cache, e.g. a copy of a real one), fully
+# offline, and prints the wall-clock time and peak memory of each:
+#
+#   python -m report_eb_autoscaling_alarms.synthetic_fleet --cache-dir ./synthetic/cache --envs 500
+#   python -m report_eb_autoscaling_alarms.bench_reports --cache-dir ./synthetic/cache --repeat 5 \
+#     --output-json bench.json
+#
+# The cache is copied to a temporary dir first, so the fixture is never modified, and nothing is fetched: every entry
+# the reports need must already be in it.  The first run of each report is "cold": it also decodes the raw history
+# pages and caches them as records-* entries.  The following runs are "warm", reading those records, and their median
+# is reported.  Every run starts with an empty memo.
+#
+# Peak memory is measured in one more run, with tracemalloc, so its overhead does not skew the times.  It counts only
+# this process, not the worker processes of --jobs; the max RSS of those is reported separately.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_target, cw_describe_alarm_history, \
+    cw_describe_alarms, util
+
+STAGE_NAMES = ['cw_alarms', 'cw_alarm_history', 'asg_activities']
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        prog='report_eb_autoscaling_alarms.bench_reports',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Times writing the CSVs from a cache, e.g. one written by synthetic_fleet.'
+    )
+    parser.add_argument('--cache-backend', choices=aws_cache.BACKEND_NAMES, default='file')
+    parser.add_argument('--cache-dir', help='Cache dir to read, for the file backend.', default='./synthetic/cache')
+    parser.add_argument('--cache-db', help='SQLite file to read, for the sqlite backend.',
+                        default='./synthetic/cache.sqlite')
+    parser.add_argument('--workers', help='As for the reports.', type=int, default=1)
+    parser.add_argument('--jobs', help='As for the reports.', type=int, default=1)
+    parser.add_argument('--repeat', help='Number of timed runs of each report, the first of them cold.',
+                        type=int, default=3)
+    parser.add_argument('--output-json', help='Also write the results to this JSON file.', default=None)
+    return parser.parse_args()
+
+
+# Writes the CSV of the named stage, as write_csvs in __main__ does without any recache.
+def run_stage(stage_name, workers, jobs):
+    if stage_name == 'cw_alarms':
+        cw_describe_alarms.write_alarms()
+    elif stage_name == 'cw_alarm_history':
+        cw_describe_alarm_history.calc_and_write_alarm_history_for_eb_autoscaling(False, workers, False, jobs)
+    elif stage_name == 'asg_activities':
+        asg_describe_scaling.calc_and_write_scaling_activity_for_beanstalk_asgs(False, workers, False, jobs)
+
+
+# Runs all the stages once, from an empty memo and target state, and returns a dict of stage name => seconds, or of
+# stage name => peak bytes allocated with trace_memory.  The reports' progress output is discarded.
+def run_stages(workers, jobs, trace_memory=False):
+    aws_cache.memo_clear()
+    aws_target.current().state.clear()
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for stage_name in STAGE_NAMES:
+            if trace_memory:
+                tracemalloc.start()
+                run_stage(stage_name, workers, jobs)
+                results[stage_name] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                start = time.perf_counter()
+                run_stage(stage_name, workers, jobs)
+                results[stage_name] = time.perf_counter() - start
+    return results
+
+
+# Copies the cache of the options to a temporary dir, and points aws_cache and util.OUTPUT_DIR there until the end of
+# the with block, so that the options' cache is never modified.
+@contextlib.contextmanager
+def copied_cache(options):
+    saved_cache_dir, saved_cache_db, saved_output_dir = aws_cache.cache_dir, aws_cache.cache_db, util.OUTPUT_DIR
+    temp_dir = tempfile.mkdtemp(prefix='bench_reports.')
+    try:
+        if options.cache_backend == 'sqlite':
+            aws_cache.cache_db = temp_dir + '/cache.sqlite'
+            shutil.copyfile(options.cache_db, aws_cache.cache_db)
+        else:
+            aws_cache.cache_dir = temp_dir + '/cache'
+            shutil.copytree(options.cache_dir, aws_cache.cache_dir)
+        util.OUTPUT_DIR = temp_dir + '/output'
+        aws_cache.init_backend(options.cache_backend)
+        yield
+    finally:
+        aws_cache.cache_dir, aws_cache.cache_db, util.OUTPUT_DIR = saved_cache_dir, saved_cache_db, saved_output_dir
+        aws_cache.init_backend(options.cache_backend)
+        shutil.rmtree(temp_dir)
+
+
+# Runs the benchmark on a copy of the options' cache.  Returns a dict of the parameters and results, ready for json.
+def run_bench(options):
+    with copied_cache(options):
+        runs = [run_stages(options.workers, options.jobs) for _ in range(max(options.repeat, 1))]
+        peak_bytes = run_stages(options.workers, options.jobs, trace_memory=True)
+
+    stages = []
+    for stage_name in STAGE_NAMES:
+        warm_seconds = [run[stage_name] for run in runs[1:]]
+        stages.append({
+            'stage': stage_name,
+            'cold_seconds': runs[0][stage_name],
+            'warm_median_seconds': statistics.median(warm_seconds) if warm_seconds else None,
+            'warm_min_seconds': min(warm_seconds) if warm_seconds else None,
+            'peak_traced_bytes': peak_bytes[stage_name]
+        })
+    return {
+        'cache': options.cache_db if options.cache_backend == 'sqlite' else options.cache_dir,
+        'cache_backend': options.cache_backend,
+        'workers': options.workers,
+        'jobs': options.jobs,
+        'repeat': options.repeat,
+        'python': platform.python_version(),
+        'stages': stages,
+        # ru_maxrss is in KiB on Linux
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'max_rss_children_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    }
+
+
+def print_results(results):
+    print('{:<16}{:>12}{:>14}{:>12}{:>14}'.format('stage', 'cold secs', 'warm median', 'warm min', 'peak MiB'))
+    for stage in results['stages']:
+        print('{:<16}{:>12.3f}{:>14}{:>12}{:>14.1f}'.format(
+            stage['stage'], stage['cold_seconds'], format_seconds(stage['warm_median_seconds']),
+            format_seconds(stage['warm_min_seconds']), stage['peak_traced_bytes'] / 2 ** 20))
+    print('(cache = {}, backend = {}, workers = {}, jobs = {}, max RSS = {:.1f} MiB, of --jobs workers = {:.1f} MiB)'
+          .format(results['cache'], results['cache_backend'], results['workers'], results['jobs'],
+                  results['max_rss_kib'] / 1024, results['max_rss_children_kib'] / 1024))
+
+
+def format_seconds(seconds):
+    return '-' if seconds is None else '{:.3f}'.format(seconds)
+
+
+if __name__ == '__main__':
+    options = parse()
+    bench_results = run_bench(options)
+    print_results(bench_results)
+    if options.output_json:
+        with open(options.output_json, 'w', encoding='UTF-8') as json_file:
+            json.dump(bench_results, json_file, indent=2)
+        print('wrote {}'.format(options.output_json))
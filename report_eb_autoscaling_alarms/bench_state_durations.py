@@ -0,0 +1,88 @@
+# Times how much of the cw_alarm_history report is spent summing the time in each state (see state_durations), on a
+# cache written by synthetic_fleet, fully offline:
+#
+#   python -m report_eb_autoscaling_alarms.synthetic_fleet --cache-dir ./synthetic/cache --envs 200 \
+#     --history-items 2000
+#   python -m report_eb_autoscaling_alarms.bench_state_durations --cache-dir ./synthetic/cache --repeat 5
+#
+# Each run reads every alarm's history records, summarizes them as the report does, and then sums the state intervals
+# once more on their own, with StateDurations.sum_by_alarm.  The share printed is that sum's time over the time to
+# read and summarize.  As in bench_reports, the cache is copied to a temporary dir first, the first run is cold (it
+# decodes the raw history pages into records-* entries) and the following runs are warm.
+#
+# This is what tells whether vectorizing the sums (which would need NumPy) would pay off: on 400 alarms with 2000
+# history items each, the sums were 7% of a warm run and well under 1% of a cold one.
+
+import argparse
+import contextlib
+import os
+import statistics
+import time
+from datetime import datetime
+import pytz
+from report_eb_autoscaling_alarms import aws_cache, aws_target, bench_reports, cw_describe_alarm_history, \
+    cw_describe_alarms, history_records, state_durations
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        prog='report_eb_autoscaling_alarms.bench_state_durations',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Times summing the alarm state durations against the rest of the cw_alarm_history report.'
+    )
+    parser.add_argument('--cache-backend', choices=aws_cache.BACKEND_NAMES, default='file')
+    parser.add_argument('--cache-dir', help='Cache dir to read, for the file backend.', default='./synthetic/cache')
+    parser.add_argument('--cache-db', help='SQLite file to read, for the sqlite backend.',
+                        default='./synthetic/cache.sqlite')
+    parser.add_argument('--repeat', help='Number of timed runs, the first of them cold.', type=int, default=3)
+    return parser.parse_args()
+
+
+# Runs the report's steps once, from an empty memo and target state, and returns a dict of step name => seconds, and
+# the number of intervals summed.
+def run_once():
+    aws_cache.memo_clear()
+    aws_target.current().state.clear()
+    now = datetime.now(pytz.utc)
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        alarms = cw_describe_alarm_history.get_report_alarms()
+        dimensions = [cw_describe_alarms.get_alarm_dimension(alarm) for alarm in alarms]
+
+        start = time.perf_counter()
+        alarm_records = [list(cw_describe_alarm_history.get_history_records(alarm['AlarmName'])) for alarm in alarms]
+        results['records'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cw_describe_alarm_history.summarize_alarms_and_history(alarms, alarm_records, now, dimensions=dimensions)
+        results['summarize'] = time.perf_counter() - start
+
+        durations = state_durations.StateDurations(len(alarms))
+        for alarm_id, (alarm, records) in enumerate(zip(alarms, alarm_records)):
+            for record in records:
+                if record.kind == history_records.KIND_STATE_UPDATE:
+                    durations.add_state_update(alarm_id, record)
+            cw_describe_alarm_history.add_current_state(durations, alarm_id, alarm, now, alarm['AlarmName'])
+        start = time.perf_counter()
+        durations.sum_by_alarm()
+        results['sum_by_alarm'] = time.perf_counter() - start
+    return results, len(durations.groups)
+
+
+def print_results(runs, num_intervals):
+    print('{:<8}{:>12}{:>12}{:>14}{:>10}'.format('run', 'records', 'summarize', 'sum_by_alarm', 'share'))
+    for run_id, run in enumerate(runs):
+        print('{:<8}{:>12.3f}{:>12.3f}{:>14.4f}{:>9.1f}%'.format(
+            'cold' if run_id == 0 else 'warm', run['records'], run['summarize'], run['sum_by_alarm'],
+            100 * run['sum_by_alarm'] / (run['records'] + run['summarize'])))
+    warm_sums = [run['sum_by_alarm'] for run in runs[1:]]
+    if warm_sums:
+        print('(warm median sum_by_alarm = {:.4f} secs over {} intervals)'
+              .format(statistics.median(warm_sums), num_intervals))
+
+
+if __name__ == '__main__':
+    options = parse()
+    with bench_reports.copied_cache(options):
+        bench_runs = [run_once() for _ in range(max(options.repeat, 1))]
+    print_results([run for run, num_intervals in bench_runs], bench_runs[-1][1])
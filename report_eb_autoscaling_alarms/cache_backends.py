@@ -0,0 +1,297 @@
+# Storage backends for aws_cache.  Each backend stores one JSON-serializable value per string key, and supports
+#   put(key, value)
+#   get(key): the value, or None if the key is not cached
+#   put_pages(key, pages): stores an iterable of paginated responses one page at a time, as they are produced
+#   get_pages(key): an iterator over the pages, read as it is consumed; or None if the key is not cached
+#   has_key(key)
+#   delete(key)
+#   keys(): all cached keys
+#   stamp(key): a value that changes whenever the entry is rewritten, starting with its size in bytes; or None if the
+#       key is not cached
+#   fetched_at(key): epoch seconds when the entry was last fetched, or None if the key is not cached
+#   touch(key): records that the entry was fetched again just now and found unchanged, without rewriting it, so that
+#       its fetched_at is now and its stamp stays the same
+#
+# get and get_pages both work whichever way the entry was put: get on a paged entry returns the list of pages, and
+# get_pages on a plain entry iterates over its (list) value.  So caches written before paged entries existed still
+# read fine.
+#
+# FileCacheBackend is the original layout: one pretty-printed "<cache_dir>/<key>.json" file per key, or for paged
+# entries "<cache_dir>/<key>.jsonl" with one compact page per line.  The cache dir is created on the first put.  Puts
+# are atomic: the value is written to a temp file in the cache dir and renamed over the entry, so a crashed run (or a
+# concurrent reader) never sees a half-written entry.  An entry is fetched when it is written, so its mtime is its
+# fetch time, unless it was touched since: touch leaves the entry's mtime, which is part of its stamp, alone, and
+# sets the mtime of an empty "<cache_dir>/.<key>.fetched" file instead.
+#
+# SqliteCacheBackend keeps every entry in a single SQLite file, as zlib-compressed compact JSON, with the key, the
+# object type (the key up to the first '-', e.g. 'describe_alarm_history'), the time it was written, the time it was
+# last fetched (the same, unless it was touched since) and its uncompressed size.  The pages of a paged entry are rows
+# of their own in cache_pages.
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from lib.json_datetime import DateTimeEncoder, DateTimeDecoder
+from report_eb_autoscaling_alarms import util
+
+
+class FileCacheBackend:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return Path('{}/{}.json'.format(self.cache_dir, key))
+
+    def pages_path(self, key):
+        return Path('{}/{}.jsonl'.format(self.cache_dir, key))
+
+    def fetched_path(self, key):
+        return Path('{}/.{}.fetched'.format(self.cache_dir, key))
+
+    # Returns the path of the existing entry for key, or None.
+    def entry_path(self, key):
+        for cfile in (self.pages_path(key), self.path(key)):
+            if cfile.is_file():
+                return cfile
+        return None
+
+    def put(self, key, value):
+        self.write_atomic(self.path(key), lambda f: json.dump(value, f, indent=4, sort_keys=True, cls=DateTimeEncoder))
+        self.unlink(self.pages_path(key))
+
+    def put_pages(self, key, pages):
+        def write_pages(f):
+            for page in pages:
+                f.write(json.dumps(page, separators=(',', ':'), sort_keys=True, cls=DateTimeEncoder) + '\n')
+
+        self.write_atomic(self.pages_path(key), write_pages)
+        self.unlink(self.path(key))
+
+    def write_atomic(self, cfile, write):
+        util.ensure_path_exists(self.cache_dir)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, prefix='.{}.'.format(cfile.name), suffix='.tmp')
+        try:
+            with open(fd, mode='w', encoding='UTF-8') as f:
+                write(f)
+            os.replace(tmp_name, str(cfile))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def get(self, key):
+        cfile = self.entry_path(key)
+        if cfile is None:
+            return None
+        if cfile.suffix == '.jsonl':
+            return list(self.read_pages(cfile))
+        try:
+            with cfile.open(encoding='UTF-8') as f:
+                return json.load(f, cls=DateTimeDecoder)
+        except FileNotFoundError:
+            return None
+
+    def get_pages(self, key):
+        cfile = self.entry_path(key)
+        if cfile is None:
+            return None
+        if cfile.suffix == '.jsonl':
+            return self.read_pages(cfile)
+        value = self.get(key)
+        return None if value is None else iter(value)
+
+    def read_pages(self, cfile):
+        with cfile.open(encoding='UTF-8') as f:
+            for line in f:
+                yield json.loads(line, cls=DateTimeDecoder)
+
+    def has_key(self, key):
+        return self.entry_path(key) is not None
+
+    def stamp(self, key):
+        cfile = self.entry_path(key)
+        try:
+            stat = cfile.stat() if cfile else None
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns) if stat else None
+
+    def fetched_at(self, key):
+        stamp = self.stamp(key)
+        if stamp is None:
+            return None
+        try:
+            return max(stamp[1], self.fetched_path(key).stat().st_mtime_ns) / 1e9
+        except FileNotFoundError:
+            return stamp[1] / 1e9
+
+    def touch(self, key):
+        self.fetched_path(key).touch()
+
+    def delete(self, key):
+        self.unlink(self.path(key))
+        self.unlink(self.pages_path(key))
+        self.unlink(self.fetched_path(key))
+
+    def unlink(self, cfile):
+        try:
+            cfile.unlink()
+        except FileNotFoundError:
+            pass  # Already gone, e.g. deleted concurrently by another thread
+
+    def keys(self):
+        cache_path = Path(self.cache_dir)
+        if not cache_path.is_dir():
+            return []
+        return sorted(set(cfile.stem for cfile in cache_path.iterdir()
+                          if cfile.suffix in ('.json', '.jsonl') and not cfile.name.startswith('.')))
+
+    def is_paged(self, key):
+        return self.pages_path(key).is_file()
+
+
+class SqliteCacheBackend:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    # sqlite3 connections cannot be shared across threads, so each thread gets its own.
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+        return conn
+
+    def connect(self):
+        util.ensure_path_exists(os.path.dirname(self.db_path))
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # data is null for a paged entry, whose pages are in cache_pages.
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_entries ('
+                     'key TEXT PRIMARY KEY, '
+                     'type TEXT NOT NULL, '
+                     'fetched_at REAL NOT NULL, '
+                     'size INTEGER NOT NULL, '
+                     'data BLOB, '
+                     'written_at REAL)')
+        # A cache from before entries could be touched has no written_at, so the fetch time is when it was written.
+        if 'written_at' not in [row[1] for row in conn.execute('PRAGMA table_info(cache_entries)')]:
+            try:
+                with conn:
+                    conn.execute('ALTER TABLE cache_entries ADD COLUMN written_at REAL')
+                    conn.execute('UPDATE cache_entries SET written_at = fetched_at')
+            except sqlite3.OperationalError:
+                pass  # Added concurrently by another connection
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_entries_type ON cache_entries (type)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_pages ('
+                     'key TEXT NOT NULL, '
+                     'seq INTEGER NOT NULL, '
+                     'data BLOB NOT NULL, '
+                     'PRIMARY KEY (key, seq))')
+        conn.commit()
+        return conn
+
+    def put(self, key, value, fetched_at=None):
+        raw = json.dumps(value, separators=(',', ':'), cls=DateTimeEncoder).encode('UTF-8')
+        conn = self.connection()
+        with conn:
+            conn.execute('DELETE FROM cache_pages WHERE key = ?', (key,))
+            conn.execute('INSERT OR REPLACE INTO cache_entries (key, type, fetched_at, size, data, written_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, object_type(key), fetched_at or time.time(), len(raw), zlib.compress(raw), time.time()))
+
+    # Pages are committed one at a time under a temporary key, then swapped in for key in one transaction, so
+    # neither a long pagination nor a crash holds up or corrupts other readers and writers.
+    def put_pages(self, key, pages, fetched_at=None):
+        tmp_key = '{}\0{}'.format(key, uuid.uuid4().hex)
+        conn = self.connection()
+        size = 0
+        try:
+            for seq, page in enumerate(pages):
+                raw = json.dumps(page, separators=(',', ':'), cls=DateTimeEncoder).encode('UTF-8')
+                size += len(raw)
+                with conn:
+                    conn.execute('INSERT INTO cache_pages (key, seq, data) VALUES (?, ?, ?)',
+                                 (tmp_key, seq, zlib.compress(raw)))
+            with conn:
+                conn.execute('DELETE FROM cache_pages WHERE key = ?', (key,))
+                conn.execute('UPDATE cache_pages SET key = ? WHERE key = ?', (key, tmp_key))
+                conn.execute('INSERT OR REPLACE INTO cache_entries (key, type, fetched_at, size, data, written_at) '
+                             'VALUES (?, ?, ?, ?, NULL, ?)',
+                             (key, object_type(key), fetched_at or time.time(), size, time.time()))
+        except BaseException:
+            with conn:
+                conn.execute('DELETE FROM cache_pages WHERE key = ?', (tmp_key,))
+            raise
+
+    def get(self, key):
+        row = self.connection().execute('SELECT data FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] is None:
+            return list(self.read_pages(key))
+        return decode(row[0])
+
+    def get_pages(self, key):
+        row = self.connection().execute('SELECT data FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] is None:
+            return self.read_pages(key)
+        return iter(decode(row[0]))
+
+    # Reads on a connection of its own, so that the caller can put to the cache while still iterating (e.g. to merge
+    # new pages into this same entry).
+    def read_pages(self, key):
+        conn = self.connect()
+        try:
+            for row in conn.execute('SELECT data FROM cache_pages WHERE key = ? ORDER BY seq', (key,)):
+                yield decode(row[0])
+        finally:
+            conn.close()
+
+    def has_key(self, key):
+        return self.connection().execute('SELECT 1 FROM cache_entries WHERE key = ?', (key,)).fetchone() is not None
+
+    def stamp(self, key):
+        row = self.connection().execute('SELECT size, written_at FROM cache_entries WHERE key = ?',
+                                        (key,)).fetchone()
+        return None if row is None else tuple(row)
+
+    def fetched_at(self, key):
+        row = self.connection().execute('SELECT fetched_at FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def touch(self, key):
+        conn = self.connection()
+        with conn:
+            conn.execute('UPDATE cache_entries SET fetched_at = ? WHERE key = ?', (time.time(), key))
+
+    def delete(self, key):
+        conn = self.connection()
+        with conn:
+            conn.execute('DELETE FROM cache_pages WHERE key = ?', (key,))
+            conn.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def keys(self):
+        return [row[0] for row in self.connection().execute('SELECT key FROM cache_entries ORDER BY key')]
+
+
+def decode(data):
+    return json.loads(zlib.decompress(data).decode('UTF-8'), cls=DateTimeDecoder)
+
+
+# Returns the object type part of a cache key, e.g. 'describe_alarm_history' for
+# 'describe_alarm_history-my-alarm'.  The object type of an entry fetched with a server-side filter, whose key records
+# the filter after an '@', like 'describe_alarm_history@HistoryItemType=StateUpdate+Action-my-alarm', is the same as
+# the unfiltered one.
+def object_type(key):
+    return key.split('-', 1)[0].split('@', 1)[0]
@@ -0,0 +1,40 @@
+# Imports an existing JSON-file cache directory into the SQLite cache backend, e.g.
+#
+#   python -m report_eb_autoscaling_alarms.cache_migrate --cache-dir ./cache --cache-db ./cache.sqlite
+#
+# Each entry keeps its key, and the file modification time becomes its fetched_at timestamp.  The cache dir is left
+# untouched, so you can go back to --cache-backend file at any time.
+
+import argparse
+from report_eb_autoscaling_alarms import aws_cache, cache_backends
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        prog='report_eb_autoscaling_alarms.cache_migrate',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="""
+        Imports a JSON-file cache directory into a SQLite cache file.
+        """
+    )
+    parser.add_argument('--cache-dir', help='JSON-file cache directory to read.', default=aws_cache.cache_dir)
+    parser.add_argument('--cache-db', help='SQLite cache file to write.  Existing keys are overwritten.',
+                        default=aws_cache.cache_db)
+    return parser.parse_args()
+
+
+def migrate(cache_dir, cache_db):
+    file_backend = cache_backends.FileCacheBackend(cache_dir)
+    sqlite_backend = cache_backends.SqliteCacheBackend(cache_db)
+    keys = file_backend.keys()
+    for key in keys:
+        if file_backend.is_paged(key):
+            sqlite_backend.put_pages(key, file_backend.get_pages(key), file_backend.fetched_at(key))
+        else:
+            sqlite_backend.put(key, file_backend.get(key), file_backend.fetched_at(key))
+    print('imported {} cache entries from {} into {}'.format(len(keys), cache_dir, cache_db))
+
+
+if __name__ == '__main__':
+    options = parse()
+    migrate(options.cache_dir, options.cache_db)
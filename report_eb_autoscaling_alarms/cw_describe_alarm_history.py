@@ -12,128 +12,364 @@
 # alarmName OK-abstime OK-pcttime INSUFFICIENT_DATA-abstime INSUF-pcttime ALARM-abstime ALARM-pcttime #Action-Success #Action-Failure
 #
 
-import boto3.session
 from pprint import pformat
-from pathlib import Path
 from datetime import datetime, timedelta
 import pytz
 import dateutil.parser
+import functools
+import heapq
+import itertools
 import json
-from report_eb_autoscaling_alarms import cw_describe_alarms, aws_cache, util
+from report_eb_autoscaling_alarms import cw_describe_alarms, aws_cache, aws_target, history_records, output_sink, \
+    state_durations, time_windows, util
 
 MAX_PAGES = 10000
-_cw_client = None
+# The alarms that beanstalk creates for its ASG scaling policies, which are the ones this report covers.
+EB_AUTOSCALING_ALARM_CRITERIA = [
+    {'AlarmDescription': 'ElasticBeanstalk Default Scale Down alarm'},
+    {'AlarmDescription': 'ElasticBeanstalk Default Scale Up alarm'}
+]
+# The history item types the report uses: ConfigurationUpdate items are not.
+REPORT_HISTORY_ITEM_TYPES = ['StateUpdate', 'Action']
+# Beanstalk names its alarms awseb-<env id>-stack-...
+EB_ALARM_NAME_PREFIX = 'awseb'
+HISTORY_PAGE_SIZE = 100
 
+# With server-side filtering, only the alarms named with EB_ALARM_NAME_PREFIX and only the history items of
+# REPORT_HISTORY_ITEM_TYPES are fetched, and cached under keys that record the filter (see history_key), apart from
+# the full ones.  That cuts the volume fetched when there are many other alarms and configuration changes, at the cost
+# of one request per item type instead of one per alarm history.  See init_server_side_filter.
+server_side_filter = False
 
-def init_client(profile_name, region_name):
-    cw_session = boto3.session.Session(profile_name=profile_name, region_name=region_name)
-    global _cw_client
-    _cw_client = cw_session.client('cloudwatch')
-    
 
-# Returns list of describe_alarm_history paginated responses.
-def get_history_pages(alarm_name, refresh_cache=False):
-    key = 'describe_alarm_history-' + alarm_name
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key)
-    done = False
+def init_server_side_filter(enabled):
+    global server_side_filter
+    server_side_filter = enabled
+
+
+# Initializes a worker process (see util.process_map_chunks) to read the same cache entries as this one.
+def init_worker(config, enabled):
+    aws_cache.init_worker(config)
+    init_server_side_filter(enabled)
+
+
+def history_key(alarm_name):
+    if server_side_filter:
+        return 'describe_alarm_history@HistoryItemType={}-{}'.format('+'.join(REPORT_HISTORY_ITEM_TYPES), alarm_name)
+    return 'describe_alarm_history-' + alarm_name
+
+
+def watermark_key(alarm_name):
+    if server_side_filter:
+        return 'alarm_history_watermark@HistoryItemType={}-{}'.format('+'.join(REPORT_HISTORY_ITEM_TYPES), alarm_name)
+    return 'alarm_history_watermark-' + alarm_name
+
+
+# Returns the alarms that the report covers, fetched with a server-side filter if enabled.
+def get_report_alarms(refresh_cache=False):
+    return cw_describe_alarms.get_filtered_alarms(EB_AUTOSCALING_ALARM_CRITERIA, refresh_cache,
+                                                  EB_ALARM_NAME_PREFIX if server_side_filter else None)
+
+
+# Returns an iterator over the describe_alarm_history paginated responses.  Pages are streamed to the cache as they
+# are fetched, and read back from the cache as the iterator is consumed.
+#
+# With incremental, a refresh of an already-cached alarm only asks AWS for items newer than the watermark (the newest
+# cached item timestamp), and merges those into the cached pages instead of downloading the full history again.
+#
+def get_history_pages(alarm_name, refresh_cache=False, incremental=False):
+    key = history_key(alarm_name)
+    if not aws_cache.should_refresh(key, refresh_cache):
+        history_pages = aws_cache.cache_lookup_pages(key)
+        if history_pages is not None:
+            return history_pages
+    if incremental and aws_cache.has_key(key):
+        history_pages = merge_new_history_pages(alarm_name, key)
+        if history_pages is None:
+            aws_cache.cache_touch(key)
+            return aws_cache.cache_get_pages(key, False)
+    else:
+        history_pages = paginate_alarm_history(alarm_name)
+    newest = None
+
+    def track_newest(history_pages):
+        nonlocal newest
+        for history_page in history_pages:
+            newest = newest_history_timestamp([history_page], newest)
+            yield history_page
+
+    aws_cache.cache_put_pages(key, track_newest(history_pages))
+    put_history_watermark(alarm_name, newest)
+    return aws_cache.cache_get_pages(key, False)
+
+
+# Makes the describe_alarm_history requests, starting at start_date if given, yielding each response as it arrives.
+# With server-side filtering, there is a pagination for each of REPORT_HISTORY_ITEM_TYPES, and their items are
+# merged, still newest first, into pages of HISTORY_PAGE_SIZE items.
+def paginate_alarm_history(alarm_name, start_date=None):
+    if not server_side_filter:
+        return paginate_alarm_history_items(alarm_name, start_date)
+    items_by_type = [iter_history_items(paginate_alarm_history_items(alarm_name, start_date, history_item_type))
+                     for history_item_type in REPORT_HISTORY_ITEM_TYPES]
+    items = heapq.merge(*items_by_type, key=lambda item: util.ensure_tz(item['Timestamp']), reverse=True)
+    return make_history_pages(items)
+
+
+# Yields pages of HISTORY_PAGE_SIZE of the items.
+def make_history_pages(items):
+    while True:
+        page_items = list(itertools.islice(items, HISTORY_PAGE_SIZE))
+        if not page_items:
+            return
+        yield {'AlarmHistoryItems': page_items}
+
+
+def paginate_alarm_history_items(alarm_name, start_date=None, history_item_type=None):
     next_token = None
-    history_pages = []
-    while not done and len(history_pages) < MAX_PAGES:
+    num_pages = 0
+    kwargs = {'AlarmName': alarm_name}
+    if start_date:
+        kwargs['StartDate'] = start_date
+    if history_item_type:
+        kwargs['HistoryItemType'] = history_item_type
+    while num_pages < MAX_PAGES:
         if next_token:
-            history_page = _cw_client.describe_alarm_history(AlarmName=alarm_name, NextToken=next_token)
+            history_page = aws_target.client('cloudwatch').describe_alarm_history(NextToken=next_token, **kwargs)
         else:
-            history_page = _cw_client.describe_alarm_history(AlarmName=alarm_name)
-        history_pages.append(history_page)
+            history_page = aws_target.client('cloudwatch').describe_alarm_history(**kwargs)
+        yield history_page
+        num_pages += 1
         if 'NextToken' in history_page and history_page['NextToken']:
             next_token = history_page['NextToken']
         else:
-            done = True
-    if len(history_pages) == MAX_PAGES:
-        print('WARNING: {} results truncated at {} pages'.format(key, MAX_PAGES))
-    aws_cache.cache_put(key, history_pages)
-    return history_pages
+            return
+    print('WARNING: {} results truncated at {} pages'.format(history_key(alarm_name), MAX_PAGES))
+
+
+# Fetches the history items at or after the watermark of the cached pages, and returns an iterator over the cached
+# pages with a new page of not-yet-cached items prepended (AWS returns newest first, and so do we).  StartDate is
+# inclusive, so the items at the watermark itself come back again and are dropped here as duplicates.  Only the new
+# items are held in memory; the cached pages are streamed.  Returns None if there are no new items, so that the cached
+# pages, and their stamp, are left as they are, and the entry is only touched (see aws_cache.cache_touch).
+def merge_new_history_pages(alarm_name, key):
+    watermark = get_history_watermark(alarm_name, key)
+    if not watermark:
+        return paginate_alarm_history(alarm_name)
+    # Newest first, so the cached items that can be duplicates are the ones before the first item older than the
+    # watermark.
+    cached_ids = set()
+    for item in iter_history_items(aws_cache.cache_get_pages(key, False)):
+        if util.ensure_tz(item['Timestamp']) < watermark:
+            break
+        cached_ids.add(history_item_id(item))
+    new_items = []
+    for item in iter_history_items(paginate_alarm_history(alarm_name, watermark)):
+        item_id = history_item_id(item)
+        if item_id not in cached_ids:
+            cached_ids.add(item_id)
+            new_items.append(item)
+    print('Found {} new alarm history items for {} since {}'.format(len(new_items), alarm_name, watermark))
+    if not new_items:
+        return None
+    return itertools.chain([{'AlarmHistoryItems': new_items}], aws_cache.cache_get_pages(key, False))
+
+
+def iter_history_items(history_pages):
+    for history_page in history_pages:
+        for item in history_page['AlarmHistoryItems']:
+            yield item
+
+
+# Identifies a history item for de-duplication.  Cached timestamps come back from the cache without tzinfo, fresh ones
+# from boto have it, so compare them in UTC.
+def history_item_id(item):
+    timestamp = util.ensure_tz(item['Timestamp']).astimezone(pytz.utc)
+    return timestamp.isoformat(), item['HistoryItemType'], item.get('HistorySummary'), item.get('HistoryData')
 
 
-def calc_and_write_alarm_history_for_eb_autoscaling(refresh_cache = False):
+# Returns the StartDate to use for the next incremental fetch of this alarm: the recorded watermark if there is one,
+# else the newest item timestamp in the cached pages.  Returns None if there are no items at all.
+def get_history_watermark(alarm_name, key):
+    watermark = aws_cache.cache_lookup(watermark_key(alarm_name), False)
+    if watermark is not None:
+        return util.ensure_tz(watermark['StartDate'])
+    return newest_history_timestamp(aws_cache.cache_get_pages(key, False))
+
+
+def put_history_watermark(alarm_name, watermark):
+    key = watermark_key(alarm_name)
+    if watermark:
+        aws_cache.cache_put(key, {'AlarmName': alarm_name, 'StartDate': watermark})
+    else:
+        aws_cache.cache_delete(key)
+
+
+# Returns the newest item timestamp in history_pages, or in newest if that is newer.
+def newest_history_timestamp(history_pages, newest=None):
+    for item in iter_history_items(history_pages):
+        timestamp = util.ensure_tz(item['Timestamp']).astimezone(pytz.utc)
+        if newest is None or timestamp > newest:
+            newest = timestamp
+    return newest
+
+
+# Returns an iterator over the decoded HistoryRecords of this alarm's history (see history_records).  The records are
+# decoded from the history pages only when the cached records are missing or out of date.
+def get_history_records(alarm_name, refresh_cache=False, incremental=False):
+    history_pages = get_history_pages(alarm_name, refresh_cache, incremental)
+    error_context = 'alarm {}'.format(alarm_name)
+    return history_records.get_records(history_key(alarm_name), history_pages,
+                                       lambda history_page: decode_history_page(history_page, error_context),
+                                       history_records.HistoryRecord)
+
+
+# Fills the cache with describe_alarm_history for each of the alarm names, fetching up to 'workers' alarms at once.
+# Each cache entry is written as soon as its alarm finishes paginating.  Alarms already cached are skipped unless
+# refresh_cache is set.
+def fetch_history_pages(alarm_names, refresh_cache=False, workers=1, incremental=False):
+    def fetch_one(alarm_name):
+        get_history_pages(alarm_name, True, incremental)
+
+    to_fetch = []
+    for alarm_name in alarm_names:
+        key = history_key(alarm_name)
+        if aws_cache.should_refresh(key, refresh_cache) or not aws_cache.has_key(key):
+            to_fetch.append(alarm_name)
+    if to_fetch:
+        print('Fetching alarm history for {} alarms with {} workers'.format(len(to_fetch), workers))
+        util.parallel_map(fetch_one, to_fetch, workers)
+
+
+# windows: list of time_windows.Window to write a CSV for each of, or None to write the one CSV of the whole history
+def calc_and_write_alarm_history_for_eb_autoscaling(refresh_cache = False, workers=1, incremental=False, jobs=1,
+                                                    windows=None):
     # refresh_cache applies here to history pages, but not envs, resources, or alarms (those are
     # refreshed at module start).
-    alarms = cw_describe_alarms.get_filtered_alarms([
-        {'AlarmDescription': 'ElasticBeanstalk Default Scale Down alarm'},
-        {'AlarmDescription': 'ElasticBeanstalk Default Scale Up alarm'}
-    ])
+    alarms = get_report_alarms()
+    if workers > 1 or jobs > 1:
+        # Fetch everything up front in parallel, then summarize from the cache in alarm order as usual.
+        fetch_history_pages([alarm['AlarmName'] for alarm in alarms], refresh_cache, workers, incremental)
+        refresh_cache = False
+    if jobs > 1:
+        # Worker processes summarize chunks of alarms, each reading its alarms' history from the cache.
+        summary_rows = util.process_map_chunks(functools.partial(summarize_alarm_chunk, now=datetime.now(pytz.utc),
+                                                                 windows=windows),
+                                               alarms, jobs, init_worker,
+                                               (aws_cache.worker_config(), server_side_filter))
+    else:
+        alarm_records = (get_history_records(alarm['AlarmName'], refresh_cache, incremental) for alarm in alarms)
+        summary_rows = summarize_alarms_and_history(alarms, alarm_records, windows=windows)
+    if windows is None:
+        write_alarm_history(summary_rows)
+    else:
+        for window_id, window in enumerate(windows):
+            write_alarm_history([alarm_rows[window_id] for alarm_rows in summary_rows],
+                                window.output_name('cw_alarm_history'))
+
+
+COLUMNS = [
+    'AlarmName',
+    'AlarmDescription',
+    'Namespace',
+    'DimensionName',
+    'DimensionValue',
+    'EnvName',
+    'ThresholdCondition',
+    'OKAbsTime',
+    'OKPctTime',
+    'ALARMAbsTime',
+    'ALARMPctTime',
+    'INSUFAbsTime',
+    'INSUFPctTime',
+    'NumActionSuccess',
+    'NumActionFailure'
+]
+
+
+def write_alarm_history(summary_rows, output_name='cw_alarm_history'):
+    output_filename, num_written = output_sink.write_rows(output_name, COLUMNS, summary_rows)
+    print('wrote {} alarms into {}'.format(num_written, output_filename))
+
+
+# Returns a summary of each alarm and its history, in alarm order.
+#
+# alarm_records: iterable in the same order as alarms, of each alarm's iterable of history_records.HistoryRecord.  Each
+# alarm's records are consumed before the next alarm's are requested.
+# now: datetime up to which the current state of each alarm is counted; default is the current time
+# windows: list of time_windows.Window, to return for each alarm a list of its summary in each window instead
+# dimensions: list in the same order as alarms of each alarm's cw_describe_alarms.get_alarm_dimension(), or None to
+#   look them up
+#
+# The state intervals of all the alarms are collected into one state_durations.StateDurations, then the time in each
+# state is summed for every alarm at once.  With windows, the intervals and the actions are indexed by time first, and
+# each window summed from the indexes.
+#
+def summarize_alarms_and_history(alarms, alarm_records, now=None, windows=None, dimensions=None):
+    durations = state_durations.StateDurations(len(alarms))
+    if dimensions is None:
+        # Cached envs & resources are refreshed at module start, not here.
+        dimensions = [cw_describe_alarms.get_alarm_dimension(alarm) for alarm in alarms]
+    action_tallies = []
+    action_index = time_windows.EventIndex()
+    for alarm_id, (alarm, records) in enumerate(zip(alarms, alarm_records)):
+        action_tally = new_action_tally()
+        for record in records:
+            if record.kind == history_records.KIND_STATE_UPDATE:
+                durations.add_state_update(alarm_id, record)
+            elif record.kind == history_records.KIND_ACTION:
+                tally_action_outcome(action_tally, record)
+                if windows is not None:
+                    action_index.add((record.action_state, alarm_id), record.timestamp_us)
+        action_tallies.append(action_tally)
+
+    now = now or datetime.now(pytz.utc)
+    for alarm_id, alarm in enumerate(alarms):
+        error_context = 'alarm {} (beanstalk env {}): StateUpdate history item'\
+            .format(alarm['AlarmName'], dimensions[alarm_id][2])
+        add_current_state(durations, alarm_id, alarm, now, error_context)
+    if windows is not None:
+        return summarize_windows(alarms, dimensions, durations, action_index, windows)
+    us_in_state = durations.sum_by_alarm()
+
     summary_rows = []
-    for alarm in alarms:
-        history_pages = get_history_pages(alarm['AlarmName'], refresh_cache)
-        summary_rows.append(summarize_alarm_and_history(alarm, history_pages))
-    write_alarm_history(summary_rows)
-
-
-def write_alarm_history(summary_rows):
-    util.ensure_path_exists(util.OUTPUT_DIR)
-    output_filename = Path(util.OUTPUT_DIR + '/cw_alarm_history.csv')
-    with output_filename.open(mode='w', encoding='UTF-8') as output_file:
-        write_column_headers(output_file)
-        for summary_row in summary_rows:
-            write_summary_row(summary_row, output_file)
-    print('wrote {} alarms into {}'.format(len(summary_rows), output_filename))
-
-
-def write_column_headers(output_file):
-    columns = [
-        'AlarmName',
-        'AlarmDescription',
-        'Namespace',
-        'DimensionName',
-        'DimensionValue',
-        'EnvName',
-        'ThresholdCondition',
-        'OKAbsTime',
-        'OKPctTime',
-        'ALARMAbsTime',
-        'ALARMPctTime',
-        'INSUFAbsTime',
-        'INSUFPctTime',
-        'NumActionSuccess',
-        'NumActionFailure'
-    ]
-    output_file.write(','.join(columns) + '\n')
-
-
-def write_summary_row(row, output_file):
-    columns = [
-        row['AlarmName'],
-        row['AlarmDescription'],
-        row['Namespace'],
-        row['DimensionName'],
-        row['DimensionValue'],
-        row['EnvName'],
-        row['ThresholdCondition'],
-        util.quote(row['OKAbsTime']),
-        row['OKPctTime'],
-        util.quote(row['ALARMAbsTime']),
-        row['ALARMPctTime'],
-        util.quote(row['INSUFAbsTime']),
-        row['INSUFPctTime'],
-        str(row['NumActionSuccess']),
-        str(row['NumActionFailure'])
-    ]
-    output_file.write(','.join(columns) + '\n')
-
-
-# Returns a summary of the alarm and its history.
-def summarize_alarm_and_history(alarm, history_pages):
-    # Cached envs & resources are refreshed at module start, not here.
-    dimension_name, dimension_value, env_name = cw_describe_alarms.get_alarm_dimension(alarm)
-
-    action_items, state_update_items, config_update_items = filter_items(history_pages)
-
-    error_context = 'alarm {} (beanstalk env {})'.format(alarm['AlarmName'], env_name)
+    for alarm_id, alarm in enumerate(alarms):
+        first = alarm_id * state_durations.NUM_STATES
+        alarm_us_in_state = us_in_state[first:first + state_durations.NUM_STATES]
+        summary_rows.append(summarize_alarm(alarm, dimensions[alarm_id], alarm_us_in_state, action_tallies[alarm_id]))
+    return summary_rows
+
+
+# Returns for each alarm a list of its summary in each of the windows.
+def summarize_windows(alarms, dimensions, durations, action_index, windows):
+    state_index = state_durations.StateIndex(durations)
+    action_index.sort()
+    summary_rows = [[] for alarm in alarms]
+    for window in windows:
+        us_in_state = state_index.sum_by_alarm(window)
+        for alarm_id, alarm in enumerate(alarms):
+            first = alarm_id * state_durations.NUM_STATES
+            action_tally = new_action_tally()
+            action_tally['Succeeded'] = action_index.count((history_records.ACTION_SUCCEEDED, alarm_id), window)
+            action_tally['Failed'] = action_index.count((history_records.ACTION_FAILED, alarm_id), window)
+            summary_rows[alarm_id].append(summarize_alarm(alarm, dimensions[alarm_id],
+                                                          us_in_state[first:first + state_durations.NUM_STATES],
+                                                          action_tally))
+    return summary_rows
+
+
+# Summarizes a chunk of alarms whose history is already cached.  Runs in a worker process with --jobs.
+def summarize_alarm_chunk(alarms, now=None, windows=None):
+    alarm_records = (get_history_records(alarm['AlarmName']) for alarm in alarms)
+    return summarize_alarms_and_history(alarms, alarm_records, now, windows)
+
+
+def summarize_alarm(alarm, dimension, us_in_state, action_tally):
+    dimension_name, dimension_value, env_name = dimension
 
     ok_abs_time, ok_pct_time, alarm_abs_time, alarm_pct_time, insuf_abs_time, insuf_pct_time\
-        = calc_state_times(alarm, state_update_items, error_context)
+        = format_state_times(us_in_state)
 
-    num_action_success, num_action_failure = calc_action_outcomes(action_items, error_context)
+    num_action_success, num_action_failure = calc_action_outcomes(action_tally)
 
     return {
         'AlarmName': alarm['AlarmName'],
@@ -154,73 +390,92 @@ def summarize_alarm_and_history(alarm, history_pages):
     }
 
 
-def filter_items(history_pages):
-    action_items = []
-    state_update_items = []
-    config_update_items = []
-    for history_page in history_pages:
-        for item in history_page['AlarmHistoryItems']:
-            item_type = item['HistoryItemType']
-            if item_type == 'Action':
-                action_items.append(item)
-            elif item_type == 'StateUpdate':
-                state_update_items.append(item)
-            elif item_type == 'ConfigurationUpdate':
-                config_update_items.append(item)
-            else:
-                print('WARNING: AlarmHistoryItem with unknown type {}: {}'.format(item_type, pformat(item)))
-    return action_items, state_update_items, config_update_items
-
-
-# Each item has HistoryData with oldState, newState, so you can subtract their timestamps to derive how much time was
-# spent in the oldState.  We also consider "now" minus the latest newState timestamp.
+def decode_history_page(history_page, error_context):
+    for item in history_page['AlarmHistoryItems']:
+        record = decode_history_item(item, error_context)
+        if record:
+            yield record
+
+
+# Decodes one AlarmHistoryItem into a HistoryRecord, or returns None for an item of unknown type.
+def decode_history_item(item, error_context):
+    item_type = item['HistoryItemType']
+    kind = history_records.KIND_INDEX.get(item_type)
+    if kind is None:
+        print('WARNING: AlarmHistoryItem with unknown type {}: {}'.format(item_type, pformat(item)))
+        return None
+    timestamp_us = history_records.to_epoch_us(item['Timestamp'])
+    if kind == history_records.KIND_STATE_UPDATE:
+        state_error_context = '{}: StateUpdate history item'.format(error_context)
+        history_data = json.loads(item['HistoryData'])
+        old_state, old_start_date = extract_state(history_data, 'oldState', state_error_context)
+        new_state, new_start_date = extract_state(history_data, 'newState', state_error_context)
+        return history_records.HistoryRecord(
+            kind, timestamp_us,
+            old_state=history_records.STATE_INDEX[old_state],
+            old_start_us=history_records.to_epoch_us(old_start_date) if old_start_date else None,
+            new_state=history_records.STATE_INDEX[new_state],
+            new_start_us=history_records.to_epoch_us(new_start_date) if new_start_date else None)
+    elif kind == history_records.KIND_ACTION:
+        action_state = json.loads(item['HistoryData'])['actionState']
+        if action_state == 'Succeeded':
+            return history_records.HistoryRecord(kind, timestamp_us, action_state=history_records.ACTION_SUCCEEDED)
+        elif action_state == 'Failed':
+            return history_records.HistoryRecord(kind, timestamp_us, action_state=history_records.ACTION_FAILED)
+        print('WARNING: {}: ignoring Action history item with unknown state {}'.format(error_context, action_state))
+        return history_records.HistoryRecord(kind, timestamp_us, action_state=history_records.ACTION_OTHER)
+    return history_records.HistoryRecord(kind, timestamp_us)
+
+
+# Each StateUpdate has an oldState and newState, so you can subtract their start dates to derive how much time was
+# spent in the oldState.  We also consider "now" minus the latest newState start date.
 #
 # In the event of no history items, the latest state and start date are on the alarm.
 #
 # Anecdotally it appears that the newState of one item is always the oldState of another, but I'm not sure I can rely
 # on that.  So I decided against the idea of sorting the items by date to try and line up newState to newState in
-# chronologically consecutive items.
+# chronologically consecutive items.  That also lets us tally the records one at a time as they stream past, in any
+# order.
+#
+# See state_durations for how the times are summed.
 #
-def calc_state_times(alarm, state_update_items, error_context):
-    timedelta_in_state = {'OK': timedelta(0), 'ALARM': timedelta(0), 'INSUFFICIENT_DATA': timedelta(0)}
-    latest_new_start_date = pytz.utc.localize(datetime(1900, 1, 1))
-    latest_state = None
-    latest_datasource = None
-    error_context = '{}: StateUpdate history item'.format(error_context)
-    if len(state_update_items) > 0:
-        for item in state_update_items:
-            history_data = json.loads(item['HistoryData'])
-            old_state, old_start_date = extract_state(history_data, 'oldState', error_context)
-            new_state, new_start_date = extract_state(history_data, 'newState', error_context)
-            if old_start_date and new_start_date:
-                timedelta_in_state[old_state] += new_start_date - old_start_date
-            if new_start_date and new_start_date > latest_new_start_date:
-                latest_new_start_date = new_start_date
-                latest_state = history_data['newState']['stateValue']
-                latest_datasource = 'latest StateUpdate history item (newState)'
+def add_current_state(durations, alarm_id, alarm, now, error_context):
+    if durations.num_state_updates[alarm_id] > 0:
+        latest_state, latest_new_start_us = durations.latest_state(alarm_id)
+        latest_datasource = 'latest StateUpdate history item (newState)'
     else:
-        latest_new_start_date = alarm['StateUpdatedTimestamp']
-        latest_state = alarm['StateValue']
+        validate_state(alarm['StateValue'], 'alarm', alarm, error_context)
+        latest_new_start_us = history_records.to_epoch_us(alarm['StateUpdatedTimestamp'])
+        latest_state = history_records.STATE_INDEX[alarm['StateValue']]
         latest_datasource = 'alarm state'
-        validate_state(latest_state, 'alarm', alarm, error_context)
 
-    now = datetime.now(latest_new_start_date.tzinfo)
-    if now < latest_new_start_date:
+    now_us = history_records.to_epoch_us(now)
+    if latest_new_start_us is None:
+        print('WARNING: {}: no newState startDate available, so the current state is not counted'
+              .format(error_context))
+    elif now_us < latest_new_start_us:
         print('WARNING: {}: {} timestamp {} is more recent than "now" {})'
-              .format(error_context, latest_datasource, latest_new_start_date, now))
+              .format(error_context, latest_datasource, history_records.from_epoch_us(latest_new_start_us), now))
     else:
-        timedelta_in_state[latest_state] += now - latest_new_start_date
-
-    ok_abs_time = str(timedelta_in_state['OK'])
-    alarm_abs_time = str(timedelta_in_state['ALARM'])
-    insuf_abs_time = str(timedelta_in_state['INSUFFICIENT_DATA'])
-    total_timedelta = timedelta_in_state['OK'] + timedelta_in_state['ALARM'] + timedelta_in_state['INSUFFICIENT_DATA']
-    ok_pct_time = '{0:.2f}%'.format(100.0 * (timedelta_in_state['OK'] / total_timedelta))
-    alarm_pct_time = '{0:.2f}%'.format(100.0 * (timedelta_in_state['ALARM'] / total_timedelta))
-    insuf_pct_time = '{0:.2f}%'.format(100.0 * (timedelta_in_state['INSUFFICIENT_DATA'] / total_timedelta))
-
-    # Example output
-    # '1 day, 0:46:30', '85.84%', '4:05:10', '14.16%', '0:00:00', '0.00%'
+        durations.add_interval(alarm_id, latest_state, latest_new_start_us, now_us)
+
+
+# Formats microseconds in each state as absolute times and percentages.  Example output:
+# '1 day, 0:46:30', '85.84%', '4:05:10', '14.16%', '0:00:00', '0.00%'
+def format_state_times(us_in_state):
+    ok_us = us_in_state[history_records.STATE_OK]
+    alarm_us = us_in_state[history_records.STATE_ALARM]
+    insuf_us = us_in_state[history_records.STATE_INSUFFICIENT_DATA]
+    total_us = ok_us + alarm_us + insuf_us
+    if total_us == 0:
+        # No time at all, as in a window before the alarm's history begins
+        return str(timedelta(0)), '', str(timedelta(0)), '', str(timedelta(0)), ''
+    ok_abs_time = str(timedelta(microseconds=ok_us))
+    alarm_abs_time = str(timedelta(microseconds=alarm_us))
+    insuf_abs_time = str(timedelta(microseconds=insuf_us))
+    ok_pct_time = '{0:.2f}%'.format(100.0 * (ok_us / total_us))
+    alarm_pct_time = '{0:.2f}%'.format(100.0 * (alarm_us / total_us))
+    insuf_pct_time = '{0:.2f}%'.format(100.0 * (insuf_us / total_us))
     return ok_abs_time, ok_pct_time, alarm_abs_time, alarm_pct_time, insuf_abs_time, insuf_pct_time
 
 
@@ -245,16 +500,16 @@ def validate_state(state_value, container_name, container, error_context):
 
 
 # Count the number of actions ending in success or failure.
-def calc_action_outcomes(action_items, error_context):
-    num_action_success, num_action_failure = 0, 0
-    for item in action_items:
-        history_data = json.loads(item['HistoryData'])
-        action_state = history_data['actionState']
-        if action_state == 'Succeeded':
-            num_action_success += 1
-        elif action_state == 'Failed':
-            num_action_failure += 1
-        else:
-            print('WARNING: {}: ignoring Action history item with unknown state {} in alarm {} (beanstalk env {})'
-                .format(error_context, action_state))
-    return num_action_success, num_action_failure
+def new_action_tally():
+    return {'Succeeded': 0, 'Failed': 0}
+
+
+def tally_action_outcome(action_tally, record):
+    if record.action_state == history_records.ACTION_SUCCEEDED:
+        action_tally['Succeeded'] += 1
+    elif record.action_state == history_records.ACTION_FAILED:
+        action_tally['Failed'] += 1
+
+
+def calc_action_outcomes(action_tally):
+    return action_tally['Succeeded'], action_tally['Failed']
@@ -1,57 +1,79 @@
 # The alarms involve ASGs with long squiggly names ... here we map the ASG names to meaningful beanstalk env names.
 # You could use Excel afterwards on the CSV to sort the output by StateUpdatedTimestamp, or Filter by other columns.
 
-import boto3.session
 from pprint import pformat
-from pathlib import Path
-from report_eb_autoscaling_alarms import eb_by_resource, aws_cache, util
+from report_eb_autoscaling_alarms import eb_by_resource, aws_cache, aws_target, output_sink
 
 MAX_PAGES = 10000
-_cw_client = None
 
 
-def init_client(profile_name, region_name):
-    cw_session = boto3.session.Session(profile_name=profile_name, region_name=region_name)
-    global _cw_client
-    _cw_client = cw_session.client('cloudwatch')
-    
+# Returns an iterator over the describe_alarms paginated responses.  Pages are streamed to the cache as they are
+# fetched, and read back from the cache as the iterator is consumed.
+#
+# With name_prefix, AWS is asked only for the alarms whose names start with it, which are cached under a key of their
+# own (see alarms_key), apart from the full list.
+#
+def get_alarm_pages(refresh_cache=False, name_prefix=None):
+    key = alarms_key(name_prefix)
+    if not aws_cache.should_refresh(key, refresh_cache):
+        alarm_pages = aws_cache.cache_lookup_pages(key)
+        if alarm_pages is not None:
+            return alarm_pages
+    aws_cache.cache_put_pages(key, paginate_alarms(name_prefix))
+    return aws_cache.cache_get_pages(key, False)
+
+
+def alarms_key(name_prefix=None):
+    return 'describe_alarms@AlarmNamePrefix=' + name_prefix if name_prefix else 'describe_alarms'
 
-# Returns list of describe_alarms paginated responses.
-def get_alarm_pages(refresh_cache=False):
-    key = 'describe_alarms'
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key)
-    done = False
+
+# Makes the describe_alarms requests, yielding each response as it arrives.
+def paginate_alarms(name_prefix=None):
     next_token = None
-    alarm_pages = []
-    while not done and len(alarm_pages) < MAX_PAGES:
+    num_pages = 0
+    kwargs = {'AlarmNamePrefix': name_prefix} if name_prefix else {}
+    while num_pages < MAX_PAGES:
         if next_token:
-            alarm_page = _cw_client.describe_alarms(NextToken=next_token)
+            alarm_page = aws_target.client('cloudwatch').describe_alarms(NextToken=next_token, **kwargs)
         else:
-            alarm_page = _cw_client.describe_alarms()
-        alarm_pages.append(alarm_page)
+            alarm_page = aws_target.client('cloudwatch').describe_alarms(**kwargs)
+        yield alarm_page
+        num_pages += 1
         if 'NextToken' in alarm_page and alarm_page['NextToken']:
             next_token = alarm_page['NextToken']
         else:
-            done = True
-    if len(alarm_pages) == MAX_PAGES:
-        print('WARNING: {} results truncated at {} pages'.format(key, MAX_PAGES))
-    aws_cache.cache_put(key, alarm_pages)
-    return alarm_pages
+            return
+    print('WARNING: describe_alarms results truncated at {} pages'.format(MAX_PAGES))
 
 
-def get_filtered_alarms(criteria, refresh_cache=False):
+# Returns the alarms that match the criteria (see match_alarm), and whose names start with name_prefix if given.  With
+# name_prefix, only those alarms are fetched, unless the full list of alarms is cached more recently (see
+# prefer_full_alarms), in which case it is filtered instead.  Either way the result is the same.
+def get_filtered_alarms(criteria, refresh_cache=False, name_prefix=None):
     if not isinstance(criteria, list):
         raise ValueError('criteria argument must be list, not {}'.format(type(criteria)))
     alarms = []
-    alarm_pages = get_alarm_pages(refresh_cache)
+    if name_prefix and not refresh_cache and prefer_full_alarms(name_prefix):
+        alarm_pages = get_alarm_pages()
+    else:
+        alarm_pages = get_alarm_pages(refresh_cache, name_prefix)
     for alarm_page in alarm_pages:
         for alarm in alarm_page['MetricAlarms']:
-            if match_alarm(alarm, criteria):
+            if match_alarm(alarm, criteria) and (not name_prefix or alarm['AlarmName'].startswith(name_prefix)):
                 alarms.append(alarm)
     return alarms
 
 
+# Returns True if the full list of alarms is cached, need not be refreshed, and was fetched more recently than the
+# alarms named with name_prefix (if at all), so that it can serve for those.
+def prefer_full_alarms(name_prefix):
+    full_fetched_at = aws_cache.cache_fetched_at(alarms_key())
+    if full_fetched_at is None or aws_cache.should_refresh(alarms_key()):
+        return False
+    filtered_fetched_at = aws_cache.cache_fetched_at(alarms_key(name_prefix))
+    return filtered_fetched_at is None or full_fetched_at >= filtered_fetched_at
+
+
 # Example input criteria:
 # [ { "AlarmDescription": "ElasticBeanstalk Default Scale Down alarm" },
 #   { "AlarmDescription": "ElasticBeanstalk Default Scale Up alarm" } ]
@@ -95,54 +117,47 @@ def comparison_operator_to_string(alarm):
         return '<='
 
 
+COLUMNS = [
+    'AlarmName',
+    'AlarmDescription',
+    'StateUpdatedTimestamp',
+    'StateValue',
+    'Namespace',
+    'DimensionName',
+    'DimensionValue',
+    'EnvName',
+    'MetricName',
+    'StateReason'
+]
+
+
 def write_alarms():
     # No need for a refresh_cache arg, we only depend on 'alarms' and those were refreshed already if user wanted it.
-    util.ensure_path_exists(util.OUTPUT_DIR)
-    output_filename = Path(util.OUTPUT_DIR + '/cw_alarms.csv')
-    with output_filename.open(mode='w', encoding='UTF-8') as output_file:
-        write_column_headers(output_file)
-        num_written = 0
-        alarm_pages = get_alarm_pages()
-        for alarm_page in alarm_pages:
-            for alarm in alarm_page['MetricAlarms']:
-                if len(alarm['Dimensions']) <= 1:
-                    write_alarm(alarm, output_file)
-                    num_written += 1
-                else:
-                    print('WARNING: cannot handle multi-dimensional alarm: {}', pformat(alarm))
+    output_filename, num_written = output_sink.write_rows('cw_alarms', COLUMNS, alarm_rows(get_alarm_pages()))
     print('wrote {} alarms into {}'.format(num_written, output_filename))
 
 
-def write_column_headers(output_file):
-    columns = [
-        'AlarmName',
-        'AlarmDescription',
-        'StateUpdatedTimestamp',
-        'StateValue',
-        'Namespace',
-        'DimensionName',
-        'DimensionValue',
-        'EnvName',
-        'MetricName',
-        'StateReason'
-    ]
-    output_file.write(','.join(columns) + '\n')
+# Yields a row for each of the alarms in alarm_pages, as they are read.
+def alarm_rows(alarm_pages):
+    for alarm_page in alarm_pages:
+        for alarm in alarm_page['MetricAlarms']:
+            if len(alarm['Dimensions']) <= 1:
+                yield alarm_row(alarm)
+            else:
+                print('WARNING: cannot handle multi-dimensional alarm: {}', pformat(alarm))
 
 
-def write_alarm(alarm, output_file):
+def alarm_row(alarm):
     (dimension_name, dimension_value, env_name) = get_alarm_dimension(alarm)
-    columns = [
-        alarm['AlarmName'],
-        alarm.get('AlarmDescription', ''), # Could be missing
-        str(alarm['StateUpdatedTimestamp']),
-        alarm['StateValue'],
-        alarm['Namespace'],
-        dimension_name,
-        dimension_value,
-        env_name,
-        alarm['MetricName'],
-        util.quote(alarm['StateReason'])
-    ]
-    output_file.write(','.join(columns) + '\n')
-
-
+    return {
+        'AlarmName': alarm['AlarmName'],
+        'AlarmDescription': alarm.get('AlarmDescription', ''), # Could be missing
+        'StateUpdatedTimestamp': str(alarm['StateUpdatedTimestamp']),
+        'StateValue': alarm['StateValue'],
+        'Namespace': alarm['Namespace'],
+        'DimensionName': dimension_name,
+        'DimensionValue': dimension_value,
+        'EnvName': env_name,
+        'MetricName': alarm['MetricName'],
+        'StateReason': alarm['StateReason']
+    }
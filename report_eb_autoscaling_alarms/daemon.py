@@ -0,0 +1,268 @@
+# Serves the reports from memory as a long-running process (--serve), rather than reading and summarizing the whole
+# cache again on every run.
+#
+# Every refresh_interval seconds, the alarm histories and scaling activities of each target are refreshed
+# incrementally, as with --async-fetch --incremental, and the envs, resources and alarms only once they have outlived
+# their TTL (see --ttl); with --refresh-stale, the histories and activities too.  Then the alarms, the ASGs, and the
+# decoded history and activity records of each alarm and ASG (see history_records) are loaded into a new Snapshot.
+# Records whose raw cache entry has the same stamp as in the last snapshot are carried over instead of read again, and
+# an incremental refresh that finds nothing new leaves the entry as it was, so loading a snapshot costs about what was
+# fetched.  The new snapshot then replaces the old one.
+#
+# Requests never wait for a refresh and read nothing but the snapshot: everything a report needs from the cache, like
+# the env name of each alarm, is resolved when the snapshot is loaded, and each report is summarized from it by the
+# same functions that write the output files, which takes milliseconds rather than the seconds to minutes of a run.
+#
+# Reports are served over HTTP, on localhost unless another host is given:
+#
+#   GET /cw_alarms, /cw_alarm_history, /asg_activities, /alarm_scaling
+#       The report's rows, in the --output-format or ?format=csv|jsonl|columnar.  ?since= and ?until= take times as for
+#       --since and --until.  With several targets, every target's rows are served together, with Region and Account
+#       columns first as in the merged output files, or only one target's with ?target=<profile>/<region>.
+#   GET /status
+#       JSON of when each target's snapshot was refreshed, and how many alarms, ASGs and records it holds.
+#
+# e.g. curl 'http://localhost:8080/cw_alarm_history?since=24h&format=jsonl'
+
+import argparse
+import io
+import json
+import threading
+import traceback
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytz
+from report_eb_autoscaling_alarms import alarm_scaling_join, asg_describe_scaling, async_fetch, aws_cache, \
+    aws_target, cw_describe_alarm_history, cw_describe_alarms, output_sink, time_windows, util
+
+REPORTS = ['cw_alarms', 'cw_alarm_history', 'asg_activities', 'alarm_scaling']
+# The object types refreshed incrementally on each interval, unless with --refresh-stale; the others only past their TTL
+REFRESH_OBJECT_TYPES = ['alarm_history', 'scaling']
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8',
+                 'columnar': 'application/x-ndjson; charset=utf-8'}
+DEFAULT_HOST = '127.0.0.1'
+
+
+# What one target's reports are summarized from, as loaded after a refresh.  A snapshot is never changed once loaded,
+# so requests can read it without locking.
+class Snapshot:
+
+    def __init__(self, refreshed_at):
+        self.refreshed_at = refreshed_at
+        self.alarm_rows = []  # the rows of cw_alarms
+        self.report_alarms = []  # cw_describe_alarm_history.get_report_alarms()
+        self.dimensions = []  # cw_describe_alarms.get_alarm_dimension() of each of report_alarms
+        self.asg_env_pairs = []  # (ASG, env name), as in asg_describe_scaling
+        self.history = {}  # alarm name => (stamp of its history cache entry, list of HistoryRecord)
+        self.activities = {}  # ASG name => (stamp of its activities cache entry, list of ActivityRecord)
+
+    def status(self):
+        return {
+            'RefreshedAt': self.refreshed_at.isoformat(),
+            'NumAlarms': len(self.alarm_rows),
+            'NumReportAlarms': len(self.report_alarms),
+            'NumASGs': len(self.asg_env_pairs),
+            'NumHistoryRecords': sum(len(records) for stamp, records in self.history.values()),
+            'NumActivityRecords': sum(len(records) for stamp, records in self.activities.values())
+        }
+
+
+# Loads a snapshot of the current target's cache, carrying over the records of previous (a Snapshot, or None) whose
+# cache entries are unchanged.
+def load_snapshot(previous=None):
+    snapshot = Snapshot(datetime.now(pytz.utc))
+    snapshot.alarm_rows = list(cw_describe_alarms.alarm_rows(cw_describe_alarms.get_alarm_pages()))
+    snapshot.report_alarms = cw_describe_alarm_history.get_report_alarms()
+    snapshot.dimensions = [cw_describe_alarms.get_alarm_dimension(alarm) for alarm in snapshot.report_alarms]
+    snapshot.asg_env_pairs = [(asg_env_pair['ASG']['AutoScalingGroups'][0], asg_env_pair['EnvName'])
+                              for asg_env_pair in asg_describe_scaling.lookup_beanstalk_asg_env_pairs(False)]
+    for alarm in snapshot.report_alarms:
+        alarm_name = alarm['AlarmName']
+        snapshot.history[alarm_name] = load_records(cw_describe_alarm_history.history_key(alarm_name),
+                                                    previous.history.get(alarm_name) if previous else None,
+                                                    cw_describe_alarm_history.get_history_records, alarm_name)
+    for asg, env_name in snapshot.asg_env_pairs:
+        asg_name = asg['AutoScalingGroupName']
+        snapshot.activities[asg_name] = load_records('describe_scaling_activities-' + asg_name,
+                                                     previous.activities.get(asg_name) if previous else None,
+                                                     asg_describe_scaling.get_scaling_activity_records, asg_name)
+    return snapshot
+
+
+# Returns (stamp, list of records) of the cache entry source_key: previous if it has the entry's current stamp, else
+# the records read anew with get_records(name).
+def load_records(source_key, previous, get_records, name):
+    source_stamp = aws_cache.cache_stamp(source_key)
+    if previous is not None and source_stamp is not None and previous[0] == source_stamp:
+        return previous
+    return source_stamp, list(get_records(name))
+
+
+# Returns the rows of the report summarized from the snapshot, as a list.  Reads nothing but the snapshot.
+#
+# window: time_windows.Window of the history to report on, or None for all of it
+#
+def report_rows(report_name, snapshot, window=None):
+    windows = [window] if window else None
+    now = datetime.now(pytz.utc)
+    if report_name == 'cw_alarms':
+        return [dict(alarm_row) for alarm_row in snapshot.alarm_rows]
+    if report_name == 'cw_alarm_history':
+        alarm_records = (snapshot.history[alarm['AlarmName']][1] for alarm in snapshot.report_alarms)
+        summary_rows = cw_describe_alarm_history.summarize_alarms_and_history(snapshot.report_alarms, alarm_records,
+                                                                              now, windows, snapshot.dimensions)
+        return summary_rows if windows is None else [alarm_rows[0] for alarm_rows in summary_rows]
+    if report_name == 'asg_activities':
+        if windows is None:
+            return [asg_describe_scaling.calc_scaling_activity_one_asg(
+                        snapshot.activities[asg['AutoScalingGroupName']][1], asg, env_name, now)
+                    for asg, env_name in snapshot.asg_env_pairs]
+        return [asg_describe_scaling.calc_scaling_activity_in_windows(
+                    snapshot.activities[asg['AutoScalingGroupName']][1], asg, env_name, windows, now)[0]
+                for asg, env_name in snapshot.asg_env_pairs]
+    alarm_records = (snapshot.history[alarm['AlarmName']][1] for alarm in snapshot.report_alarms)
+    asg_records = (snapshot.activities[asg['AutoScalingGroupName']][1] for asg, env_name in snapshot.asg_env_pairs)
+    return alarm_scaling_join.summarize_alarm_scaling(snapshot.report_alarms, alarm_records, asg_records, window,
+                                                      snapshot.dimensions)
+
+
+REPORT_COLUMNS = {
+    'cw_alarms': cw_describe_alarms.COLUMNS,
+    'cw_alarm_history': cw_describe_alarm_history.COLUMNS,
+    'asg_activities': asg_describe_scaling.COLUMNS,
+    'alarm_scaling': alarm_scaling_join.COLUMNS
+}
+
+
+class ReportDaemon:
+
+    # targets: list of aws_target.Target
+    # options: the parsed command line, for the cache backend, workers and refresh_interval
+    def __init__(self, targets, options):
+        self.targets = targets
+        self.options = options
+        self.snapshots = {}  # target => its latest Snapshot, replaced whole on each refresh
+        self.stopped = threading.Event()
+
+    # Refreshes and loads every target once, recaching the object types in recache, with the targets concurrently as
+    # in a run.
+    def refresh(self, recache):
+        util.parallel_map(lambda target: aws_target.run(target, self.refresh_target, recache), self.targets,
+                          len(self.targets))
+
+    def refresh_target(self, recache):
+        target = aws_target.current()
+        async_fetch.fill_cache(recache, REPORTS, self.options.workers, True)
+        previous = self.snapshots.get(target)
+        snapshot = load_snapshot(previous)
+        self.snapshots[target] = snapshot
+        print('{}: loaded {}'.format(target, snapshot.status()))
+
+    # Refreshes every refresh_interval seconds until stopped, and whatever has outlived its TTL.  A failed refresh is
+    # reported, and the last snapshot served until the next one succeeds.
+    def refresh_loop(self):
+        while not self.stopped.wait(self.options.refresh_interval):
+            try:
+                self.refresh([] if self.options.refresh_stale else REFRESH_OBJECT_TYPES)
+            except Exception:
+                traceback.print_exc()
+
+    # Returns the columns and rows of the report, as requested by the query args (see the top of this file).
+    def report(self, report_name, query):
+        window = None
+        since, until = query.get('since'), query.get('until')
+        if since or until:
+            window = time_windows.Window('', time_windows.parse_time(since) if since else None,
+                                         time_windows.parse_time(until) if until else None)
+        columns = REPORT_COLUMNS[report_name]
+        targets = self.targets
+        if query.get('target'):
+            targets = [target for target in self.targets
+                       if '{}/{}'.format(target.profile_name, target.region_name) == query['target']]
+            if not targets:
+                raise LookupError('no target {}'.format(query['target']))
+        if len(self.targets) == 1:
+            target = targets[0]
+            return columns, aws_target.run(target, report_rows, report_name, self.snapshots[target], window)
+        rows = []
+        for target in targets:
+            for row in aws_target.run(target, report_rows, report_name, self.snapshots[target], window):
+                row['Region'] = target.region_name
+                row['Account'] = target.profile_name
+                rows.append(row)
+        return ['Region', 'Account'] + columns, rows
+
+    def status(self):
+        return {'{}/{}'.format(target.profile_name, target.region_name): self.snapshots[target].status()
+                for target in self.targets}
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        try:
+            self.get_report()
+        except Exception:
+            traceback.print_exc()
+            self.respond(500, 'text/plain', 'Failed to serve {}, see the server log\n'.format(self.path))
+
+    def get_report(self):
+        report_daemon = self.server.report_daemon
+        url = urllib.parse.urlsplit(self.path)
+        report_name = url.path.strip('/')
+        query = dict(urllib.parse.parse_qsl(url.query))
+        format_name = query.get('format', output_sink.output_format)
+        if report_name == 'status':
+            self.respond(200, 'application/json', json.dumps(report_daemon.status(), indent=2) + '\n')
+        elif report_name not in REPORTS or format_name not in output_sink.FORMATS:
+            self.respond(404, 'text/plain', 'Unknown report or format: expected /<report>?format=<format> with '
+                                            'report one of {} and format one of {}\n'
+                         .format(', '.join(REPORTS + ['status']), ', '.join(output_sink.FORMATS)))
+        else:
+            try:
+                columns, rows = report_daemon.report(report_name, query)
+            except (LookupError, argparse.ArgumentTypeError) as e:
+                self.respond(400, 'text/plain', '{}\n'.format(e))
+                return
+            output_file = io.StringIO(newline='')
+            output_sink.write_to(output_file, columns, rows, format_name)
+            self.respond(200, CONTENT_TYPES[format_name], output_file.getvalue())
+
+    def respond(self, status, content_type, text):
+        body = text.encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Parses a --serve argument, [host:]port, into (host, int port).
+def parse_address(arg):
+    host, sep, port = arg.rpartition(':')
+    if not port.isdigit():
+        raise argparse.ArgumentTypeError('expected [host:]port, not {}'.format(arg))
+    return host or DEFAULT_HOST, int(port)
+
+
+# Loads every target, then serves its reports at address, a (host, port), refreshing them in the background, until
+# interrupted.  The cache backend of each target must be chosen already.
+def serve(targets, options, address):
+    # Whatever is not refreshed on each interval is refreshed once past its TTL.
+    aws_cache.init_ttls(dict(options.ttl), True)
+    report_daemon = ReportDaemon(targets, options)
+    report_daemon.refresh(options.recache)
+    server = ThreadingHTTPServer(address, ReportHandler)
+    server.report_daemon = report_daemon
+    refresh_thread = threading.Thread(target=report_daemon.refresh_loop, name='refresh', daemon=True)
+    refresh_thread.start()
+    print('Serving {} at http://{}:{}/, refreshing every {} seconds'
+          .format(', '.join(REPORTS), address[0], server.server_address[1], options.refresh_interval))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        report_daemon.stopped.set()
+        server.server_close()
@@ -6,42 +6,125 @@
 #   * Call describe-environment-resources for each env til you find the resource
 # So we automate that here...
 #
+# Doing that walk once per lookup is O(envs) cache reads per resource, so we walk it once and keep a reverse index
+# from resource to env name.  The index is persisted in the cache next to the entries it was built from, and is
+# invalidated whenever describe_environments or describe_environment_resources is refetched.  Each aws_target has its
+# own index, like its own cache.
+#
 # In the absence of explicit config for ASG name, then beanstalk creates the ASG with a long autogenerated name.
 # As those pile up it becomes impractical to visually associate the ASG with its beanstalk env, hence this automation.
 #
 # See http://boto3.readthedocs.io/en/latest/reference/services/elasticbeanstalk.html#ElasticBeanstalk.Client.describe_environment_resources
 
-import boto3.session
-from pprint import pformat
-from report_eb_autoscaling_alarms import aws_cache
-
-_eb_client = None
+from report_eb_autoscaling_alarms import aws_cache, aws_target, util
 
+RESOURCE_INDEX_KEY = 'eb_resource_index'
+# Per-target count of invalidations of the index
+RESOURCE_INDEX_GENERATION_KEY = 'eb_resource_index_generation'
 
-def init_client(profile_name, region_name):
-    eb_session = boto3.session.Session(profile_name=profile_name, region_name=region_name)
-    global _eb_client
-    _eb_client = eb_session.client('elasticbeanstalk')
-    
 
 def get_envs(refresh_cache=False):
     key = 'describe_environments'
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key)
-    envs = _eb_client.describe_environments()
+    if not aws_cache.should_refresh(key, refresh_cache):
+        envs = aws_cache.cache_lookup(key)
+        if envs is not None:
+            return envs
+    envs = aws_target.client('elasticbeanstalk').describe_environments()
     aws_cache.cache_put(key, envs)
+    invalidate_resource_index()
     return envs
 
 
 def get_resources(env_name, refresh_cache=False):
     key = 'describe_environment_resources-' + env_name
-    if aws_cache.has_key(key) and not refresh_cache:
-        return aws_cache.cache_get(key, False)
-    resources = _eb_client.describe_environment_resources(EnvironmentName=env_name)
+    if not aws_cache.should_refresh(key, refresh_cache):
+        resources = aws_cache.cache_lookup(key, False)
+        if resources is not None:
+            return resources
+    resources = aws_target.client('elasticbeanstalk').describe_environment_resources(EnvironmentName=env_name)
     aws_cache.cache_put(key, resources)
+    invalidate_resource_index()
     return resources
 
 
+# Returns a list of (env_name, describe_environment_resources) pairs, in the same order as envs['Environments'].
+# Up to 'workers' envs are fetched at once.
+def get_all_resources(envs, refresh_cache=False, workers=1):
+    def get_one(env_name):
+        return env_name, get_resources(env_name, refresh_cache)
+
+    return util.parallel_map(get_one, [env['EnvironmentName'] for env in envs['Environments']], workers)
+
+
+# Drops the resource index, in memory and on disk.  Call this whenever envs or resources are refetched.  The target's
+# generation of the index is bumped under its lock, so that an index read or built before this is not kept after it
+# (see get_resource_index).
+def invalidate_resource_index():
+    target = aws_target.current()
+    with target.lock:
+        target.state[RESOURCE_INDEX_GENERATION_KEY] = target.state.get(RESOURCE_INDEX_GENERATION_KEY, 0) + 1
+        target.state.pop(RESOURCE_INDEX_KEY, None)
+        aws_cache.cache_delete(RESOURCE_INDEX_KEY)
+
+
+# resource_index =>
+#     {
+#        resource_type: {
+#           criterion: {
+#              value: env_name
+#           }
+#        }
+#     }
+#
+# Example resource_index:
+#   {'AutoScalingGroups': {'Name': {'<long name string>': 'my-env'}},
+#    'Instances': {'Id': {'i-0123456789abcdef0': 'my-env'}}}
+#
+# Every string-valued attribute of every resource type is indexed.  If two envs claim the same resource, the first
+# env in describe_environments order wins, same as the linear search did.
+#
+def build_resource_index(refresh_cache=False):
+    resource_index = {}
+    envs = get_envs(refresh_cache)
+    for env in envs['Environments']:
+        env_name = env['EnvironmentName']
+        resources = get_resources(env_name, refresh_cache)
+        for resource_type, typed_resources in resources['EnvironmentResources'].items():
+            if not isinstance(typed_resources, list):
+                continue
+            for resource in typed_resources:
+                for criterion, value in resource.items():
+                    if isinstance(value, str):
+                        resource_index.setdefault(resource_type, {}).setdefault(criterion, {}) \
+                            .setdefault(value, env_name)
+    return resource_index
+
+
+# Returns the resource index: the target's in memory, else the persisted one, else a new one, which is persisted.
+#
+# An index read or built while the index is invalidated (by another thread refetching, or by the gets of the build
+# itself fetching what was not cached yet) may be out of date, so it is neither kept nor persisted: the index is built
+# again, from the entries now cached.
+def get_resource_index(refresh_cache=False):
+    target = aws_target.current()
+    resource_index = None if refresh_cache else target.state.get(RESOURCE_INDEX_KEY)
+    while resource_index is None:
+        generation = target.state.get(RESOURCE_INDEX_GENERATION_KEY, 0)
+        resource_index = None if refresh_cache else aws_cache.cache_lookup(RESOURCE_INDEX_KEY)
+        is_built = resource_index is None
+        if is_built:
+            resource_index = build_resource_index(refresh_cache)
+        refresh_cache = False
+        with target.lock:
+            if target.state.get(RESOURCE_INDEX_GENERATION_KEY, 0) != generation:
+                resource_index = None
+            else:
+                if is_built:
+                    aws_cache.cache_put(RESOURCE_INDEX_KEY, resource_index)
+                target.state[RESOURCE_INDEX_KEY] = resource_index
+    return resource_index
+
+
 # tgt_resource =>
 #     {
 #        resource_type: criteria
@@ -57,28 +140,14 @@ def get_resources(env_name, refresh_cache=False):
 #   {'LoadBalancers': {'Name': '<long name string>'}}
 #   {'LaunchConfigurations': {'Name': '<long name string>'}}
 #
-def find_env_with_resource(tgt_resource, refresh_cache = False):
-    print('Looking for env with this resource: {}'.format(pformat(tgt_resource)))
-    envs = get_envs(refresh_cache)
-    for env in envs['Environments']:
-        env_name = env['EnvironmentName']
-        resources = get_resources(env_name, refresh_cache)
-        if match_resource(resources, tgt_resource):
-            print('Found resource in env {}'.format(env_name))
-            return env_name
-    print('Not found')
-    return ''
-
-
-# Given the output from describe-environment-resources, return True if the tgt_resource is found there.
-def match_resource(cur_resources, tgt_resource):
+def find_env_with_resource(tgt_resource, refresh_cache=False):
+    resource_index = get_resource_index(refresh_cache)
     for tgt_resource_type, tgt_criteria in tgt_resource.items():
-        if tgt_resource_type in cur_resources['EnvironmentResources']:
-            cur_typed_resources = cur_resources['EnvironmentResources'][tgt_resource_type]
-            for tgt_criterion, tgt_value in tgt_criteria.items():
-                for cur_resource in cur_typed_resources:
-                    if tgt_criterion in cur_resource and cur_resource[tgt_criterion] == tgt_value:
-                        return True
-    return False
-
+        indexed_criteria = resource_index.get(tgt_resource_type, {})
+        for tgt_criterion, tgt_value in tgt_criteria.items():
+            env_name = indexed_criteria.get(tgt_criterion, {}).get(tgt_value)
+            if env_name:
+                return env_name
+    print('No env found with this resource: {}'.format(tgt_resource))
+    return ''
 
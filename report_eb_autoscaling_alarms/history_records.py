@@ -0,0 +1,110 @@
+# Compact, pre-decoded records of alarm history items and scaling activities.
+#
+# The raw cache entries hold AWS responses as-is, so every analysis of them has to json.loads each history item's
+# HistoryData, parse the dates inside it, and json.loads each scaling activity's Details.  Instead we decode each item
+# once into a small __slots__ record, with timestamps as integer microseconds since the epoch (UTC) and states as
+# small ints, and persist the records in the cache next to the raw entry, under 'records-<raw key>'.  The records
+# entry remembers the stamp of the raw entry it was decoded from, and is rebuilt when the raw entry changes.
+#
+# A records entry is paged like the raw one: a header page {'SourceStamp': ..., 'Version': ...}, then pages of
+# {'Records': [row, ...]} where each row is a record's slots as a list.
+
+from datetime import datetime, timedelta
+import pytz
+from report_eb_autoscaling_alarms import aws_cache, util
+
+RECORDS_VERSION = 1
+ROWS_PER_PAGE = 1000
+EPOCH = pytz.utc.localize(datetime(1970, 1, 1))
+
+# Alarm states, indexed by the state ints in HistoryRecord.
+STATE_NAMES = ('OK', 'ALARM', 'INSUFFICIENT_DATA')
+STATE_OK, STATE_ALARM, STATE_INSUFFICIENT_DATA = range(len(STATE_NAMES))
+STATE_INDEX = {name: i for i, name in enumerate(STATE_NAMES)}
+
+# HistoryRecord.kind
+KIND_NAMES = ('StateUpdate', 'Action', 'ConfigurationUpdate')
+KIND_STATE_UPDATE, KIND_ACTION, KIND_CONFIGURATION_UPDATE = range(len(KIND_NAMES))
+KIND_INDEX = {name: i for i, name in enumerate(KIND_NAMES)}
+
+# HistoryRecord.action_state
+ACTION_OTHER, ACTION_SUCCEEDED, ACTION_FAILED = range(3)
+
+# ActivityRecord.launch_or_term
+ACTIVITY_OTHER, ACTIVITY_LAUNCHING, ACTIVITY_TERMINATING = range(3)
+
+
+class HistoryRecord:
+    __slots__ = ('kind', 'timestamp_us', 'old_state', 'old_start_us', 'new_state', 'new_start_us', 'action_state')
+
+    def __init__(self, kind, timestamp_us, old_state=None, old_start_us=None, new_state=None, new_start_us=None,
+                 action_state=None):
+        self.kind = kind
+        self.timestamp_us = timestamp_us
+        self.old_state = old_state
+        self.old_start_us = old_start_us
+        self.new_state = new_state
+        self.new_start_us = new_start_us
+        self.action_state = action_state
+
+
+class ActivityRecord:
+    __slots__ = ('activity_id', 'start_us', 'status_code', 'launch_or_term', 'alarm_name')
+
+    def __init__(self, activity_id, start_us, status_code, launch_or_term, alarm_name):
+        self.activity_id = activity_id
+        self.start_us = start_us
+        self.status_code = status_code
+        self.launch_or_term = launch_or_term
+        self.alarm_name = alarm_name
+
+
+# Returns an iterator over the records decoded from the raw cache entry source_key, whose pages are source_pages.
+# If the persisted records are current they are read instead, and source_pages is never consumed.
+#
+# decode_page: function of one raw page, returning an iterable of records
+# record_class: HistoryRecord or ActivityRecord
+#
+def get_records(source_key, source_pages, decode_page, record_class):
+    records_key = 'records-' + source_key
+    source_stamp = aws_cache.cache_stamp(source_key)
+    records_pages = aws_cache.cache_lookup_pages(records_key, False)
+    if records_pages is not None:
+        header = next(records_pages, None)
+        if header is not None and header.get('Version') == RECORDS_VERSION \
+                and header.get('SourceStamp') == list(source_stamp or []):
+            return rows_to_records(records_pages, record_class)
+    aws_cache.cache_put_pages(records_key, records_to_pages(source_stamp, source_pages, decode_page))
+    records_pages = aws_cache.cache_get_pages(records_key, False)
+    next(records_pages)  # header
+    return rows_to_records(records_pages, record_class)
+
+
+def records_to_pages(source_stamp, source_pages, decode_page):
+    yield {'SourceStamp': list(source_stamp or []), 'Version': RECORDS_VERSION}
+    rows = []
+    for source_page in source_pages:
+        for record in decode_page(source_page):
+            rows.append([getattr(record, slot) for slot in record.__slots__])
+            if len(rows) == ROWS_PER_PAGE:
+                yield {'Records': rows}
+                rows = []
+    if rows:
+        yield {'Records': rows}
+
+
+def rows_to_records(records_pages, record_class):
+    for records_page in records_pages:
+        for row in records_page['Records']:
+            yield record_class(*row)
+
+
+# Converts a datetime to integer microseconds since the epoch.  A naive datetime is taken to be UTC, as datetimes come
+# back from the cache without tzinfo.
+def to_epoch_us(date):
+    delta = util.ensure_tz(date) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_epoch_us(epoch_us):
+    return EPOCH + timedelta(microseconds=epoch_us)
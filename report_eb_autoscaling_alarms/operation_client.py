@@ -0,0 +1,24 @@
+# A stand-in for a boto3 client, or for another stand-in, that makes each call of one of the client's AWS operations
+# through a function of its own, e.g. to time it (run_stats) or to rate limit it (rate_limit).  Everything else, like
+# the client's meta or get_paginator, is the client's own.
+
+import functools
+
+# Methods of a boto3 client that are not AWS operations
+NOT_OPERATIONS = ['can_paginate', 'close', 'generate_presigned_url', 'get_paginator', 'get_waiter']
+
+
+class OperationClient:
+
+    # call: function of (operation_name, operation_fn, *args, **kwargs) that calls operation_fn(*args, **kwargs) and
+    #   returns its response, with operation_name like 'cloudwatch.describe_alarm_history'
+    def __init__(self, service_name, client, call):
+        self.service_name = service_name
+        self.client = client
+        self.call = call
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or name in NOT_OPERATIONS or not callable(attr):
+            return attr
+        return functools.partial(self.call, self.service_name + '.' + name, attr)
@@ -0,0 +1,135 @@
+# Writes the rows of a report into the output dir as they are produced, in the format chosen with --output-format,
+# optionally gzipped with --output-gzip:
+#
+#   csv: a header line, then a line per row, quoted by the csv module wherever a value needs it (a comma, quote or line
+#       break, as alarm StateReasons often have), with embedded quotes doubled.
+#   jsonl: a JSON object per line and row, keyed by column name.  Numbers stay numbers, and everything else is a string
+#       as in the CSV.
+#   columnar: JSON Lines of batches of up to BATCH_ROWS rows, each an object of column name => list of the batch's
+#       values, so each column of a batch is contiguous, ready for e.g. pandas.DataFrame(batch).
+#
+# Rows are dicts with a value for each column, consumed one at a time from any iterable, so a report written from a
+# generator takes the memory of one row (or one batch) rather than of all of them.  The file is written through a
+# buffer of BUFFER_BYTES.
+
+import csv
+import gzip
+import itertools
+import json
+from pathlib import Path
+from report_eb_autoscaling_alarms import util
+
+FORMATS = ['csv', 'jsonl', 'columnar']
+EXTENSIONS = {'csv': '.csv', 'jsonl': '.jsonl', 'columnar': '.columns.jsonl'}
+BATCH_ROWS = 10000
+BUFFER_BYTES = 1 << 16
+
+# See init_output
+output_format = 'csv'
+output_gzip = False
+
+
+def init_output(format_name, gzipped=False):
+    global output_format, output_gzip
+    output_format = format_name
+    output_gzip = gzipped
+
+
+# Returns the name of the output file of the report named base_name, e.g. 'cw_alarms.csv' or 'cw_alarms.jsonl.gz'.
+def file_name(base_name):
+    return base_name + EXTENSIONS[output_format] + ('.gz' if output_gzip else '')
+
+
+def open_output(filename, mode):
+    if output_gzip:
+        return gzip.open(str(filename), mode + 't', encoding='UTF-8', newline='')
+    return open(str(filename), mode, encoding='UTF-8', newline='', buffering=BUFFER_BYTES)
+
+
+# Writes the rows into the output file of the report named base_name, in output_dir (by default the current target's),
+# and returns the file's path and the number of rows written.
+#
+# columns: list of string: column names, in order
+# rows: iterable of dict of column name => value
+#
+def write_rows(base_name, columns, rows, output_dir=None):
+    output_dir = output_dir or util.output_dir()
+    util.ensure_path_exists(output_dir)
+    output_filename = Path(output_dir + '/' + file_name(base_name))
+    with open_output(output_filename, 'w') as output_file:
+        num_written = write_to(output_file, columns, rows)
+    return output_filename, num_written
+
+
+# Writes the rows to an open text file, e.g. an HTTP response, in format_name (by default the current format), and
+# returns the number of rows written.
+def write_to(output_file, columns, rows, format_name=None):
+    format_name = format_name or output_format
+    if format_name == 'csv':
+        return write_csv(output_file, columns, rows)
+    if format_name == 'jsonl':
+        return write_jsonl(output_file, columns, rows)
+    return write_columnar(output_file, columns, rows)
+
+
+def write_csv(output_file, columns, rows):
+    writer = csv.writer(output_file, lineterminator='\n')
+    writer.writerow(columns)
+    num_written = 0
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+        num_written += 1
+    return num_written
+
+
+def write_jsonl(output_file, columns, rows):
+    num_written = 0
+    for row in rows:
+        output_file.write(json.dumps({column: json_value(row[column]) for column in columns}) + '\n')
+        num_written += 1
+    return num_written
+
+
+def write_columnar(output_file, columns, rows):
+    num_written = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_ROWS))
+        if not batch:
+            return num_written
+        output_file.write(json.dumps({column: [json_value(row[column]) for row in batch] for column in columns}) + '\n')
+        num_written += len(batch)
+
+
+# Numbers (and None) as is, and anything else, such as a timedelta, as the string the CSV has.
+def json_value(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return str(value)
+
+
+# Returns the column names of an output file written in the current format, or None if it has no rows to tell from
+# (which only a CSV file does without any).
+def read_columns(filename):
+    with open_output(filename, 'r') as input_file:
+        if output_format == 'csv':
+            return next(csv.reader(input_file), None)
+        line = input_file.readline()
+        return list(json.loads(line)) if line else None
+
+
+# Returns an iterator over the rows of an output file written in the current format, as dicts.  The values of a CSV
+# come back as strings.
+def read_rows(filename):
+    with open_output(filename, 'r') as input_file:
+        if output_format == 'csv':
+            yield from csv.DictReader(input_file)
+        elif output_format == 'jsonl':
+            for line in input_file:
+                yield json.loads(line)
+        else:
+            for line in input_file:
+                batch = json.loads(line)
+                columns = list(batch)
+                for values in zip(*[batch[column] for column in columns]):
+                    yield dict(zip(columns, values))
@@ -0,0 +1,149 @@
+# Adaptive client-side rate limiting of AWS requests, per target and API operation (e.g. CloudWatch
+# DescribeAlarmHistory), so that many --workers fetch as fast as the account's limits allow without failing on
+# throttling.
+#
+# Each operation has a token bucket that starts out unlimited.  When a request is throttled (it fails with a throttling
+# error, or botocore retried it after a throttling error), the bucket's rate drops to BACKOFF of the rate requests were
+# completing at over the last WINDOW_SECONDS, which is what the API let through, and throttled requests are retried
+# once the bucket has a token for them.  Each completed request then adds to the rate, so that it grows by
+# INCREASE_PER_SECOND of the rate at the last throttle per second of requests completing at the rate, and is back to
+# that rate in a few seconds and keeps going up until the next throttle: additive increase, multiplicative decrease, as
+# TCP does.  As in TCP, the increase is clocked by completions rather than by time, so the rate does not run up while
+# requests are slow or few.
+#
+# Only a request sent after the last cut can cause another: the ones already in flight, and any retries of theirs,
+# were sent at the old rate, so their throttles say nothing about the new one.  Cutting again for each of them would
+# cut the rate over and over for one burst of throttling.
+#
+# botocore retries a throttled request by itself before returning, and its response only says how many retries there
+# were, not why: 5xx errors and dropped connections are retried too, and are no reason to slow down.  So each client
+# reports the error code of every attempt botocore considers retrying, through its needs-retry event, and only a
+# throttling error code counts.
+
+import collections
+import functools
+import threading
+import time
+from report_eb_autoscaling_alarms import operation_client, run_stats
+
+MIN_RATE = 0.5  # Requests per second
+BACKOFF = 0.75  # Fraction of the completed rate kept on a throttle
+INCREASE_PER_SECOND = 0.1  # Fraction of the rate at the last throttle added per second of completed requests
+BURST = 1.0  # Tokens a bucket can save up
+WINDOW_SECONDS = 1.0  # Over which the rate of completed requests is measured
+MAX_ATTEMPTS = 8  # At a request that keeps failing on throttling errors
+
+# Whether botocore retried the request being made on this thread after a throttling error, see note_retry
+_attempts = threading.local()
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self):
+        self.rate = None  # Requests per second, or None while unlimited
+        self.tokens = BURST
+        self.refilled_at = time.monotonic()
+        self.throttled_at = None
+        self.throttled_rate = None  # The rate requests completed at when last throttled
+        self.recent_completions = collections.deque()  # Times of the completed requests of the last WINDOW_SECONDS
+        self.lock = threading.Lock()
+
+    # Waits until a request may be made, and returns (the time it is sent at, the seconds waited).  Each caller
+    # reserves a token, which may make the bucket go negative, and then waits for its share of the refill outside of
+    # the lock.
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.rate is None:
+                return now, 0.0
+            self.refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return now + wait, wait
+
+    def refill(self, now):
+        self.tokens = min(BURST, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    # Returns the requests per second that completed over the last WINDOW_SECONDS.
+    def completed_rate(self, now):
+        while self.recent_completions and self.recent_completions[0] < now - WINDOW_SECONDS:
+            self.recent_completions.popleft()
+        return len(self.recent_completions) / WINDOW_SECONDS
+
+    # Notes a request that completed without being throttled.
+    def on_success(self):
+        with self.lock:
+            now = time.monotonic()
+            self.recent_completions.append(now)
+            if self.rate is not None:
+                self.refill(now)
+                self.rate += self.throttled_rate * INCREASE_PER_SECOND / self.rate
+
+    # Notes a throttled request sent at sent_at, which completed in the end if completed, or else failed.
+    def on_throttle(self, sent_at, completed):
+        with self.lock:
+            now = time.monotonic()
+            if completed:
+                self.recent_completions.append(now)
+            if self.throttled_at is not None and sent_at < self.throttled_at:
+                return
+            completed_rate = self.completed_rate(now)
+            if self.rate is not None:
+                self.refill(now)
+            self.rate = max(MIN_RATE, completed_rate * BACKOFF)
+            self.throttled_rate = max(MIN_RATE, completed_rate)
+            self.throttled_at = now
+            self.tokens = min(self.tokens, 0.0)
+
+
+# Returns the target's rate limiter for the operation, e.g. 'cloudwatch.describe_alarm_history'.
+def get_limiter(target, operation_name):
+    limiters = target.get_state('rate_limiters', dict)
+    with target.lock:
+        if operation_name not in limiters:
+            limiters[operation_name] = AdaptiveRateLimiter()
+        return limiters[operation_name]
+
+
+# Calls operation_fn(*args, **kwargs) as the target's limiter of the operation allows, retrying it while it is
+# throttled, and returns its response.
+def limited_call(target, operation_name, operation_fn, *args, **kwargs):
+    limiter = get_limiter(target, operation_name)
+    attempt = 1
+    while True:
+        sent_at, waited = limiter.acquire()
+        if waited and run_stats.enabled:
+            run_stats.note_rate_limit_wait(operation_name, waited)
+        _attempts.throttled = False
+        try:
+            response = operation_fn(*args, **kwargs)
+        except Exception as e:
+            if not run_stats.is_throttling_error(e) or attempt >= MAX_ATTEMPTS:
+                raise
+            limiter.on_throttle(sent_at, False)
+            attempt += 1
+            continue
+        if _attempts.throttled:
+            limiter.on_throttle(sent_at, True)
+        else:
+            limiter.on_success()
+        return response
+
+
+# Handles botocore's needs-retry event, emitted after each attempt at a request with its response (None if it failed
+# to connect), and notes whether the attempt was throttled.
+def note_retry(response=None, **kwargs):
+    if response and (response[1] or {}).get('Error', {}).get('Code') in run_stats.THROTTLING_ERROR_CODES:
+        _attempts.throttled = True
+
+
+# Returns the target's client, limited by the target's rate limiters.
+def limit(target, service_name, client):
+    meta = getattr(client, 'meta', None)
+    if meta is not None:
+        # Registering again under the same unique_id does nothing, so each client gets the handler once.
+        meta.events.register('needs-retry', note_retry, unique_id='rate_limit.note_retry')
+    return operation_client.OperationClient(service_name, client, functools.partial(limited_call, target))
@@ -0,0 +1,180 @@
+# Metrics of a run, for --stats: where the time went and how much work was done, written as JSON to
+# output/run_stats.json at the end of the run.
+#
+#   api_calls: per AWS operation ('cloudwatch.describe_alarm_history', ...), the number of calls (each one a page of a
+#       paginated response), errors, throttling errors, retries made by botocore, total and max seconds, and a
+#       latency histogram: the count of calls per bucket, keyed by the bucket's upper bound in milliseconds (from
+#       LATENCY_BUCKETS_MS, non-cumulative), with '+Inf' for the calls slower than the last bound; and the number of
+#       calls that waited for the rate limiter (see rate_limit), and for how long in all.
+#   cache: per object type (see cache_backends.object_type), lookups that found the entry (hits) or not (misses),
+#       entries and pages read from and written to the backend, and their bytes; plus aws_cache.memo_counts.
+#   stages: per report stage of __main__, the number of runs and total and max wall-clock seconds.  With several
+#       targets, a stage runs once per target, concurrently.
+#
+# The counts cover the whole run, all targets together, in this process: the cache reads of --jobs worker processes
+# are not included.  Nothing is recorded unless enable() was called, so the instrumented code paths cost next to
+# nothing without --stats.
+
+import contextlib
+import json
+import threading
+import time
+from datetime import datetime
+import pytz
+from pathlib import Path
+from report_eb_autoscaling_alarms import operation_client
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                          'RequestThrottled', 'RequestThrottledException', 'SlowDown']
+
+enabled = False
+_lock = threading.Lock()
+_started_at = None
+_start = None
+_api_calls = {}
+_cache = {}
+_stages = {}
+
+
+# Starts recording, from zero.
+def enable():
+    global enabled, _started_at, _start
+    with _lock:
+        enabled = True
+        _started_at = datetime.now(pytz.utc)
+        _start = time.perf_counter()
+        _api_calls.clear()
+        _cache.clear()
+        _stages.clear()
+
+
+# Returns client, or if recording, a stand-in for it that records each of its AWS operation calls.
+def instrument(service_name, client):
+    if not enabled:
+        return client
+    return operation_client.OperationClient(service_name, client, timed_call)
+
+
+# Calls operation_fn(*args, **kwargs), recording it under operation_name, and returns its response.
+def timed_call(operation_name, operation_fn, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = operation_fn(*args, **kwargs)
+    except Exception as e:
+        note_api_call(operation_name, time.perf_counter() - start, 'throttled' if is_throttling_error(e) else 'error')
+        raise
+    retries = response.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(response, dict) else 0
+    note_api_call(operation_name, time.perf_counter() - start, 'ok', retries)
+    return response
+
+
+def is_throttling_error(e):
+    return (getattr(e, 'response', None) or {}).get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+# outcome: string: 'ok', 'error' or 'throttled' (a throttling error)
+def note_api_call(operation_name, seconds, outcome, retries=0):
+    with _lock:
+        op_stats = get_op_stats(operation_name)
+        op_stats['calls'] += 1
+        if outcome == 'throttled':
+            op_stats['errors'] += 1
+            op_stats['throttles'] += 1
+        elif outcome == 'error':
+            op_stats['errors'] += 1
+        op_stats['retries'] += retries
+        op_stats['seconds'] += seconds
+        op_stats['max_seconds'] = max(op_stats['max_seconds'], seconds)
+        op_stats['histogram'][bucket_index(seconds * 1000)] += 1
+
+
+# Adds seconds that a call of the operation waited for the rate limiter (see rate_limit).
+def note_rate_limit_wait(operation_name, seconds):
+    with _lock:
+        op_stats = get_op_stats(operation_name)
+        op_stats['rate_limit_waits'] += 1
+        op_stats['rate_limit_wait_seconds'] += seconds
+
+
+# Returns the stats of the operation, adding them if there are none yet.  Call with _lock held.
+def get_op_stats(operation_name):
+    if operation_name not in _api_calls:
+        _api_calls[operation_name] = {'calls': 0, 'errors': 0, 'throttles': 0, 'retries': 0, 'seconds': 0.0,
+                                      'max_seconds': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                                      'rate_limit_waits': 0, 'rate_limit_wait_seconds': 0.0}
+    return _api_calls[operation_name]
+
+
+def bucket_index(ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+# Adds counts to the cache stats of the object type, e.g. note_cache('describe_alarms', hits=1).
+def note_cache(object_type, **counts):
+    with _lock:
+        if object_type not in _cache:
+            _cache[object_type] = {'hits': 0, 'misses': 0, 'entries_read': 0, 'pages_read': 0, 'bytes_read': 0,
+                                   'entries_written': 0, 'pages_written': 0, 'bytes_written': 0}
+        for name, count in counts.items():
+            _cache[object_type][name] += count
+
+
+# Returns an iterator over pages that adds the number of pages consumed to the object type's count_name.
+def count_pages(object_type, count_name, pages):
+    num_pages = 0
+    try:
+        for page in pages:
+            num_pages += 1
+            yield page
+    finally:
+        note_cache(object_type, **{count_name: num_pages})
+
+
+# Times the body of the with statement as a run of the named stage.
+@contextlib.contextmanager
+def stage(stage_name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            stage_stats = _stages.setdefault(stage_name, {'runs': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stage_stats['runs'] += 1
+            stage_stats['seconds'] += seconds
+            stage_stats['max_seconds'] = max(stage_stats['max_seconds'], seconds)
+
+
+# Returns the stats recorded so far, as a dict ready for json.
+def get_stats(memo_counts=None):
+    with _lock:
+        api_calls = {}
+        for operation_name, op_stats in sorted(_api_calls.items()):
+            api_calls[operation_name] = dict(op_stats)
+            api_calls[operation_name]['histogram'] = dict(zip([str(bound) for bound in LATENCY_BUCKETS_MS] + ['+Inf'],
+                                                              op_stats['histogram']))
+        return {
+            'started_at': _started_at.isoformat() if _started_at else None,
+            'wall_seconds': time.perf_counter() - _start if _start is not None else None,
+            'api_calls': api_calls,
+            'cache': {
+                'by_object_type': {object_type: dict(counts) for object_type, counts in sorted(_cache.items())},
+                'memo': dict(memo_counts or {})
+            },
+            'stages': {stage_name: dict(stage_stats) for stage_name, stage_stats in _stages.items()}
+        }
+
+
+def write_stats(output_filename, memo_counts=None):
+    output_path = Path(output_filename)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open(mode='w', encoding='UTF-8') as output_file:
+        json.dump(get_stats(memo_counts), output_file, indent=2)
+    print('wrote run stats into {}'.format(output_filename))
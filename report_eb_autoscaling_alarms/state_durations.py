@@ -0,0 +1,140 @@
+# Sums the time each alarm spent in each state, for all the alarms of a report at once.
+#
+# Every interval an alarm spent in one state (from a StateUpdate's oldState start date to its newState start date, or
+# from the latest newState start date to "now") goes into flat, typed columns: the group (alarm id * NUM_STATES +
+# state), and the start and end in integer microseconds since the epoch.  That is a few dozen bytes per interval
+# instead of a dict and datetimes per history item.  Integer microseconds add up exactly, so the sums equal the
+# equivalent timedelta sums.
+#
+# NumPy is not a dependency of this project, so the columns are array.array and the sums are not vectorized: summing
+# is one plain Python pass over the columns, and the work per interval is an add into the group's total.  That pass is
+# a small part of the report, next to reading the records: bench_state_durations times it.
+#
+# Alarm ids are the alarms' positions in the report, 0 to num_alarms - 1.
+#
+# An interval that ends no later than it starts is dropped as it is added, as from a StateUpdate whose newState start
+# date is earlier than its oldState one, which AWS does send.  So no sum, window or timeline bucket ever counts
+# negative time, and they all agree on what was counted.
+#
+# To sum the time in each state within windows of time (see time_windows), StateIndex sorts the intervals by alarm and
+# start, with running totals per state, so that each window takes a few binary searches per alarm.  Building the index
+# is done with sorted, bisect and itertools.accumulate over whole columns, so the loops per interval run in C.
+
+import bisect
+import itertools
+import operator
+from array import array
+from report_eb_autoscaling_alarms import history_records
+
+NUM_STATES = len(history_records.STATE_NAMES)
+NO_STATE = -1
+
+
+class StateDurations:
+
+    def __init__(self, num_alarms):
+        self.num_alarms = num_alarms
+        # One entry per interval
+        self.groups = array('q')
+        self.start_us = array('q')
+        self.end_us = array('q')
+        # One entry per alarm
+        self.num_state_updates = array('q', [0]) * num_alarms
+        self.latest_states = array('b', [NO_STATE]) * num_alarms
+        self.latest_start_us = array('q', [0]) * num_alarms
+
+    # Adds an interval, unless it is empty or negative.
+    def add_interval(self, alarm_id, state, start_us, end_us):
+        if end_us <= start_us:
+            return
+        self.groups.append(alarm_id * NUM_STATES + state)
+        self.start_us.append(start_us)
+        self.end_us.append(end_us)
+
+    # Adds the oldState interval of a StateUpdate history_records.HistoryRecord, if it has both start dates, and keeps
+    # track of the alarm's latest newState.
+    def add_state_update(self, alarm_id, record):
+        self.num_state_updates[alarm_id] += 1
+        if record.old_start_us is not None and record.new_start_us is not None:
+            self.add_interval(alarm_id, record.old_state, record.old_start_us, record.new_start_us)
+        if record.new_start_us is not None and (self.latest_states[alarm_id] == NO_STATE
+                                                or record.new_start_us > self.latest_start_us[alarm_id]):
+            self.latest_states[alarm_id] = record.new_state
+            self.latest_start_us[alarm_id] = record.new_start_us
+
+    # Returns the alarm's latest newState and its start in microseconds, or (None, None) if no StateUpdate of the
+    # alarm had a newState start date.
+    def latest_state(self, alarm_id):
+        if self.latest_states[alarm_id] == NO_STATE:
+            return None, None
+        return self.latest_states[alarm_id], self.latest_start_us[alarm_id]
+
+    # Returns an array of microseconds in state, NUM_STATES per alarm, so alarm_id's are at
+    # [alarm_id * NUM_STATES:(alarm_id + 1) * NUM_STATES], indexed by the history_records.STATE_* ints.
+    def sum_by_alarm(self):
+        sums = array('q', [0]) * (self.num_alarms * NUM_STATES)
+        for group, duration_us in zip(self.groups, map(operator.sub, self.end_us, self.start_us)):
+            sums[group] += duration_us
+        return sums
+
+
+class StateIndex:
+
+    # Indexes the intervals of durations, a StateDurations to which no more intervals will be added.
+    def __init__(self, durations):
+        self.num_alarms = durations.num_alarms
+        num_states = itertools.repeat(NUM_STATES)
+        alarm_ids = array('q', map(operator.floordiv, durations.groups, num_states))
+        # Sorting by one int key, the alarm id in the high bits and the start (offset to be non-negative) in the low
+        # 64, is several times faster than sorting tuples.
+        sort_keys = list(map(operator.add, map(operator.lshift, alarm_ids, itertools.repeat(64)),
+                             map(operator.add, durations.start_us, itertools.repeat(1 << 63))))
+        order = sorted(range(len(sort_keys)), key=sort_keys.__getitem__)
+        self.states = array('b', map(operator.mod, map(durations.groups.__getitem__, order), num_states))
+        self.start_us = array('q', map(durations.start_us.__getitem__, order))
+        self.end_us = array('q', map(durations.end_us.__getitem__, order))
+        # Where each alarm's intervals begin, plus where the last alarm's end
+        alarm_ids = array('q', map(alarm_ids.__getitem__, order))
+        self.alarm_starts = array('q', map(bisect.bisect_left, itertools.repeat(alarm_ids),
+                                           range(self.num_alarms + 1)))
+        # The latest end of an alarm's intervals so far, which unlike the ends themselves never decreases even if the
+        # intervals overlap, so it can be bisected.
+        self.max_end_us = array('q')
+        for alarm_id in range(self.num_alarms):
+            lo, hi = self.alarm_starts[alarm_id], self.alarm_starts[alarm_id + 1]
+            self.max_end_us.extend(itertools.accumulate(self.end_us[lo:hi], max))
+        # For each state, the microseconds in that state of all the intervals before each one, plus of all of them.
+        durations_us = list(map(operator.sub, self.end_us, self.start_us))
+        self.cumulative_us = [array('q', itertools.accumulate(itertools.chain(
+                                  [0], map(operator.mul, durations_us, map(operator.eq, self.states,
+                                                                            itertools.repeat(state))))))
+                              for state in range(NUM_STATES)]
+
+    # Returns an array of microseconds in state within the window (a time_windows.Window), laid out as from
+    # StateDurations.sum_by_alarm.  Intervals that straddle an edge of the window are clipped to it.
+    def sum_by_alarm(self, window):
+        sums = array('q', [0]) * (self.num_alarms * NUM_STATES)
+        since_us, until_us = window.since_us, window.until_us
+        for alarm_id in range(self.num_alarms):
+            lo, hi = self.alarm_starts[alarm_id], self.alarm_starts[alarm_id + 1]
+            if until_us is not None:
+                hi = bisect.bisect_left(self.start_us, until_us, lo, hi)
+            if since_us is not None:
+                lo = bisect.bisect_right(self.max_end_us, since_us, lo, hi)
+            first = alarm_id * NUM_STATES
+            # Those starting before the window, then those ending after it, and the rest of them are within it.
+            while lo < hi and since_us is not None and self.start_us[lo] < since_us:
+                self.add_clipped(sums, first, lo, since_us, until_us)
+                lo += 1
+            while hi > lo and until_us is not None and self.max_end_us[hi - 1] > until_us:
+                self.add_clipped(sums, first, hi - 1, since_us, until_us)
+                hi -= 1
+            for state in range(NUM_STATES):
+                sums[first + state] += self.cumulative_us[state][hi] - self.cumulative_us[state][lo]
+        return sums
+
+    def add_clipped(self, sums, first, i, since_us, until_us):
+        start_us = self.start_us[i] if since_us is None else max(self.start_us[i], since_us)
+        end_us = self.end_us[i] if until_us is None else min(self.end_us[i], until_us)
+        if end_us > start_us:
+            sums[first + self.states[i]] += end_us - start_us
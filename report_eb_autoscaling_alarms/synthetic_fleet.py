@@ -0,0 +1,227 @@
+# Writes a cache for a made-up fleet of beanstalk envs, in the same key layout and response shapes as a real run
+# would fetch, so that the reports can be run (and timed, see bench_reports) offline at any fleet size:
+#
+#   python -m report_eb_autoscaling_alarms.synthetic_fleet --cache-dir ./synthetic/cache \
+#     --envs 500 --asgs-per-env 1 --alarms-per-asg 2 --history-items 1000 --activities 500
+#
+# Each ASG gets the beanstalk scale up and scale down alarms (the ones cw_alarm_history reports on), plus custom
+# alarms if --alarms-per-asg is more than 2.  Alarm histories alternate between OK and ALARM, with an Action item
+# after each ALARM, and scaling activities are launches and terminations mostly caused by those alarms.  The data is
+# a function of --seed and --end-time only, so the same arguments always write the same cache.
+#
+# The generated entries are streamed to the cache one alarm or ASG at a time, so memory use does not grow with the
+# fleet size.
+
+import argparse
+import json
+import random
+from datetime import timedelta
+import dateutil.parser
+from report_eb_autoscaling_alarms import aws_cache, cache_backends
+
+ALARM_HISTORY_PAGE_SIZE = 100
+SCALING_ACTIVITIES_PAGE_SIZE = 100
+ALARMS_PAGE_SIZE = 100
+DEFAULT_END_TIME = '2017-02-01T00:00:00Z'
+SCALE_UP_DESCRIPTION = 'ElasticBeanstalk Default Scale Up alarm'
+SCALE_DOWN_DESCRIPTION = 'ElasticBeanstalk Default Scale Down alarm'
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        prog='report_eb_autoscaling_alarms.synthetic_fleet',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Writes a cache for a synthetic fleet of beanstalk envs.'
+    )
+    parser.add_argument('--cache-backend', choices=aws_cache.BACKEND_NAMES, default='file')
+    parser.add_argument('--cache-dir', help='Cache dir to write, for the file backend.', default='./synthetic/cache')
+    parser.add_argument('--cache-db', help='SQLite file to write, for the sqlite backend.',
+                        default='./synthetic/cache.sqlite')
+    parser.add_argument('--envs', type=int, default=10)
+    parser.add_argument('--asgs-per-env', type=int, default=1)
+    parser.add_argument('--alarms-per-asg', help='At least 2: the beanstalk scale up and scale down alarms.',
+                        type=int, default=2)
+    parser.add_argument('--history-items', help='Alarm history items per alarm.', type=int, default=100)
+    parser.add_argument('--activities', help='Scaling activities per ASG.', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--end-time', help='Time of the newest history item or activity.', default=DEFAULT_END_TIME)
+    options = parser.parse_args()
+    if options.alarms_per_asg < 2:
+        parser.error('--alarms-per-asg must be at least 2')
+    return options
+
+
+# Writes the whole fleet into the backend and returns a dict of counts of what was written.
+def write_fleet(backend, envs=10, asgs_per_env=1, alarms_per_asg=2, history_items=100, activities=100, seed=1,
+                end_time=DEFAULT_END_TIME):
+    rnd = random.Random(seed)
+    end_time = dateutil.parser.parse(end_time)
+    env_names = ['synthetic-env-{}'.format(env_num) for env_num in range(envs)]
+    backend.put('describe_environments', {'Environments': [make_env(env_name) for env_name in env_names]})
+    asg_names = []
+    for env_num, env_name in enumerate(env_names):
+        env_asg_names = ['awseb-e-{}-stack-AWSEBAutoScalingGroup-{}'.format(env_num, asg_num)
+                         for asg_num in range(asgs_per_env)]
+        backend.put('describe_environment_resources-' + env_name, make_env_resources(env_name, env_asg_names))
+        asg_names.extend(env_asg_names)
+
+    alarms = []
+    for asg_name in asg_names:
+        asg_alarms = make_asg_alarms(asg_name, alarms_per_asg, end_time)
+        backend.put('describe_auto_scaling_groups-' + asg_name, make_asg(asg_name))
+        backend.put_pages('describe_scaling_activities-' + asg_name,
+                          make_activity_pages(rnd, asg_name, asg_alarms[:2], activities, end_time))
+        for alarm in asg_alarms:
+            backend.put_pages('describe_alarm_history-' + alarm['AlarmName'],
+                              make_history_pages(rnd, alarm, history_items, end_time))
+        alarms.extend(asg_alarms)
+    backend.put_pages('describe_alarms', make_pages('MetricAlarms', alarms, ALARMS_PAGE_SIZE))
+    return {'envs': len(env_names), 'asgs': len(asg_names), 'alarms': len(alarms),
+            'history_items': len(alarms) * history_items, 'activities': len(asg_names) * activities}
+
+
+def make_env(env_name):
+    return {
+        'EnvironmentName': env_name,
+        'EnvironmentId': 'e-' + env_name,
+        'ApplicationName': 'synthetic-app',
+        'Status': 'Ready',
+        'Health': 'Green'
+    }
+
+
+def make_env_resources(env_name, asg_names):
+    return {
+        'EnvironmentResources': {
+            'EnvironmentName': env_name,
+            'AutoScalingGroups': [{'Name': asg_name} for asg_name in asg_names],
+            'Instances': [{'Id': 'i-{}-{}'.format(env_name, asg_num)} for asg_num in range(len(asg_names))],
+            'LaunchConfigurations': [{'Name': 'lc-{}'.format(asg_name)} for asg_name in asg_names],
+            'LoadBalancers': [{'Name': 'lb-{}'.format(env_name)}],
+            'Triggers': [],
+            'Queues': []
+        }
+    }
+
+
+def make_asg(asg_name):
+    return {'AutoScalingGroups': [{
+        'AutoScalingGroupName': asg_name,
+        'MinSize': 1,
+        'MaxSize': 4,
+        'DesiredCapacity': 1
+    }]}
+
+
+# The first two alarms of each ASG are its beanstalk scale up and scale down alarms.
+def make_asg_alarms(asg_name, alarms_per_asg, end_time):
+    alarms = []
+    for alarm_num in range(alarms_per_asg):
+        if alarm_num == 0:
+            suffix, description, operator, threshold = 'AlarmHigh', SCALE_UP_DESCRIPTION, 'GreaterThanThreshold', 6e6
+        elif alarm_num == 1:
+            suffix, description, operator, threshold = 'AlarmLow', SCALE_DOWN_DESCRIPTION, 'LessThanThreshold', 2e6
+        else:
+            suffix, description, operator, threshold = 'Custom{}'.format(alarm_num), 'Custom alarm', \
+                'GreaterThanOrEqualToThreshold', 90.0
+        alarms.append({
+            'AlarmName': '{}-Cloudwatch{}'.format(asg_name, suffix),
+            'AlarmDescription': description,
+            'Namespace': 'AWS/EC2',
+            'MetricName': 'NetworkOut',
+            'Dimensions': [{'Name': 'AutoScalingGroupName', 'Value': asg_name}],
+            'ComparisonOperator': operator,
+            'Threshold': threshold,
+            'StateValue': 'OK',
+            'StateReason': 'Threshold Crossed: 1 datapoint was not greater than the threshold',
+            'StateUpdatedTimestamp': end_time,
+            'AlarmActions': ['arn:aws:autoscaling:us-west-2:123456789012:scalingPolicy:synthetic']
+        })
+    return alarms
+
+
+# Returns the pages of history_items items of the alarm, newest first as AWS returns them.  The alarm alternates
+# between OK and ALARM, ending OK at end_time.
+def make_history_pages(rnd, alarm, history_items, end_time):
+    items = []
+    new_start = end_time
+    new_state = 'OK'
+    while len(items) < history_items:
+        old_state = 'ALARM' if new_state == 'OK' else 'OK'
+        old_start = new_start - timedelta(seconds=rnd.randint(60, 6 * 3600), milliseconds=rnd.randint(0, 999))
+        if new_state == 'ALARM':
+            items.append(make_history_item(alarm, new_start + timedelta(seconds=1), 'Action', {
+                'actionState': 'Succeeded' if rnd.random() < 0.9 else 'Failed'
+            }))
+        items.append(make_history_item(alarm, new_start, 'StateUpdate', {
+            'version': '1.0',
+            'oldState': {'stateValue': old_state, 'stateReasonData': {'startDate': format_start_date(old_start)}},
+            'newState': {'stateValue': new_state, 'stateReasonData': {'startDate': format_start_date(new_start)}}
+        }))
+        new_start, new_state = old_start, old_state
+    return make_pages('AlarmHistoryItems', items[:history_items], ALARM_HISTORY_PAGE_SIZE)
+
+
+def make_history_item(alarm, timestamp, item_type, history_data):
+    return {
+        'AlarmName': alarm['AlarmName'],
+        'Timestamp': timestamp,
+        'HistoryItemType': item_type,
+        'HistorySummary': '{} for {}'.format(item_type, alarm['AlarmName']),
+        'HistoryData': json.dumps(history_data)
+    }
+
+
+# Formats like the startDate in alarm HistoryData, e.g. '2017-01-20T01:23:45.678+0000'.
+def format_start_date(date):
+    return '{}.{:03d}+0000'.format(date.strftime('%Y-%m-%dT%H:%M:%S'), date.microsecond // 1000)
+
+
+# Returns the pages of the ASG's activities, newest first as AWS returns them.  Most are caused by one of the ASG's
+# scale up (launching) or scale down (terminating) alarms.
+def make_activity_pages(rnd, asg_name, scaling_alarms, activities, end_time):
+    scaling_activities = []
+    start_time = end_time
+    for activity_num in range(activities):
+        launching = rnd.random() < 0.5
+        alarm = scaling_alarms[0 if launching else 1]
+        if launching:
+            description = 'Launching a new EC2 instance: i-{:08x}'.format(rnd.getrandbits(32))
+        else:
+            description = 'Terminating EC2 instance: i-{:08x}'.format(rnd.getrandbits(32))
+        details = {'Subnet ID': 'subnet-synthetic', 'Availability Zone': 'us-west-2a'}
+        if rnd.random() < 0.9:
+            details['InvokingAlarms'] = [{'AlarmName': alarm['AlarmName']}]
+        scaling_activities.append({
+            'ActivityId': '{}-{}'.format(asg_name, activity_num),
+            'AutoScalingGroupName': asg_name,
+            'Description': description,
+            'Cause': 'At {} a monitor alarm {} in state ALARM triggered policy'.format(start_time, alarm['AlarmName']),
+            'StartTime': start_time,
+            'EndTime': start_time + timedelta(minutes=1),
+            'StatusCode': 'Successful' if rnd.random() < 0.95 else 'Failed',
+            'Progress': 100,
+            'Details': json.dumps(details)
+        })
+        start_time -= timedelta(seconds=rnd.randint(300, 12 * 3600))
+    return make_pages('Activities', scaling_activities, SCALING_ACTIVITIES_PAGE_SIZE)
+
+
+# Yields the items in pages of page_size, each with a NextToken but the last, like paginated responses.
+def make_pages(items_name, items, page_size):
+    for start in range(0, max(len(items), 1), page_size):
+        page = {items_name: items[start:start + page_size], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if start + page_size < len(items):
+            page['NextToken'] = 'synthetic-{}'.format(start + page_size)
+        yield page
+
+
+if __name__ == '__main__':
+    options = parse()
+    if options.cache_backend == 'sqlite':
+        fleet_backend = cache_backends.SqliteCacheBackend(options.cache_db)
+    else:
+        fleet_backend = cache_backends.FileCacheBackend(options.cache_dir)
+    counts = write_fleet(fleet_backend, options.envs, options.asgs_per_env, options.alarms_per_asg,
+                         options.history_items, options.activities, options.seed, options.end_time)
+    print('wrote synthetic fleet: {}'.format(', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items()))))
@@ -0,0 +1,134 @@
+# Windows of time for the cw_alarm_history and asg_activities reports, like the last 24 hours (--since 24h), or
+# from one deploy to the next (--since 2017-03-01T12:00 --until 2017-03-08T09:30), and time-sorted indexes of events
+# to count those within a window by binary search.
+#
+# A run can cover several windows: each alarm's history records (or ASG's activities) are read once, into indexes
+# sorted by time (see EventIndex here and state_durations.StateIndex), and each window then takes a few binary searches
+# per alarm or ASG instead of another pass over the history.
+#
+# A window is half-open, from its since (inclusive) to its until (exclusive), either of which may be open-ended.  Times
+# are integer microseconds since the epoch, as in history_records.
+
+import argparse
+import bisect
+import re
+from array import array
+from datetime import datetime, timedelta
+import dateutil.parser
+import pytz
+from report_eb_autoscaling_alarms import history_records, util
+
+# Units of a relative time like 24h, meaning 24 hours ago
+DURATION_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+class Window:
+
+    # name: string to tell the window's output files apart, or '' for the window of the usual output files
+    # since_us, until_us: int microseconds since the epoch, or None for no bound
+    def __init__(self, name, since_us=None, until_us=None):
+        self.name = name
+        self.since_us = since_us
+        self.until_us = until_us
+
+    # Returns the name of the window's report named base_name, e.g. 'cw_alarm_history-24h' for 'cw_alarm_history'.
+    # See output_sink.file_name for its file name.
+    def output_name(self, base_name):
+        return '{}-{}'.format(base_name, self.name) if self.name else base_name
+
+    # Returns the end of the window as of now_us: until_us if that is earlier.
+    def end_us(self, now_us):
+        return now_us if self.until_us is None else min(self.until_us, now_us)
+
+    def __repr__(self):
+        return 'Window({!r}, {}, {})'.format(self.name, format_us(self.since_us), format_us(self.until_us))
+
+
+def format_us(epoch_us):
+    return '-' if epoch_us is None else history_records.from_epoch_us(epoch_us).isoformat()
+
+
+# Parses a duration like 90m, 24h, 7d or 2w into a timedelta, or returns None if arg is not one.
+def match_duration(arg):
+    m = re.match(r'^(\d+)([{}])$'.format(''.join(DURATION_UNITS)), arg)
+    return timedelta(**{DURATION_UNITS[m.group(2)]: int(m.group(1))}) if m else None
+
+
+# Parses a duration argument like 15m or 1h into microseconds.
+def parse_duration(arg):
+    duration = match_duration(arg)
+    if not duration:
+        raise argparse.ArgumentTypeError('expected a duration like 15m, 1h or 1d (units m, h, d, w), not {}'
+                                         .format(arg))
+    return (duration.days * 86400 + duration.seconds) * 1000000
+
+
+# Parses a time argument into microseconds since the epoch: a relative time like 90m, 24h, 7d or 2w (that long before
+# now), or a date and time like 2017-03-01T12:00 (in UTC unless it has an offset).
+def parse_time(arg, now=None):
+    duration = match_duration(arg)
+    if duration:
+        return history_records.to_epoch_us((now or datetime.now(pytz.utc)) - duration)
+    try:
+        return history_records.to_epoch_us(util.ensure_tz(dateutil.parser.parse(arg)))
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError('expected a date and time like 2017-03-01T12:00, or a time ago like 24h or '
+                                         '7d, not {}'.format(arg))
+
+
+# Parses a --window argument, [name=]since[..until], into a Window.  Without a name, the window is named after the
+# argument itself, e.g. 7d.
+def parse_window(arg):
+    name, sep, spec = arg.rpartition('=')
+    if not sep:
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', arg)
+    if not name:
+        raise argparse.ArgumentTypeError('expected [name=]since[..until], not {}'.format(arg))
+    since, sep, until = spec.partition('..')
+    return Window(name, parse_time(since) if since else None, parse_time(until) if until else None)
+
+
+# Returns the windows to report on: one for the usual output files, from since_us to until_us, then extra_windows.
+# Returns None if there are no bounds or extra windows at all, for the usual reports of the whole history.
+def make_windows(since_us=None, until_us=None, extra_windows=()):
+    if since_us is None and until_us is None and not extra_windows:
+        return None
+    return [Window('', since_us, until_us)] + list(extra_windows)
+
+
+class EventIndex:
+
+    # Times of events, in groups like ('Failed', alarm id) or 'Launching'.  Add them in any order, then sort() them
+    # before counting.
+    def __init__(self):
+        self.times_by_group = {}
+
+    def add(self, group, time_us):
+        if group not in self.times_by_group:
+            self.times_by_group[group] = array('q')
+        self.times_by_group[group].append(time_us)
+
+    def sort(self):
+        for group, times in self.times_by_group.items():
+            self.times_by_group[group] = array('q', sorted(times))
+
+    # Returns the groups, in the order their first events were added.
+    def groups(self):
+        return self.times_by_group.keys()
+
+    # Returns the range of positions in the group's sorted times that are within the window.
+    def window_range(self, group, window):
+        times = self.times_by_group.get(group, ())
+        lo = 0 if window.since_us is None else bisect.bisect_left(times, window.since_us)
+        hi = len(times) if window.until_us is None else bisect.bisect_left(times, window.until_us, lo)
+        return times, lo, hi
+
+    # Returns the number of events of the group within the window.
+    def count(self, group, window):
+        times, lo, hi = self.window_range(group, window)
+        return hi - lo
+
+    # Returns the time of the group's earliest event within the window, or None if there is none.
+    def earliest(self, group, window):
+        times, lo, hi = self.window_range(group, window)
+        return times[lo] if lo < hi else None
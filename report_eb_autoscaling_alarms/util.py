@@ -1,11 +1,11 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import contextvars
+import itertools
 import pytz
 import os
 import errno
-
-
-def quote(arg):
-    return '"{}"'.format(arg)
+from report_eb_autoscaling_alarms import aws_target
 
 
 def ensure_tz(date):
@@ -26,4 +26,40 @@ def ensure_path_exists(path):
                     raise
 
 
+# Calls fn on each of args using up to 'workers' threads, and returns the results in the same order as args.
+# With workers <= 1 the calls are made serially on the calling thread.  The first exception raised by fn is re-raised.
+# Each call runs in a copy of the caller's context, so it sees the caller's current aws_target.
+def parallel_map(fn, args, workers=1):
+    if workers <= 1:
+        return [fn(arg) for arg in args]
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda arg: context.copy().run(fn, arg), args))
+
+
+# Splits args into about CHUNKS_PER_JOB chunks per job, so that one slow chunk does not leave the other jobs idle.
+CHUNKS_PER_JOB = 4
+
+
+# Calls fn on chunks of args using up to 'jobs' worker processes, and returns the results of all the chunks
+# concatenated in the same order as args.  fn takes a list of args and returns a list of results; it, the args and the
+# results must be picklable, so pass names or small dicts rather than large data.  Each worker process first calls
+# initializer(*initargs).  With jobs <= 1, fn is called once on all of args in this process.
+def process_map_chunks(fn, args, jobs=1, initializer=None, initargs=()):
+    args = list(args)
+    if jobs <= 1 or len(args) <= 1:
+        return fn(args)
+    chunk_size = -(-len(args) // (jobs * CHUNKS_PER_JOB))
+    chunks = [args[i:i + chunk_size] for i in range(0, len(args), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        return list(itertools.chain.from_iterable(executor.map(fn, chunks)))
+
+
 OUTPUT_DIR = './output'
+
+
+# Returns the dir to write the current aws_target's CSVs in: OUTPUT_DIR, or its subdir named by the target's
+# namespace.
+def output_dir():
+    namespace = aws_target.current().namespace
+    return OUTPUT_DIR + '/' + namespace if namespace else OUTPUT_DIR
@@ -0,0 +1,47 @@
+# Fixtures of the tests: a synthetic fleet (see synthetic_fleet) replayed in place of AWS (see aws_replay), to targets
+# whose cache and output dirs are in a temporary dir.
+#
+# Run from the repo root with: python -m pytest
+
+import pytest
+from report_eb_autoscaling_alarms import aws_cache, aws_replay, aws_target, cache_backends, \
+    cw_describe_alarm_history, output_sink, synthetic_fleet
+
+# A fleet small enough to fetch in a moment, with more items than fit in a replayed page
+FLEET = {'envs': 3, 'asgs_per_env': 1, 'alarms_per_asg': 3, 'history_items': 40, 'activities': 30}
+PAGE_SIZE = 7
+
+
+@pytest.fixture
+def fleet_backend(tmp_path):
+    backend = cache_backends.FileCacheBackend(str(tmp_path / 'fleet'))
+    synthetic_fleet.write_fleet(backend, **FLEET)
+    return backend
+
+
+@pytest.fixture
+def replay_data(fleet_backend):
+    return aws_replay.load_cache(fleet_backend)
+
+
+# Returns a function of (backend name, namespace=None, data=None, profile_name=None, region_name=None) that returns a
+# new aws_target.Target whose clients replay data (by default the fleet), with its cache in that backend.
+@pytest.fixture
+def make_target(tmp_path, monkeypatch, replay_data):
+    monkeypatch.chdir(tmp_path)
+    aws_cache.init_ttls()
+    cw_describe_alarm_history.init_server_side_filter(False)
+    output_sink.init_output('csv')
+
+    def make(backend_name, namespace=None, data=None, profile_name=None, region_name=None):
+        target = aws_target.Target(profile_name, region_name, namespace=namespace)
+        aws_replay.replay_target(target, data or replay_data, page_size=PAGE_SIZE)
+        aws_target.run(target, aws_cache.init_backend, backend_name)
+        return target
+
+    return make
+
+
+@pytest.fixture
+def target(make_target):
+    return make_target('file')
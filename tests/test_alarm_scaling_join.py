@@ -0,0 +1,83 @@
+import random
+from report_eb_autoscaling_alarms import alarm_scaling_join, asg_describe_scaling, aws_target, \
+    cw_describe_alarm_history, cw_describe_alarms, history_records, output_sink, time_windows
+
+MAX_LAG_US = int(alarm_scaling_join.MAX_LAG.total_seconds()) * 1000000
+LAUNCHING, TERMINATING = history_records.ACTIVITY_LAUNCHING, history_records.ACTIVITY_TERMINATING
+
+
+# Matches each activity to the latest action of its alarm at or before it, by looking at every action.
+def brute_force_join(actions, activities):
+    joined = {}
+    for alarm_name, start_us, launch_or_term in activities:
+        alarm_joined = joined.setdefault(alarm_name, {'Launching': 0, 'Terminating': 0, 'Lags': []})
+        alarm_joined['Launching' if launch_or_term == LAUNCHING else 'Terminating'] += 1
+        action_times = [time_us for action_alarm_name, time_us in actions
+                        if action_alarm_name == alarm_name and time_us <= start_us]
+        if action_times and start_us - max(action_times) <= MAX_LAG_US:
+            alarm_joined['Lags'].append(start_us - max(action_times))
+    for alarm_joined in joined.values():
+        alarm_joined['Lags'].sort()
+    return joined
+
+
+def test_join_matches_brute_force():
+    rnd = random.Random(1)
+    for trial in range(300):
+        alarm_names = ['alarm-{}'.format(i) for i in range(rnd.randint(1, 4))]
+        actions = [(rnd.choice(alarm_names), rnd.randint(0, 3 * MAX_LAG_US)) for _ in range(rnd.randint(0, 15))]
+        activities = [(rnd.choice(alarm_names), rnd.randint(0, 4 * MAX_LAG_US), rnd.choice([LAUNCHING, TERMINATING]))
+                      for _ in range(rnd.randint(0, 15))]
+        # Ties of an action and an activity at the same time
+        if actions and activities:
+            activities.append((actions[0][0], actions[0][1], LAUNCHING))
+        expected = brute_force_join(actions, activities)
+        assert alarm_scaling_join.join_actions_and_activities(list(actions), list(activities)) == expected, trial
+
+
+def test_percentile_is_nearest_rank():
+    assert alarm_scaling_join.percentile([1], 50) == 1
+    assert alarm_scaling_join.percentile([1, 2, 3, 4], 50) == 2
+    assert alarm_scaling_join.percentile([1, 2, 3, 4], 90) == 4
+    assert alarm_scaling_join.percentile(list(range(1, 101)), 99) == 99
+
+
+def summarize(window=None, with_dimensions=False):
+    alarms = cw_describe_alarm_history.get_report_alarms()
+    asg_names = [asg_env_pair['ASG']['AutoScalingGroups'][0]['AutoScalingGroupName']
+                 for asg_env_pair in asg_describe_scaling.lookup_beanstalk_asg_env_pairs(False)]
+    alarm_records = (cw_describe_alarm_history.get_history_records(alarm['AlarmName']) for alarm in alarms)
+    asg_records = (asg_describe_scaling.get_scaling_activity_records(asg_name) for asg_name in asg_names)
+    dimensions = [cw_describe_alarms.get_alarm_dimension(alarm) for alarm in alarms] if with_dimensions else None
+    return alarm_scaling_join.summarize_alarm_scaling(alarms, alarm_records, asg_records, window, dimensions)
+
+
+def test_summary_counts_each_alarms_actions_and_activities(target):
+    summary_rows = aws_target.run(target, summarize)
+    assert aws_target.run(target, summarize, None, True) == summary_rows
+    assert [summary_row['AlarmName'] for summary_row in summary_rows] == \
+        [alarm['AlarmName'] for alarm in aws_target.run(target, cw_describe_alarm_history.get_report_alarms)]
+    assert any(summary_row['NumActivityMatched'] for summary_row in summary_rows)
+    for summary_row in summary_rows:
+        assert summary_row['EnvName'].startswith('synthetic-env-')
+        assert summary_row['NumActivityMatched'] <= \
+            summary_row['NumActivityLaunching'] + summary_row['NumActivityTerminating']
+        if summary_row['NumActivityMatched']:
+            lags = [summary_row['LagP{}Secs'.format(percent)] for percent in alarm_scaling_join.LAG_PERCENTILES]
+            assert lags == sorted(lags) and lags[-1] <= summary_row['LagMaxSecs'] <= MAX_LAG_US / 1000000
+
+
+def test_window_counts_only_what_is_within_it(target):
+    summary_rows = aws_target.run(target, summarize)
+    assert aws_target.run(target, summarize, time_windows.Window('')) == summary_rows
+    empty_rows = aws_target.run(target, summarize, time_windows.Window('', 0, 1))
+    for summary_row in empty_rows:
+        assert (summary_row['NumActionSuccess'], summary_row['NumActivityLaunching'],
+                summary_row['NumActivityTerminating'], summary_row['NumActivityMatched']) == (0, 0, 0, 0)
+
+
+def test_written_report_has_a_row_per_alarm(target):
+    aws_target.run(target, alarm_scaling_join.calc_and_write_alarm_scaling)
+    rows = list(output_sink.read_rows('output/' + output_sink.file_name('alarm_scaling')))
+    assert list(rows[0]) == alarm_scaling_join.COLUMNS
+    assert len(rows) == len(aws_target.run(target, cw_describe_alarm_history.get_report_alarms))
@@ -0,0 +1,130 @@
+from array import array
+from datetime import datetime
+import ast
+import json
+import random
+import zipfile
+import pytz
+from report_eb_autoscaling_alarms import alarm_timeline, aws_target, cw_describe_alarm_history, history_records, \
+    state_durations, time_windows
+
+SECOND_US = 1000000
+
+
+# The whole seconds of each group's intervals in each bucket, one bucket and interval at a time.
+def brute_force_rows(durations, start_us, bucket_us, num_buckets, since_us, until_us):
+    rows = [[0] * num_buckets for _ in range(durations.num_alarms * state_durations.NUM_STATES)]
+    for group, interval_start_us, interval_end_us in zip(durations.groups, durations.start_us, durations.end_us):
+        for bucket in range(num_buckets):
+            bucket_start_us = start_us + bucket * bucket_us
+            overlap_us = min(interval_end_us, until_us, bucket_start_us + bucket_us) - \
+                max(interval_start_us, since_us, bucket_start_us)
+            rows[group][bucket] += max(0, overlap_us)
+    return [[us // SECOND_US for us in row] for row in rows]
+
+
+def test_spread_rows_matches_brute_force():
+    rnd = random.Random(1)
+    for trial in range(300):
+        num_alarms = rnd.randint(0, 3)
+        durations = state_durations.StateDurations(num_alarms)
+        bucket_us = rnd.choice([1, 2, 60]) * SECOND_US
+        for _ in range(rnd.randint(0, 20) if num_alarms else 0):
+            start_us = rnd.randint(-20 * bucket_us, 60 * bucket_us) + rnd.randint(0, SECOND_US)
+            durations.add_interval(rnd.randrange(num_alarms), rnd.randrange(state_durations.NUM_STATES), start_us,
+                                   start_us + rnd.randint(0, 15 * bucket_us))
+        since_us = rnd.randint(-10 * bucket_us, 30 * bucket_us)
+        until_us = since_us + rnd.randint(0, 40 * bucket_us)
+        start_us = since_us - since_us % bucket_us
+        num_buckets = -(-(until_us - start_us) // bucket_us)
+        rows = list(alarm_timeline.spread_rows(durations, start_us, bucket_us, num_buckets, since_us, until_us))
+        assert [list(row) for row in rows] == \
+            brute_force_rows(durations, start_us, bucket_us, num_buckets, since_us, until_us), trial
+
+
+def test_spread_rows_of_intervals_spanning_many_buckets():
+    durations = state_durations.StateDurations(1)
+    durations.add_interval(0, history_records.STATE_ALARM, 90 * SECOND_US, 100000 * SECOND_US)
+    rows = list(alarm_timeline.spread_rows(durations, 0, 3600 * SECOND_US, 10, 0, 36000 * SECOND_US))
+    assert list(rows[history_records.STATE_ALARM]) == [3600 - 90] + [3600] * 9
+    assert list(rows[history_records.STATE_OK]) == [0] * 10
+
+
+def test_intervals_ending_before_they_start_count_nowhere():
+    hour_us = 3600 * SECOND_US
+    durations = state_durations.StateDurations(1)
+    # A StateUpdate whose newState started an hour before its oldState
+    durations.add_state_update(0, history_records.HistoryRecord(
+        history_records.KIND_STATE_UPDATE, 6 * hour_us, history_records.STATE_ALARM, 5 * hour_us,
+        history_records.STATE_OK, 4 * hour_us))
+    durations.add_interval(0, history_records.STATE_OK, 4 * hour_us, 4 * hour_us)
+    assert durations.latest_state(0) == (history_records.STATE_OK, 4 * hour_us)
+    rows = list(alarm_timeline.spread_rows(durations, 0, hour_us, 8, 0, 8 * hour_us))
+    assert [list(row) for row in rows] == [[0] * 8] * state_durations.NUM_STATES
+    assert list(durations.sum_by_alarm()) == [0] * state_durations.NUM_STATES
+    assert list(state_durations.StateIndex(durations).sum_by_alarm(time_windows.Window('', 0, 8 * hour_us))) == \
+        [0] * state_durations.NUM_STATES
+
+
+def test_timeline_of_out_of_order_history_items(target, replay_data):
+    alarm_name = aws_target.run(target, cw_describe_alarm_history.get_report_alarms)[0]['AlarmName']
+    items = replay_data.responses[('describe_alarm_history', alarm_name)]
+    state_update = next(item for item in items if item['HistoryItemType'] == 'StateUpdate')
+    history_data = json.loads(state_update['HistoryData'])
+    old_reason_data, new_reason_data = (history_data[state]['stateReasonData'] for state in ['oldState', 'newState'])
+    # Swap the start dates, so that the newState started before the oldState
+    old_start_date = old_reason_data['startDate']
+    old_reason_data['startDate'] = new_reason_data['startDate']
+    new_reason_data['startDate'] = old_start_date
+    items[items.index(state_update)] = dict(state_update, HistoryData=json.dumps(history_data))
+
+    now = pytz.utc.localize(datetime(2017, 2, 1))
+    aws_target.run(target, alarm_timeline.calc_and_write_alarm_timeline, 6 * 3600 * SECOND_US, False, 1, False, None,
+                   None, now)
+    arrays = load_npz('output/cw_alarm_timeline.npz')
+    assert alarm_name in arrays['alarm_name'][1]
+
+
+def load_npz(path):
+    arrays = {}
+    with zipfile.ZipFile(str(path)) as npz_file:
+        for name in npz_file.namelist():
+            data = npz_file.read(name)
+            assert data[:8] == b'\x93NUMPY\x01\x00'
+            header_len = int.from_bytes(data[8:10], 'little')
+            assert (10 + header_len) % 64 == 0
+            header = ast.literal_eval(data[10:10 + header_len].decode('latin1'))
+            body = data[10 + header_len:]
+            if header['descr'].startswith('<U'):
+                width = int(header['descr'][2:]) * 4
+                values = [body[i:i + width].decode('utf-32-le').rstrip('\0') for i in range(0, len(body), width)]
+            else:
+                values = array({'<u4': 'I', '<i8': 'q'}[header['descr']], body).tolist()
+            arrays[name[:-len('.npy')]] = (header['shape'], values)
+    return arrays
+
+
+def test_timeline_file_holds_every_alarms_time_in_state(target):
+    now = pytz.utc.localize(datetime(2017, 2, 1))
+    bucket_us = 6 * 3600 * SECOND_US
+    aws_target.run(target, alarm_timeline.calc_and_write_alarm_timeline, bucket_us, False, 1, False, None, None, now)
+    arrays = load_npz('output/cw_alarm_timeline.npz')
+
+    alarms = aws_target.run(target, cw_describe_alarm_history.get_report_alarms)
+    num_buckets = len(arrays['bucket_start'][1])
+    assert arrays['seconds_in_state'][0] == (len(alarms), state_durations.NUM_STATES, num_buckets)
+    assert arrays['alarm_name'][1] == [alarm['AlarmName'] for alarm in alarms]
+    assert arrays['state_name'][1] == list(history_records.STATE_NAMES)
+    bucket_starts = arrays['bucket_start'][1]
+    assert all(later - earlier == bucket_us // SECOND_US for earlier, later in zip(bucket_starts, bucket_starts[1:]))
+
+    # Every alarm is in some state at every moment from its first state interval on, so its buckets after that are
+    # full, save for the rounding down of partial seconds.
+    seconds_in_state = arrays['seconds_in_state'][1]
+    for alarm_id in range(len(alarms)):
+        first = alarm_id * state_durations.NUM_STATES * num_buckets
+        totals = [sum(seconds_in_state[first + state * num_buckets + bucket]
+                      for state in range(state_durations.NUM_STATES)) for bucket in range(num_buckets)]
+        first_bucket = next(bucket for bucket, total in enumerate(totals) if total)
+        for total in totals[first_bucket + 1:-1]:
+            assert bucket_us // SECOND_US - state_durations.NUM_STATES < total <= bucket_us // SECOND_US
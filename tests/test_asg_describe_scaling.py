@@ -0,0 +1,172 @@
+from datetime import timedelta
+import collections
+import conftest
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_target, operation_client
+
+
+def scaling_asg_name(replay_data):
+    return next(name for operation, name in replay_data.responses if operation == 'describe_scaling_activities')
+
+
+def count_calls(target):
+    counts = collections.Counter()
+
+    def counted_call(operation_name, operation_fn, *args, **kwargs):
+        counts[operation_name] += 1
+        return operation_fn(*args, **kwargs)
+
+    target.set_client('autoscaling', operation_client.OperationClient('autoscaling', target.client('autoscaling'),
+                                                                      counted_call))
+    return counts
+
+
+def fetch(target, asg_name, incremental=True):
+    list(aws_target.run(target, asg_describe_scaling.get_scaling_activity_pages, asg_name, True, incremental))
+
+
+def cached_activities(target, asg_name):
+    return [scaling_activity
+            for activity_page in aws_target.run(target, asg_describe_scaling.get_scaling_activity_pages, asg_name)
+            for scaling_activity in activity_page['Activities']]
+
+
+def add_activity(replay_data, asg_name, activity_id):
+    activities = replay_data.responses[('describe_scaling_activities', asg_name)]
+    activities.insert(0, dict(activities[0], ActivityId=activity_id,
+                              StartTime=activities[0]['StartTime'] + timedelta(minutes=5)))
+
+
+def test_incremental_refresh_stops_at_cached_activities(target, replay_data):
+    asg_name = scaling_asg_name(replay_data)
+    fetch(target, asg_name)
+    cached = cached_activities(target, asg_name)
+    assert len(cached) == len(replay_data.responses[('describe_scaling_activities', asg_name)])
+
+    counts = count_calls(target)
+    add_activity(replay_data, asg_name, 'new-1')
+    add_activity(replay_data, asg_name, 'new-2')
+    fetch(target, asg_name)
+    assert counts['autoscaling.describe_scaling_activities'] == 1
+    assert [scaling_activity['ActivityId'] for scaling_activity in cached_activities(target, asg_name)] == \
+        ['new-2', 'new-1'] + [scaling_activity['ActivityId'] for scaling_activity in cached]
+
+
+def test_incremental_refresh_updates_in_progress_activities(target, replay_data):
+    asg_name = scaling_asg_name(replay_data)
+    activities = replay_data.responses[('describe_scaling_activities', asg_name)]
+    # Past the first page, so that the refresh has to paginate on to see it again
+    pending_at = conftest.PAGE_SIZE + 2
+    activities[pending_at] = dict(activities[pending_at], StatusCode='InProgress', Progress=30)
+    key = 'describe_scaling_activities-' + asg_name
+    fetch(target, asg_name)
+    stamp = aws_target.run(target, aws_cache.cache_stamp, key)
+
+    # Seen again, but no further along
+    counts = count_calls(target)
+    fetch(target, asg_name)
+    assert counts['autoscaling.describe_scaling_activities'] == 2
+    assert aws_target.run(target, aws_cache.cache_stamp, key) == stamp
+
+    activities[pending_at] = dict(activities[pending_at], StatusCode='Successful', Progress=100)
+    fetch(target, asg_name)
+    cached = cached_activities(target, asg_name)
+    assert [scaling_activity['ActivityId'] for scaling_activity in cached] == \
+        [scaling_activity['ActivityId'] for scaling_activity in activities]
+    assert cached[pending_at]['StatusCode'] == 'Successful'
+
+
+def test_incremental_refresh_without_new_activities_leaves_the_entry(make_target, replay_data):
+    target = make_target('sqlite')
+    asg_name = scaling_asg_name(replay_data)
+    key = 'describe_scaling_activities-' + asg_name
+    fetch(target, asg_name)
+    stamp = aws_target.run(target, aws_cache.cache_stamp, key)
+    fetch(target, asg_name)
+    assert aws_target.run(target, aws_cache.cache_stamp, key) == stamp
+
+
+def test_asgs_are_described_in_batches_and_cached_one_by_one(target, replay_data):
+    asgs = replay_data.responses[('describe_auto_scaling_groups', None)]
+    asg = next(iter(asgs.values()))
+    asg_names = ['batched-asg-{}'.format(i) for i in range(2 * asg_describe_scaling.ASG_NAMES_PER_REQUEST + 20)]
+    for asg_name in asg_names:
+        asgs[asg_name] = dict(asg, AutoScalingGroupName=asg_name)
+    requests = []
+
+    def recorded_call(operation_name, operation_fn, *args, **kwargs):
+        requests.append(kwargs)
+        return operation_fn(*args, **kwargs)
+
+    target.set_client('autoscaling', operation_client.OperationClient('autoscaling', target.client('autoscaling'),
+                                                                      recorded_call))
+    found = aws_target.run(target, asg_describe_scaling.get_asgs, asg_names + asg_names[:5], False, 2)
+    assert sorted(found) == sorted(asg_names)
+    assert sorted(len(request['AutoScalingGroupNames']) for request in requests) == [20, 50, 50]
+    assert all(request['MaxRecords'] == asg_describe_scaling.ASG_MAX_RECORDS for request in requests)
+    for asg_name in asg_names:
+        cached = aws_target.run(target, aws_cache.cache_lookup, 'describe_auto_scaling_groups-' + asg_name)
+        assert [cached_asg['AutoScalingGroupName'] for cached_asg in cached['AutoScalingGroups']] == [asg_name]
+
+    # All cached now
+    aws_target.run(target, asg_describe_scaling.get_asgs, asg_names)
+    assert len(requests) == 3
+
+
+def test_missing_asgs_are_not_cached(target, replay_data):
+    asg_name = scaling_asg_name(replay_data)
+    counts = count_calls(target)
+    for attempt in range(2):
+        found = aws_target.run(target, asg_describe_scaling.get_asgs, [asg_name, 'deleted-asg'])
+        assert list(found) == [asg_name]
+        assert not aws_target.run(target, aws_cache.has_key, 'describe_auto_scaling_groups-deleted-asg')
+    # The second time, only the missing ASG is asked for again.
+    assert counts['autoscaling.describe_auto_scaling_groups'] == 2
+
+
+def test_incremental_refresh_replaces_pending_activities_next_to_new_ones(target, replay_data):
+    asg_name = scaling_asg_name(replay_data)
+    activities = replay_data.responses[('describe_scaling_activities', asg_name)]
+    activities[1] = dict(activities[1], StatusCode='InProgress', Progress=50)
+    fetch(target, asg_name)
+    records = list(aws_target.run(target, asg_describe_scaling.get_scaling_activity_records, asg_name))
+    assert records[1].status_code == 'InProgress'
+
+    activities[1] = dict(activities[1], StatusCode='Failed', Progress=100)
+    add_activity(replay_data, asg_name, 'new-1')
+    fetch(target, asg_name)
+    cached = cached_activities(target, asg_name)
+    assert [scaling_activity['ActivityId'] for scaling_activity in cached] == \
+        [scaling_activity['ActivityId'] for scaling_activity in activities]
+    assert [scaling_activity['StatusCode'] for scaling_activity in cached] == \
+        [scaling_activity['StatusCode'] for scaling_activity in activities]
+    records = list(aws_target.run(target, asg_describe_scaling.get_scaling_activity_records, asg_name))
+    assert [record.status_code for record in records] == \
+        [scaling_activity['StatusCode'] for scaling_activity in activities]
+    assert records[2].status_code == 'Failed'
+
+
+def test_env_asgs_are_looked_up_in_one_paginated_batch(target, monkeypatch):
+    monkeypatch.setattr(asg_describe_scaling, 'ASG_MAX_RECORDS', 2)
+    counts = count_calls(target)
+    asg_env_pairs = aws_target.run(target, asg_describe_scaling.lookup_beanstalk_asg_env_pairs, True)
+    assert len(asg_env_pairs) == conftest.FLEET['envs'] * conftest.FLEET['asgs_per_env']
+    # One batch of the fleet's ASGs, in pages of 2
+    assert counts['autoscaling.describe_auto_scaling_groups'] == (len(asg_env_pairs) + 1) // 2
+    for asg_env_pair in asg_env_pairs:
+        asg_name = asg_env_pair['ASG']['AutoScalingGroups'][0]['AutoScalingGroupName']
+        assert len(asg_env_pair['ASG']['AutoScalingGroups']) == 1
+        assert aws_target.run(target, aws_cache.cache_lookup, 'describe_auto_scaling_groups-' + asg_name) == \
+            asg_env_pair['ASG']
+        assert aws_target.run(target, asg_describe_scaling.get_asg, asg_name) == asg_env_pair['ASG']
+    assert counts['autoscaling.describe_auto_scaling_groups'] == (len(asg_env_pairs) + 1) // 2
+
+
+def test_cached_misses_of_older_versions_are_fetched_again(target, replay_data):
+    asg_name = scaling_asg_name(replay_data)
+    key = 'describe_auto_scaling_groups-' + asg_name
+    aws_target.run(target, aws_cache.cache_put, key, {'AutoScalingGroups': []})
+    counts = count_calls(target)
+    asg = aws_target.run(target, asg_describe_scaling.get_asg, asg_name)
+    assert asg['AutoScalingGroups'][0]['AutoScalingGroupName'] == asg_name
+    assert aws_target.run(target, aws_cache.cache_lookup, key) == asg
+    assert counts['autoscaling.describe_auto_scaling_groups'] == 1
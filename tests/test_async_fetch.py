@@ -0,0 +1,60 @@
+import threading
+from pathlib import Path
+from report_eb_autoscaling_alarms import async_fetch, aws_replay, aws_target, bench_fetch, operation_client
+import conftest
+
+LATENCY = 0.005
+CONCURRENCY = 3
+
+
+# Makes every call of the target's clients take LATENCY, and keeps track in the returned dict of service name => the
+# most calls of that service in flight at once.
+def replay_with_latency(target, replay_data):
+    aws_replay.replay_target(target, replay_data, page_size=conftest.PAGE_SIZE, latency=LATENCY)
+    lock = threading.Lock()
+    in_flight = {service: 0 for service in async_fetch.SERVICES}
+    max_in_flight = dict(in_flight)
+
+    def counted_call(operation_name, operation_fn, *args, **kwargs):
+        service = operation_name.split('.')[0]
+        with lock:
+            in_flight[service] += 1
+            max_in_flight[service] = max(max_in_flight[service], in_flight[service])
+        try:
+            return operation_fn(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[service] -= 1
+
+    for service in async_fetch.SERVICES:
+        target.set_client(service, operation_client.OperationClient(service, target.client(service), counted_call))
+    return max_in_flight
+
+
+# Returns the bytes of each file in the cache dir of the namespace, by name.
+def cache_files(namespace):
+    return {cfile.name: cfile.read_bytes() for cfile in Path('cache', namespace).iterdir()}
+
+
+def test_async_fill_caches_the_same_bytes_as_the_sync_fill(make_target, replay_data):
+    sync_target = make_target('file', 'sync')
+    replay_with_latency(sync_target, replay_data)
+    aws_target.run(sync_target, bench_fetch.fill_sync, CONCURRENCY)
+    async_target = make_target('file', 'async')
+    replay_with_latency(async_target, replay_data)
+    aws_target.run(async_target, bench_fetch.fill_async, CONCURRENCY)
+
+    sync_files, async_files = cache_files('sync'), cache_files('async')
+    assert any(name.startswith('describe_alarm_history-') for name in sync_files)
+    assert any(name.startswith('describe_scaling_activities-') for name in sync_files)
+    assert sorted(async_files) == sorted(sync_files)
+    for name in sync_files:
+        assert async_files[name] == sync_files[name], name
+
+
+def test_async_fill_keeps_each_service_within_its_concurrency(target, replay_data):
+    max_in_flight = replay_with_latency(target, replay_data)
+    aws_target.run(target, async_fetch.fill_cache, bench_fetch.ALL_OBJECT_TYPES, bench_fetch.ALL_CSVS, CONCURRENCY)
+    assert all(max_in_flight[service] <= CONCURRENCY for service in async_fetch.SERVICES), max_in_flight
+    # The alarm histories, the env resources and the scaling activities are each fetched CONCURRENCY at a time
+    assert all(max_in_flight[service] == CONCURRENCY for service in async_fetch.SERVICES), max_in_flight
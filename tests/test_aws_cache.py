@@ -0,0 +1,146 @@
+import collections
+import os
+import time
+import pytest
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_target, cache_backends, \
+    cw_describe_alarm_history, operation_client
+
+HOUR = 3600
+
+
+# Returns a Counter of the calls of each AWS operation that the target makes from now on.
+def count_calls(target):
+    counts = collections.Counter()
+
+    def counted_call(operation_name, operation_fn, *args, **kwargs):
+        counts[operation_name] += 1
+        return operation_fn(*args, **kwargs)
+
+    for service_name in ['cloudwatch', 'autoscaling', 'elasticbeanstalk']:
+        target.set_client(service_name, operation_client.OperationClient(service_name, target.client(service_name),
+                                                                         counted_call))
+    return counts
+
+
+# Makes the entry look as if it had been fetched seconds ago.
+def age(backend, key, seconds):
+    fetched_at = time.time() - seconds
+    if isinstance(backend, cache_backends.FileCacheBackend):
+        os.utime(str(backend.entry_path(key)), (fetched_at, fetched_at))
+    else:
+        with backend.connection() as conn:
+            conn.execute('UPDATE cache_entries SET fetched_at = ? WHERE key = ?', (fetched_at, key))
+
+
+# The keys of the histories and activities that an incremental refresh updates.
+def incremental_keys():
+    keys = [cw_describe_alarm_history.history_key(alarm['AlarmName'])
+            for alarm in cw_describe_alarm_history.get_report_alarms()]
+    keys += ['describe_scaling_activities-' + asg_env_pair['ASG']['AutoScalingGroups'][0]['AutoScalingGroupName']
+             for asg_env_pair in asg_describe_scaling.lookup_beanstalk_asg_env_pairs(False)]
+    return keys
+
+
+def refresh_incrementally():
+    for key in incremental_keys():
+        if key.startswith('describe_scaling_activities-'):
+            list(asg_describe_scaling.get_scaling_activity_pages(key.partition('-')[2], False, True))
+        else:
+            list(cw_describe_alarm_history.get_history_pages(key.partition('-')[2], False, True))
+
+
+@pytest.mark.parametrize('backend_name', aws_cache.BACKEND_NAMES)
+def test_refresh_that_finds_nothing_new_is_fresh_for_the_ttl(make_target, backend_name):
+    target = make_target(backend_name)
+    aws_target.run(target, refresh_incrementally)
+    keys = aws_target.run(target, incremental_keys)
+    backend = aws_target.run(target, aws_cache.get_backend)
+    for key in keys:
+        age(backend, key, 2 * HOUR)
+    stamps = [backend.stamp(key) for key in keys]
+
+    # Expired, so refetched, but with nothing new
+    aws_target.run(target, aws_cache.init_ttls, {'alarm_history': HOUR, 'scaling': HOUR}, True)
+    counts = count_calls(target)
+    aws_target.run(target, refresh_incrementally)
+    assert counts['cloudwatch.describe_alarm_history'] and counts['autoscaling.describe_scaling_activities']
+    assert [backend.stamp(key) for key in keys] == stamps
+    assert all(time.time() - backend.fetched_at(key) < HOUR for key in keys)
+    refresh_report = aws_target.run(target, aws_cache.get_refresh_report)
+    assert [refresh_report[key] for key in keys] == ['refreshed'] * len(keys)
+
+    # The next run is within the TTL
+    aws_target.run(target, aws_cache.init_ttls, {'alarm_history': HOUR, 'scaling': HOUR}, True)
+    counts.clear()
+    aws_target.run(target, refresh_incrementally)
+    assert not counts
+    refresh_report = aws_target.run(target, aws_cache.get_refresh_report)
+    assert [refresh_report[key] for key in keys] == ['served'] * len(keys)
+
+
+def test_sqlite_cache_from_before_touch_gets_written_at(tmp_path):
+    db_path = str(tmp_path / 'cache.sqlite')
+    backend = cache_backends.SqliteCacheBackend(db_path)
+    backend.put('describe_environments', {'Environments': []}, 1000.0)
+    with backend.connection() as conn:
+        conn.execute('CREATE TABLE old_entries AS SELECT key, type, fetched_at, size, data FROM cache_entries')
+        conn.execute('DROP TABLE cache_entries')
+        conn.execute('ALTER TABLE old_entries RENAME TO cache_entries')
+
+    backend = cache_backends.SqliteCacheBackend(db_path)
+    assert backend.stamp('describe_environments')[1] == backend.fetched_at('describe_environments') == 1000.0
+    backend.touch('describe_environments')
+    assert backend.stamp('describe_environments')[1] == 1000.0
+    assert backend.fetched_at('describe_environments') > 1000.0
+
+
+def memo_count_deltas(counts_before):
+    return {name: aws_cache.memo_counts[name] - counts_before[name] for name in counts_before}
+
+
+@pytest.mark.parametrize('backend_name', aws_cache.BACKEND_NAMES)
+def test_memo_serves_decoded_entries_until_they_are_rewritten(make_target, backend_name):
+    target = make_target(backend_name)
+    key = 'describe_environment_resources-env'
+    aws_target.run(target, aws_cache.cache_put, key, {'EnvironmentResources': {'Instances': []}})
+    counts_before = dict(aws_cache.memo_counts)
+    value = aws_target.run(target, aws_cache.cache_lookup, key)
+    assert aws_target.run(target, aws_cache.cache_lookup, key) is value
+    assert memo_count_deltas(counts_before) == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+    # Rewritten behind the memo's back, e.g. by another process
+    new_value = {'EnvironmentResources': {'Instances': [{'Id': 'i-1'}]}}
+    aws_target.run(target, aws_cache.get_backend).put(key, new_value)
+    assert aws_target.run(target, aws_cache.cache_lookup, key) == new_value
+    # Touched: fresh again, but unchanged
+    aws_target.run(target, aws_cache.get_backend).touch(key)
+    assert aws_target.run(target, aws_cache.cache_lookup, key) == new_value
+    assert memo_count_deltas(counts_before) == {'hits': 2, 'misses': 2, 'evictions': 0}
+
+    aws_target.run(target, aws_cache.cache_delete, key)
+    assert aws_target.run(target, aws_cache.cache_lookup, key) is None
+
+
+def test_memo_evicts_the_least_recently_used_entries_past_its_size(target, monkeypatch):
+    keys = ['describe_environment_resources-env-{}'.format(i) for i in range(3)]
+    for key in keys:
+        aws_target.run(target, aws_cache.cache_put, key, {'EnvironmentResources': {'Instances': []}})
+    entry_size = aws_target.run(target, aws_cache.cache_stamp, keys[0])[0]
+    monkeypatch.setattr(aws_cache, 'MEMO_MAX_BYTES', 2 * entry_size)
+    aws_cache.memo_clear()
+    counts_before = dict(aws_cache.memo_counts)
+    for key in [keys[0], keys[1], keys[0], keys[2]]:
+        aws_target.run(target, aws_cache.cache_lookup, key)
+    # keys[1] was the least recently used when keys[2] came in.
+    assert memo_count_deltas(counts_before) == {'hits': 1, 'misses': 3, 'evictions': 1}
+    for key in [keys[0], keys[2], keys[1]]:
+        aws_target.run(target, aws_cache.cache_lookup, key)
+    assert memo_count_deltas(counts_before) == {'hits': 3, 'misses': 4, 'evictions': 2}
+
+    # An entry bigger than the whole memo is not memoized.
+    instances = [{'Id': 'i-{}'.format(i)} for i in range(10)]
+    aws_target.run(target, aws_cache.cache_put, keys[0], {'EnvironmentResources': {'Instances': instances}})
+    assert aws_target.run(target, aws_cache.cache_stamp, keys[0])[0] > aws_cache.MEMO_MAX_BYTES
+    for _ in range(2):
+        aws_target.run(target, aws_cache.cache_lookup, keys[0])
+    assert memo_count_deltas(counts_before) == {'hits': 3, 'misses': 6, 'evictions': 2}
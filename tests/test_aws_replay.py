@@ -0,0 +1,84 @@
+import time
+from pathlib import Path
+import pytest
+from botocore.exceptions import ClientError
+from report_eb_autoscaling_alarms import aws_replay, aws_target, bench_fetch, util
+
+
+def cache_files(namespace):
+    return {cfile.name: cfile.read_bytes() for cfile in Path('cache', namespace).iterdir()}
+
+
+def test_replayed_recording_fetches_the_same_cache(make_target):
+    recorded_target = make_target('file', 'recorded')
+    recording_filename = aws_replay.record_target(recorded_target, 'recording')
+    aws_target.run(recorded_target, bench_fetch.fill_sync, 1)
+
+    replayed_target = make_target('file', 'replayed', aws_replay.load_recording(recording_filename))
+    aws_target.run(replayed_target, bench_fetch.fill_sync, 1)
+    recorded_files, replayed_files = cache_files('recorded'), cache_files('replayed')
+    assert any(name.startswith('describe_alarm_history-') for name in recorded_files)
+    assert sorted(replayed_files) == sorted(recorded_files)
+    for name in recorded_files:
+        assert replayed_files[name] == recorded_files[name], name
+
+
+# Returns the items of every page of the operation, and the number of pages.
+def paginate(client, operation, **params):
+    items_name = aws_replay.OPERATIONS[operation][2]
+    items = []
+    num_pages = 0
+    while True:
+        response = getattr(client, operation)(**params)
+        items += response[items_name]
+        num_pages += 1
+        if not response.get('NextToken'):
+            return items, num_pages
+        params['NextToken'] = response['NextToken']
+
+
+def test_replay_pages_and_filters_the_items(replay_data):
+    client = aws_replay.ReplayClient('cloudwatch', replay_data, page_size=7)
+    alarm_name = next(name for operation, name in replay_data.responses if operation == 'describe_alarm_history')
+    recorded = replay_data.responses[('describe_alarm_history', alarm_name)]
+    items, num_pages = paginate(client, 'describe_alarm_history', AlarmName=alarm_name)
+    assert items == recorded and num_pages == (len(recorded) + 6) // 7
+    assert paginate(client, 'describe_alarm_history', AlarmName=alarm_name, MaxRecords=100) == (recorded, 1)
+
+    items = paginate(client, 'describe_alarm_history', AlarmName=alarm_name, HistoryItemType='Action')[0]
+    assert items == [item for item in recorded if item['HistoryItemType'] == 'Action']
+    start_date = util.ensure_tz(recorded[3]['Timestamp'])
+    assert paginate(client, 'describe_alarm_history', AlarmName=alarm_name, StartDate=start_date)[0] == \
+        [item for item in recorded if util.ensure_tz(item['Timestamp']) >= start_date]
+    alarms = paginate(client, 'describe_alarms', AlarmNamePrefix='awseb-')[0]
+    assert alarms and all(alarm['AlarmName'].startswith('awseb-') for alarm in alarms)
+
+    with pytest.raises(ClientError):
+        aws_replay.ReplayClient('elasticbeanstalk', replay_data).describe_environment_resources(EnvironmentName='nope')
+    with pytest.raises(AttributeError):
+        client.describe_scaling_activities
+
+
+def test_replay_latency_and_throttling(replay_data):
+    client = aws_replay.ReplayClient('cloudwatch', replay_data, latency=0.02)
+    start = time.perf_counter()
+    client.describe_alarms()
+    assert time.perf_counter() - start >= 0.02
+
+    client = aws_replay.ReplayClient('cloudwatch', replay_data, throttle_rate=1.0, max_attempts=2, seed=1)
+    retries = []
+    client.meta.events.register('needs-retry.cloudwatch.describe_alarms',
+                                lambda attempts, **kwargs: retries.append(attempts))
+    with pytest.raises(ClientError) as e:
+        client.describe_alarms()
+    assert e.value.response['Error']['Code'] == 'Throttling'
+    assert retries == [1, 2]
+
+    # A second's worth of calls at max_rate goes through, then the next ones are throttled until tokens come back.
+    client = aws_replay.ReplayClient('cloudwatch', replay_data, max_rate=5, seed=1)
+    assert [bool(client.is_throttled('describe_alarms')) for _ in range(6)] == [False] * 5 + [True]
+    assert not client.is_throttled('describe_alarm_history')
+    client.buckets['describe_alarms'][1] -= 1.0
+    assert not client.is_throttled('describe_alarms')
+    response = client.describe_alarm_history(AlarmName='nope')
+    assert response['ResponseMetadata']['RetryAttempts'] == 0
@@ -0,0 +1,136 @@
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+import pytest
+from report_eb_autoscaling_alarms import async_fetch, aws_cache, aws_target, cache_backends, cache_migrate, \
+    cw_describe_alarm_history, daemon, operation_client
+
+ALL_OBJECT_TYPES = ['envs', 'resources', 'alarms', 'alarm_history', 'scaling']
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'file':
+        return cache_backends.FileCacheBackend(str(tmp_path / 'cache'))
+    return cache_backends.SqliteCacheBackend(str(tmp_path / 'cache.sqlite'))
+
+
+def test_entries_round_trip(backend):
+    value = {'Environments': [{'EnvironmentName': 'env, "quoted"', 'DateUpdated': datetime(2017, 1, 2, 3, 4, 5)}]}
+    pages = [{'Activities': [{'ActivityId': str(i)}]} for i in range(3)]
+    backend.put('describe_environments', value)
+    backend.put_pages('describe_scaling_activities-asg', iter(pages))
+    assert backend.get('describe_environments') == value
+    assert list(backend.get_pages('describe_scaling_activities-asg')) == pages
+    assert sorted(backend.keys()) == ['describe_environments', 'describe_scaling_activities-asg']
+    assert backend.has_key('describe_environments')
+    assert backend.get('describe_alarms') is None
+    assert backend.stamp('describe_alarms') is None
+
+    backend.delete('describe_environments')
+    assert not backend.has_key('describe_environments')
+    assert backend.get('describe_environments') is None
+
+
+def test_rewritten_entry_changes_stamp(backend):
+    backend.put_pages('describe_scaling_activities-asg', iter([{'Activities': []}]))
+    stamp = backend.stamp('describe_scaling_activities-asg')
+    assert stamp is not None
+    backend.put_pages('describe_scaling_activities-asg', iter([{'Activities': [{'ActivityId': '1'}]}]))
+    assert backend.stamp('describe_scaling_activities-asg') != stamp
+
+
+def test_failed_put_leaves_the_entry_as_it_was(backend):
+    pages = [{'Activities': [{'ActivityId': str(i)}]} for i in range(3)]
+    backend.put_pages('describe_scaling_activities-asg', iter(pages))
+    backend.put('describe_environments', {'Environments': []})
+
+    def crash_after_a_page():
+        yield {'Activities': []}
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        backend.put_pages('describe_scaling_activities-asg', crash_after_a_page())
+    with pytest.raises(TypeError):
+        backend.put('describe_environments', {'Environments': [object()]})
+    assert list(backend.get_pages('describe_scaling_activities-asg')) == pages
+    assert backend.get('describe_environments') == {'Environments': []}
+    assert sorted(backend.keys()) == ['describe_environments', 'describe_scaling_activities-asg']
+    if isinstance(backend, cache_backends.FileCacheBackend):
+        assert sorted(cfile.name for cfile in Path(backend.cache_dir).iterdir()) == \
+            ['describe_environments.json', 'describe_scaling_activities-asg.jsonl']
+
+
+def test_paged_entries_are_read_a_page_at_a_time(backend, monkeypatch):
+    pages = [{'Activities': [{'ActivityId': str(i)}]} for i in range(5)]
+    backend.put_pages('describe_scaling_activities-asg', iter(pages))
+    loads = json.loads
+    num_decoded = [0]
+
+    def counted_loads(*args, **kwargs):
+        num_decoded[0] += 1
+        return loads(*args, **kwargs)
+
+    monkeypatch.setattr(json, 'loads', counted_loads)
+    activity_pages = backend.get_pages('describe_scaling_activities-asg')
+    assert next(activity_pages) == pages[0]
+    assert num_decoded[0] == 1
+    assert list(activity_pages) == pages[1:]
+    assert num_decoded[0] == len(pages)
+
+
+def test_fetched_pages_are_written_as_they_arrive(make_target, replay_data):
+    target = make_target('sqlite')
+    alarm_name = next(name for operation, name in replay_data.responses if operation == 'describe_alarm_history')
+    db_path = aws_target.run(target, aws_cache.get_backend).db_path
+    pages_written = []
+
+    # Each request finds the pages of the earlier ones written already.
+    def noted_call(operation_name, operation_fn, *args, **kwargs):
+        with sqlite3.connect(db_path) as conn:
+            pages_written.append(conn.execute('SELECT COUNT(*) FROM cache_pages').fetchone()[0])
+        return operation_fn(*args, **kwargs)
+
+    target.set_client('cloudwatch', operation_client.OperationClient('cloudwatch', target.client('cloudwatch'),
+                                                                     noted_call))
+    history_pages = list(aws_target.run(target, cw_describe_alarm_history.get_history_pages, alarm_name, True))
+    assert len(history_pages) > 2
+    assert pages_written == list(range(len(history_pages)))
+
+
+def fill_and_read(target):
+    def fill():
+        async_fetch.fill_cache(ALL_OBJECT_TYPES, daemon.REPORTS, 2)
+        for alarm in cw_describe_alarm_history.get_report_alarms():
+            list(cw_describe_alarm_history.get_history_records(alarm['AlarmName']))
+        backend = aws_cache.get_backend()
+        entries = {}
+        for key in backend.keys():
+            # A paged entry gets as the list of its pages
+            entries[key] = backend.get(key)
+            if key.startswith('records-'):
+                # The header holds the stamp of the raw entry, which is backend-specific
+                entries[key] = entries[key][1:]
+        return entries
+
+    return aws_target.run(target, fill)
+
+
+def test_fetch_caches_the_same_in_either_backend(make_target):
+    file_entries = fill_and_read(make_target('file', 'file'))
+    sqlite_entries = fill_and_read(make_target('sqlite', 'sqlite'))
+    assert file_entries.keys() == sqlite_entries.keys()
+    assert any(key.startswith('describe_alarm_history-') for key in file_entries)
+    assert any(key.startswith('records-describe_alarm_history-') for key in file_entries)
+    for key in file_entries:
+        assert file_entries[key] == sqlite_entries[key], key
+
+
+def test_migrate_copies_every_entry(tmp_path, fleet_backend):
+    cache_migrate.migrate(fleet_backend.cache_dir, str(tmp_path / 'migrated.sqlite'))
+    sqlite_backend = cache_backends.SqliteCacheBackend(str(tmp_path / 'migrated.sqlite'))
+    assert sorted(sqlite_backend.keys()) == sorted(fleet_backend.keys())
+    for key in fleet_backend.keys():
+        assert sqlite_backend.get(key) == fleet_backend.get(key), key
+        assert sqlite_backend.fetched_at(key) == pytest.approx(fleet_backend.fetched_at(key))
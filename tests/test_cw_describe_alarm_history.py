@@ -0,0 +1,105 @@
+import threading
+from datetime import timedelta
+import conftest
+from report_eb_autoscaling_alarms import aws_cache, aws_replay, aws_target, cw_describe_alarm_history, \
+    operation_client, output_sink, time_windows, util
+
+
+def report_alarm_name(target):
+    return aws_target.run(target, cw_describe_alarm_history.get_report_alarms)[0]['AlarmName']
+
+
+def cached_item_ids(target, alarm_name):
+    history_pages = aws_target.run(target, cw_describe_alarm_history.get_history_pages, alarm_name)
+    return [cw_describe_alarm_history.history_item_id(item)
+            for history_page in history_pages for item in history_page['AlarmHistoryItems']]
+
+
+def fetch(target, alarm_name, incremental):
+    return list(aws_target.run(target, cw_describe_alarm_history.get_history_pages, alarm_name, True, incremental))
+
+
+def add_history_item(replay_data, alarm_name, summary):
+    items = replay_data.responses[('describe_alarm_history', alarm_name)]
+    new_item = dict(items[0], Timestamp=items[0]['Timestamp'] + timedelta(minutes=5), HistorySummary=summary)
+    items.insert(0, new_item)
+    return cw_describe_alarm_history.history_item_id(new_item)
+
+
+def test_incremental_refresh_adds_only_new_items(make_target, replay_data):
+    target = make_target('file')
+    alarm_name = report_alarm_name(target)
+    fetch(target, alarm_name, True)
+    cached_ids = cached_item_ids(target, alarm_name)
+    assert len(cached_ids) == len(replay_data.responses[('describe_alarm_history', alarm_name)])
+
+    new_ids = [add_history_item(replay_data, alarm_name, 'first new'),
+               add_history_item(replay_data, alarm_name, 'second new')]
+    fetch(target, alarm_name, True)
+    assert cached_item_ids(target, alarm_name) == new_ids[::-1] + cached_ids
+
+    full_target = make_target('file', 'full')
+    fetch(full_target, alarm_name, False)
+    assert cached_item_ids(full_target, alarm_name) == cached_item_ids(target, alarm_name)
+
+
+def test_incremental_refresh_without_new_items_leaves_the_entry(make_target):
+    target = make_target('sqlite')
+    alarm_name = report_alarm_name(target)
+    key = cw_describe_alarm_history.history_key(alarm_name)
+    fetch(target, alarm_name, True)
+    stamp = aws_target.run(target, aws_cache.cache_stamp, key)
+    cached_ids = cached_item_ids(target, alarm_name)
+
+    fetch(target, alarm_name, True)
+    assert aws_target.run(target, aws_cache.cache_stamp, key) == stamp
+    assert cached_item_ids(target, alarm_name) == cached_ids
+
+
+def test_records_are_decoded_again_after_new_items(target, replay_data):
+    alarm_name = report_alarm_name(target)
+    records = list(aws_target.run(target, cw_describe_alarm_history.get_history_records, alarm_name, True, True))
+    add_history_item(replay_data, alarm_name, 'new')
+    new_records = list(aws_target.run(target, cw_describe_alarm_history.get_history_records, alarm_name, True, True))
+    assert len(new_records) == len(records) + 1
+
+
+# Writes the report of the fleet's history up to its end, at 2017-02-01, refetching every alarm's history with the
+# workers, and returns the CSV.
+def write_history(target, workers):
+    windows = time_windows.make_windows(time_windows.parse_time('2017-01-01T00:00'),
+                                        time_windows.parse_time('2017-02-01T00:00'))
+    aws_target.run(target, cw_describe_alarm_history.calc_and_write_alarm_history_for_eb_autoscaling, True, workers,
+                   False, 1, windows)
+    output_filename = aws_target.run(target, util.output_dir) + '/' + output_sink.file_name('cw_alarm_history')
+    with open(output_filename, encoding='UTF-8', newline='') as output_file:
+        return output_file.read()
+
+
+def test_workers_fetch_histories_at_once_and_write_the_same_report(make_target, replay_data):
+    serial_target = make_target('file', 'serial')
+    serial_report = write_history(serial_target, 1)
+    num_alarms = len(aws_target.run(serial_target, cw_describe_alarm_history.get_report_alarms))
+    assert len(serial_report.splitlines()) == 1 + num_alarms
+
+    target = make_target('file', 'workers')
+    aws_replay.replay_target(target, replay_data, page_size=conftest.PAGE_SIZE, latency=0.005)
+    lock = threading.Lock()
+    in_flight = [0, 0]  # now, most at once
+
+    def counted_call(operation_name, operation_fn, *args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        try:
+            return operation_fn(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    target.set_client('cloudwatch', operation_client.OperationClient('cloudwatch', target.client('cloudwatch'),
+                                                                     counted_call))
+    assert write_history(target, 4) == serial_report
+    assert 1 < in_flight[1] <= 4
+    for alarm in aws_target.run(target, cw_describe_alarm_history.get_report_alarms):
+        assert aws_target.run(target, aws_cache.has_key, cw_describe_alarm_history.history_key(alarm['AlarmName']))
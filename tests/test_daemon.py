@@ -0,0 +1,145 @@
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+import pytest
+from report_eb_autoscaling_alarms import aws_cache, aws_target, cw_describe_alarm_history, daemon, time_windows
+from report_eb_autoscaling_alarms import __main__
+
+
+# Returns a function of path => (HTTP status, body) that gets it from a daemon serving the targets.
+@pytest.fixture
+def serve(make_target):
+    servers = []
+
+    def start(targets):
+        aws_cache.init_ttls({}, True)
+        options = argparse.Namespace(workers=2, refresh_interval=60, refresh_stale=False, recache=[])
+        report_daemon = daemon.ReportDaemon(targets, options)
+        report_daemon.refresh([])
+        server = ThreadingHTTPServer(('127.0.0.1', 0), daemon.ReportHandler)
+        server.report_daemon = report_daemon
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return report_daemon, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def get(base_url, path):
+    try:
+        with urllib.request.urlopen(base_url + path) as response:
+            return response.status, response.read().decode('UTF-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('UTF-8')
+
+
+def test_served_reports_are_the_written_ones(serve, target):
+    report_daemon, base_url = serve([target])
+    # The history of the whole fleet lasts until now, and so differs from one moment to the next, so only the reports
+    # that do not depend on it are compared as a whole.
+    aws_target.run(target, __main__.write_csvs, ['cw_alarms', 'alarm_scaling'], [])
+    for report_name in ['cw_alarms', 'alarm_scaling']:
+        with open('output/{}.csv'.format(report_name), encoding='UTF-8', newline='') as report_file:
+            assert get(base_url, report_name) == (200, report_file.read()), report_name
+
+    # The fleet's history ends at 2017-02-01
+    since, until = '2017-01-20T00:00', '2017-02-01T00:00'
+    windows = time_windows.make_windows(time_windows.parse_time(since), time_windows.parse_time(until))
+    aws_target.run(target, __main__.write_csvs, daemon.REPORTS[1:], [], 1, False, 1, windows)
+    for report_name in daemon.REPORTS[1:]:
+        with open('output/{}.csv'.format(report_name), encoding='UTF-8', newline='') as report_file:
+            assert get(base_url, '{}?since={}&until={}'.format(report_name, since, until)) == \
+                (200, report_file.read()), report_name
+
+
+def test_refresh_carries_over_unchanged_records(serve, target):
+    report_daemon, base_url = serve([target])
+    snapshot = report_daemon.snapshots[target]
+    report_daemon.refresh(daemon.REFRESH_OBJECT_TYPES)
+    new_snapshot = report_daemon.snapshots[target]
+    assert new_snapshot is not snapshot
+    assert all(new_snapshot.history[alarm_name] is records for alarm_name, records in snapshot.history.items())
+    assert all(new_snapshot.activities[asg_name] is records for asg_name, records in snapshot.activities.items())
+
+
+def add_history_item(replay_data, alarm_name):
+    items = replay_data.responses[('describe_alarm_history', alarm_name)]
+    items.insert(0, dict(items[0], Timestamp=items[0]['Timestamp'] + timedelta(minutes=5), HistorySummary='new'))
+
+
+def test_refresh_reads_again_only_the_records_that_changed(serve, target, replay_data):
+    report_daemon, base_url = serve([target])
+    snapshot = report_daemon.snapshots[target]
+    alarm_name = snapshot.report_alarms[0]['AlarmName']
+    add_history_item(replay_data, alarm_name)
+    report_daemon.refresh(daemon.REFRESH_OBJECT_TYPES)
+    new_snapshot = report_daemon.snapshots[target]
+    assert len(new_snapshot.history[alarm_name][1]) == len(snapshot.history[alarm_name][1]) + 1
+    assert new_snapshot.history[alarm_name][0] != snapshot.history[alarm_name][0]
+    assert all(new_snapshot.history[other_name] is records
+               for other_name, records in snapshot.history.items() if other_name != alarm_name)
+
+
+def test_refresh_interval_reloads_the_served_snapshot(serve, target, replay_data):
+    report_daemon, base_url = serve([target])
+    status_key = '{}/{}'.format(target.profile_name, target.region_name)
+    num_records = json.loads(get(base_url, 'status')[1])[status_key]['NumHistoryRecords']
+    alarm_name = report_daemon.snapshots[target].report_alarms[0]['AlarmName']
+    add_history_item(replay_data, alarm_name)
+
+    report_daemon.options.refresh_interval = 0.05
+    refresh_thread = threading.Thread(target=report_daemon.refresh_loop, daemon=True)
+    refresh_thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while json.loads(get(base_url, 'status')[1])[status_key]['NumHistoryRecords'] == num_records:
+            assert time.monotonic() < deadline, 'the snapshot was not reloaded'
+            time.sleep(0.05)
+    finally:
+        report_daemon.stopped.set()
+        refresh_thread.join()
+    assert json.loads(get(base_url, 'status')[1])[status_key]['NumHistoryRecords'] == num_records + 1
+
+
+def test_server_side_filter_serves_and_carries_over_the_filtered_entries(serve, make_target):
+    # The fleet's history ends at 2017-02-01
+    query = 'cw_alarm_history?since=2017-01-20T00:00&until=2017-02-01T00:00'
+    full_daemon, full_url = serve([make_target('file', 'full')])
+    full_rows = get(full_url, query)
+
+    cw_describe_alarm_history.init_server_side_filter(True)
+    target = make_target('file', 'filtered')
+    report_daemon, base_url = serve([target])
+    history_keys = [key for key in aws_target.run(target, aws_cache.get_backend).keys()
+                    if key.startswith('describe_alarm_history')]
+    assert history_keys and all(key.startswith('describe_alarm_history@') for key in history_keys)
+    assert get(base_url, query) == full_rows
+
+    snapshot = report_daemon.snapshots[target]
+    report_daemon.refresh(daemon.REFRESH_OBJECT_TYPES)
+    assert all(report_daemon.snapshots[target].history[alarm_name] is records
+               for alarm_name, records in snapshot.history.items())
+
+
+def test_bad_requests_and_failures(serve, target, monkeypatch):
+    report_daemon, base_url = serve([target])
+    assert get(base_url, 'nope')[0] == 404
+    assert get(base_url, 'cw_alarms?format=xml')[0] == 404
+    assert get(base_url, 'cw_alarms?since=yesterday-ish')[0] == 400
+    assert get(base_url, 'cw_alarms?target=nobody/nowhere')[0] == 400
+
+    def fail(*args):
+        raise ZeroDivisionError()
+
+    monkeypatch.setattr(daemon, 'report_rows', fail)
+    status, body = get(base_url, 'cw_alarms')
+    assert status == 500 and 'see the server log' in body
+    assert get(base_url, 'status')[0] == 200
@@ -0,0 +1,136 @@
+import collections
+import threading
+import time
+import pytest
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_target, eb_by_resource, \
+    operation_client
+
+
+def count_calls(target):
+    counts = collections.Counter()
+
+    def counted_call(operation_name, operation_fn, *args, **kwargs):
+        counts[operation_name] += 1
+        return operation_fn(*args, **kwargs)
+
+    target.set_client('elasticbeanstalk', operation_client.OperationClient(
+        'elasticbeanstalk', target.client('elasticbeanstalk'), counted_call))
+    return counts
+
+
+# Returns the name of an ASG of the fleet and the name of its env.
+def asg_and_env_names(target):
+    env_name = aws_target.run(target, eb_by_resource.get_envs)['Environments'][0]['EnvironmentName']
+    resources = aws_target.run(target, eb_by_resource.get_resources, env_name)
+    return resources['EnvironmentResources']['AutoScalingGroups'][0]['Name'], env_name
+
+
+def find_env(target, asg_name):
+    return aws_target.run(target, eb_by_resource.find_env_with_resource, {'AutoScalingGroups': {'Name': asg_name}})
+
+
+def persisted_index(target):
+    return aws_target.run(target, aws_cache.get_backend).get(eb_by_resource.RESOURCE_INDEX_KEY)
+
+
+# Starts the target afresh, as a new run would, with only what is cached.
+def restart(target):
+    aws_cache.memo_clear()
+    target.state.clear()
+
+
+def test_resources_resolve_through_the_persisted_index(target):
+    asg_name, env_name = asg_and_env_names(target)
+    assert find_env(target, asg_name) == env_name
+    assert persisted_index(target)['AutoScalingGroups']['Name'][asg_name] == env_name
+    assert find_env(target, 'no-such-asg') == ''
+
+    # A new run reads the persisted index instead of building it from every env's resources.
+    restart(target)
+    resource_index = persisted_index(target)
+    resource_index['AutoScalingGroups']['Name'][asg_name] = 'persisted-env'
+    aws_target.run(target, aws_cache.get_backend).put(eb_by_resource.RESOURCE_INDEX_KEY, resource_index)
+    counts = count_calls(target)
+    assert find_env(target, asg_name) == 'persisted-env'
+    assert not counts
+
+
+@pytest.mark.parametrize('refetch_envs', [True, False])
+def test_refetching_envs_or_resources_invalidates_the_persisted_index(target, refetch_envs):
+    asg_name, env_name = asg_and_env_names(target)
+    find_env(target, asg_name)
+    # A stale index, as if the ASG had moved to another env since it was built
+    resource_index = persisted_index(target)
+    resource_index['AutoScalingGroups']['Name'][asg_name] = 'stale-env'
+    restart(target)
+    aws_target.run(target, aws_cache.get_backend).put(eb_by_resource.RESOURCE_INDEX_KEY, resource_index)
+    assert find_env(target, asg_name) == 'stale-env'
+
+    if refetch_envs:
+        aws_target.run(target, eb_by_resource.get_envs, True)
+    else:
+        aws_target.run(target, eb_by_resource.get_resources, env_name, True)
+    assert persisted_index(target) is None
+    assert find_env(target, asg_name) == env_name
+    assert persisted_index(target)['AutoScalingGroups']['Name'][asg_name] == env_name
+
+
+def test_index_built_while_it_is_invalidated_is_not_kept(target, monkeypatch):
+    asg_name, env_name = asg_and_env_names(target)
+    build_resource_index = eb_by_resource.build_resource_index
+    builds = []
+
+    # The first build is from entries that another thread then refetches, and so invalidates the index.
+    def build_then_invalidate(refresh_cache=False):
+        resource_index = build_resource_index(refresh_cache)
+        if not builds:
+            resource_index = {'AutoScalingGroups': {'Name': {asg_name: 'stale-env'}}}
+            eb_by_resource.invalidate_resource_index()
+        builds.append(resource_index)
+        return resource_index
+
+    monkeypatch.setattr(eb_by_resource, 'build_resource_index', build_then_invalidate)
+    assert find_env(target, asg_name) == env_name
+    assert len(builds) == 2
+    assert persisted_index(target)['AutoScalingGroups']['Name'][asg_name] == env_name
+
+
+def test_index_is_persisted_when_building_it_fetches_what_was_not_cached(target):
+    asg_name, env_name = asg_and_env_names(target)
+    aws_target.run(target, aws_cache.cache_delete, 'describe_environment_resources-' + env_name)
+    restart(target)
+    assert find_env(target, asg_name) == env_name
+    assert persisted_index(target)['AutoScalingGroups']['Name'][asg_name] == env_name
+
+
+def test_resource_fan_out_keeps_the_env_order(make_target):
+    target = make_target('file')
+    envs = aws_target.run(target, eb_by_resource.get_envs)
+    env_names = [env['EnvironmentName'] for env in envs['Environments']]
+    lock = threading.Lock()
+    in_flight = [0, 0]  # now, most at once
+
+    # The first envs answer last
+    def slow_first_envs(operation_name, operation_fn, *args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        try:
+            if operation_name == 'elasticbeanstalk.describe_environment_resources':
+                time.sleep(0.02 * (len(env_names) - env_names.index(kwargs['EnvironmentName'])))
+            return operation_fn(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    target.set_client('elasticbeanstalk', operation_client.OperationClient(
+        'elasticbeanstalk', target.client('elasticbeanstalk'), slow_first_envs))
+    all_resources = aws_target.run(target, eb_by_resource.get_all_resources, envs, True, len(env_names))
+    assert [env_name for env_name, resources in all_resources] == env_names
+    assert in_flight[1] == len(env_names)
+    for env_name, resources in all_resources:
+        assert aws_target.run(target, aws_cache.cache_lookup, 'describe_environment_resources-' + env_name) == resources
+
+    serial_target = make_target('file', 'serial')
+    assert aws_target.run(target, asg_describe_scaling.lookup_beanstalk_asg_env_pairs, True, len(env_names)) == \
+        aws_target.run(serial_target, asg_describe_scaling.lookup_beanstalk_asg_env_pairs, True)
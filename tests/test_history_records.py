@@ -0,0 +1,74 @@
+import pytest
+from report_eb_autoscaling_alarms import asg_describe_scaling, aws_cache, aws_target, cw_describe_alarm_history, \
+    history_records
+
+
+def rows(records):
+    return [tuple(getattr(record, slot) for slot in record.__slots__) for record in records]
+
+
+# Returns a function of the target that returns the rows of the records of the fleet's first alarm (or ASG) and the
+# key of their raw entry, and a list holding the count of raw pages decoded.
+@pytest.fixture(params=['alarm_history', 'scaling'])
+def read_records(request, replay_data, monkeypatch):
+    num_decoded = [0]
+    if request.param == 'alarm_history':
+        name = next(name for operation, name in replay_data.responses if operation == 'describe_alarm_history')
+        source_key = cw_describe_alarm_history.history_key(name)
+        get_records, module, decode_name = \
+            cw_describe_alarm_history.get_history_records, cw_describe_alarm_history, 'decode_history_page'
+    else:
+        name = next(name for operation, name in replay_data.responses if operation == 'describe_scaling_activities')
+        source_key = 'describe_scaling_activities-' + name
+        get_records, module, decode_name = \
+            asg_describe_scaling.get_scaling_activity_records, asg_describe_scaling, 'decode_activity_page'
+    decode_page = getattr(module, decode_name)
+
+    def counted_decode_page(*args):
+        num_decoded[0] += 1
+        return decode_page(*args)
+
+    monkeypatch.setattr(module, decode_name, counted_decode_page)
+
+    def read(target):
+        return rows(aws_target.run(target, get_records, name)), source_key
+
+    return read, num_decoded
+
+
+def records_header(target, source_key):
+    return next(aws_target.run(target, aws_cache.cache_lookup_pages, 'records-' + source_key))
+
+
+def test_records_are_decoded_once_and_read_back_after(target, read_records, monkeypatch):
+    read, num_decoded = read_records
+    monkeypatch.setattr(history_records, 'ROWS_PER_PAGE', 5)
+    records, source_key = read(target)
+    num_pages = len(list(aws_target.run(target, aws_cache.cache_lookup_pages, source_key)))
+    assert len(records) > 5 and num_decoded[0] == num_pages
+    assert records_header(target, source_key) == {
+        'SourceStamp': list(aws_target.run(target, aws_cache.cache_stamp, source_key)),
+        'Version': history_records.RECORDS_VERSION}
+    assert read(target)[0] == records
+    assert num_decoded[0] == num_pages
+
+
+def test_records_are_decoded_again_when_the_raw_entry_or_version_changes(target, read_records, monkeypatch):
+    read, num_decoded = read_records
+    records, source_key = read(target)
+
+    # Rewritten with an empty page more, so that its stamp changes but not its records
+    raw_pages = list(aws_target.run(target, aws_cache.cache_lookup_pages, source_key))
+    raw_pages.append({name: [] for name, value in raw_pages[0].items() if isinstance(value, list)})
+    aws_target.run(target, aws_cache.cache_put_pages, source_key, iter(raw_pages))
+    num_decoded[0] = 0
+    assert read(target)[0] == records
+    assert num_decoded[0] == len(raw_pages)
+    assert records_header(target, source_key)['SourceStamp'] == \
+        list(aws_target.run(target, aws_cache.cache_stamp, source_key))
+
+    monkeypatch.setattr(history_records, 'RECORDS_VERSION', history_records.RECORDS_VERSION + 1)
+    num_decoded[0] = 0
+    assert read(target)[0] == records
+    assert read(target)[0] == records
+    assert num_decoded[0] == len(raw_pages)
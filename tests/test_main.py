@@ -0,0 +1,38 @@
+import conftest
+from report_eb_autoscaling_alarms import aws_replay, aws_target, cache_backends, cw_describe_alarms, output_sink, \
+    synthetic_fleet, util
+from report_eb_autoscaling_alarms import __main__
+
+
+def read_output(filename):
+    return list(output_sink.read_rows(filename))
+
+
+def test_merged_outputs_hold_each_targets_rows_in_turn(make_target, tmp_path):
+    # A fleet of its own for the second target, so that the targets' rows differ
+    other_backend = cache_backends.FileCacheBackend(str(tmp_path / 'other-fleet'))
+    synthetic_fleet.write_fleet(other_backend, **dict(conftest.FLEET, envs=2, seed=2))
+    targets = [make_target('file', 'prod-us', None, 'prod', 'us-east-1'),
+               make_target('sqlite', 'test-eu', aws_replay.load_cache(other_backend), 'test', 'eu-west-1')]
+    target_rows = []
+    for target in targets:
+        aws_target.run(target, cw_describe_alarms.write_alarms)
+        target_filename = aws_target.run(target, util.output_dir) + '/' + output_sink.file_name('cw_alarms')
+        target_rows.append(read_output(target_filename))
+    assert target_rows[0] and target_rows[1] and target_rows[0] != target_rows[1]
+
+    __main__.merge_target_outputs(targets, ['cw_alarms'])
+    merged_filename = util.OUTPUT_DIR + '/' + output_sink.file_name('cw_alarms')
+    assert output_sink.read_columns(merged_filename) == ['Region', 'Account'] + cw_describe_alarms.COLUMNS
+    assert read_output(merged_filename) == \
+        [dict(row, Region='us-east-1', Account='prod') for row in target_rows[0]] + \
+        [dict(row, Region='eu-west-1', Account='test') for row in target_rows[1]]
+
+
+def test_targets_without_an_output_are_left_out_of_the_merge(make_target):
+    targets = [make_target('file', 'with', None, 'with', 'us-east-1'),
+               make_target('file', 'without', None, 'without', 'us-east-1')]
+    aws_target.run(targets[0], cw_describe_alarms.write_alarms)
+    __main__.merge_target_outputs(targets, ['cw_alarms'])
+    merged_rows = read_output(util.OUTPUT_DIR + '/' + output_sink.file_name('cw_alarms'))
+    assert merged_rows and {row['Account'] for row in merged_rows} == {'with'}
@@ -0,0 +1,66 @@
+from datetime import timedelta
+import io
+import pytest
+from report_eb_autoscaling_alarms import output_sink
+
+COLUMNS = ['AlarmName', 'NumAlarms', 'StateReason', 'Lag']
+ROWS = [
+    {'AlarmName': 'alarm-a', 'NumAlarms': 3, 'StateReason': 'Threshold Crossed: 1 datapoint [4.5, "high"]',
+     'Lag': timedelta(seconds=90)},
+    {'AlarmName': 'alarm-b', 'NumAlarms': 0, 'StateReason': 'line one\nline two, with "quotes"', 'Lag': None},
+    {'AlarmName': 'alarm-c', 'NumAlarms': 12, 'StateReason': '', 'Lag': 1.5},
+]
+
+
+# The rows as read back from a CSV file: everything a string, None as empty.
+def as_csv_strings(rows):
+    return [{column: '' if row[column] is None else str(row[column]) for column in COLUMNS} for row in rows]
+
+
+# The rows as read back from a JSON file: numbers and None as is, anything else a string.
+def as_json_values(rows):
+    return [{column: output_sink.json_value(row[column]) for column in COLUMNS} for row in rows]
+
+
+@pytest.fixture(params=[(format_name, gzipped) for format_name in output_sink.FORMATS for gzipped in [False, True]])
+def output_format(request, monkeypatch):
+    format_name, gzipped = request.param
+    monkeypatch.setattr(output_sink, 'output_format', format_name)
+    monkeypatch.setattr(output_sink, 'output_gzip', gzipped)
+    # Small enough batches that the columnar rows span several
+    monkeypatch.setattr(output_sink, 'BATCH_ROWS', 2)
+    return format_name
+
+
+def test_rows_read_back_as_written(output_format, tmp_path):
+    output_filename, num_written = output_sink.write_rows('report', COLUMNS, iter(ROWS), str(tmp_path))
+    assert num_written == len(ROWS)
+    assert output_filename.name == output_sink.file_name('report')
+    assert output_sink.read_columns(output_filename) == COLUMNS
+    expected = as_csv_strings(ROWS) if output_format == 'csv' else as_json_values(ROWS)
+    assert list(output_sink.read_rows(output_filename)) == expected
+
+
+def test_empty_reports(output_format, tmp_path):
+    output_filename, num_written = output_sink.write_rows('report', COLUMNS, [], str(tmp_path))
+    assert num_written == 0
+    assert output_sink.read_columns(output_filename) == (COLUMNS if output_format == 'csv' else None)
+    assert list(output_sink.read_rows(output_filename)) == []
+
+
+def test_file_names():
+    output_sink.init_output('jsonl', True)
+    try:
+        assert output_sink.file_name('cw_alarms') == 'cw_alarms.jsonl.gz'
+    finally:
+        output_sink.init_output('csv')
+    assert output_sink.file_name('cw_alarms') == 'cw_alarms.csv'
+
+
+def test_write_to_an_open_file_in_another_format():
+    output_file = io.StringIO()
+    assert output_sink.write_to(output_file, COLUMNS, ROWS, 'columnar') == len(ROWS)
+    assert output_file.getvalue().count('\n') == 1
+    output_file = io.StringIO()
+    assert output_sink.write_to(output_file, COLUMNS, ROWS, 'csv') == len(ROWS)
+    assert output_file.getvalue().startswith(','.join(COLUMNS) + '\n')
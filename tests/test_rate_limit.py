@@ -0,0 +1,48 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from report_eb_autoscaling_alarms import aws_replay, aws_target, rate_limit
+
+
+def test_throttles_of_requests_sent_before_a_cut_do_not_cut_again():
+    limiter = rate_limit.AdaptiveRateLimiter()
+    sent_before = [limiter.acquire()[0] for _ in range(20)]
+    for _ in range(20):
+        limiter.on_success()
+    limiter.on_throttle(sent_before[0], True)
+    rate = limiter.rate
+    assert rate == 21 * rate_limit.BACKOFF
+    # The rest of the burst, in flight when the rate was cut
+    for sent_at in sent_before[1:]:
+        limiter.on_throttle(sent_at, True)
+    assert limiter.rate == rate
+
+    limiter.on_success()
+    assert limiter.rate > rate
+    # A request sent after the cut, to the rate requests completed at
+    limiter.on_throttle(limiter.acquire()[0], False)
+    assert limiter.rate == len(limiter.recent_completions) * rate_limit.BACKOFF
+
+
+# Makes num_calls calls of one operation from many threads, and returns the calls per second completed after the first
+# skip calls.
+def calls_per_second(target, workers, num_calls, skip):
+    completed_at = []
+    lock = threading.Lock()
+
+    def call(_):
+        aws_target.run(target, lambda: aws_target.client('cloudwatch').describe_alarm_history(AlarmName='alarm'))
+        with lock:
+            completed_at.append(time.monotonic())
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(call, range(num_calls)))
+    return (num_calls - 1 - skip) / (completed_at[-1] - completed_at[skip])
+
+
+def test_concurrent_calls_keep_close_to_the_rate_limit():
+    max_rate = 100
+    target = aws_target.Target()
+    aws_replay.replay_target(target, aws_replay.ReplayData(), latency=0.005, max_rate=max_rate, seed=1)
+    # Past the second's worth of calls the replay lets through at first, as AWS does
+    assert calls_per_second(target, 32, 6 * max_rate, max_rate) > 0.85 * max_rate
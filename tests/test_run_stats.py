@@ -0,0 +1,83 @@
+import json
+import pytest
+from botocore.exceptions import ClientError
+from report_eb_autoscaling_alarms import aws_cache, aws_target, cw_describe_alarm_history, operation_client, run_stats
+from report_eb_autoscaling_alarms import __main__
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    # Restored to disabled after the test
+    monkeypatch.setattr(run_stats, 'enabled', False)
+    run_stats.enable()
+
+
+def test_operation_client_routes_only_the_operations():
+    calls = []
+
+    class Client:
+        meta = 'meta'
+
+        def describe_alarms(self, **kwargs):
+            return {'MetricAlarms': [], 'Params': kwargs}
+
+        def get_paginator(self, operation_name):
+            return 'paginator of ' + operation_name
+
+    def noted_call(operation_name, operation_fn, *args, **kwargs):
+        calls.append(operation_name)
+        return operation_fn(*args, **kwargs)
+
+    client = operation_client.OperationClient('cloudwatch', Client(), noted_call)
+    assert client.describe_alarms(AlarmNamePrefix='awseb-') == \
+        {'MetricAlarms': [], 'Params': {'AlarmNamePrefix': 'awseb-'}}
+    assert client.get_paginator('describe_alarms') == 'paginator of describe_alarms'
+    assert client.meta == 'meta'
+    assert calls == ['cloudwatch.describe_alarms']
+
+
+def test_calls_are_timed_and_counted_by_outcome(stats):
+    def throttled():
+        raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}, 'DescribeAlarms')
+
+    def failed():
+        raise ClientError({'Error': {'Code': 'ValidationError', 'Message': 'Bad'}}, 'DescribeAlarms')
+
+    run_stats.timed_call('cloudwatch.describe_alarms', lambda: {'ResponseMetadata': {'RetryAttempts': 2}})
+    for fail in (throttled, failed):
+        with pytest.raises(ClientError):
+            run_stats.timed_call('cloudwatch.describe_alarms', fail)
+    op_stats = run_stats.get_stats()['api_calls']['cloudwatch.describe_alarms']
+    assert (op_stats['calls'], op_stats['errors'], op_stats['throttles'], op_stats['retries']) == (3, 2, 1, 2)
+    # All fast enough for the first bucket
+    assert op_stats['histogram'][str(run_stats.LATENCY_BUCKETS_MS[0])] == 3
+    assert sum(op_stats['histogram'].values()) == 3
+
+
+def test_run_stats_of_a_run(target, stats):
+    assert aws_target.run(target, aws_target.client, 'cloudwatch') is not target.client('cloudwatch')
+    aws_target.run(target, __main__.write_csvs, ['cw_alarms', 'cw_alarm_history'], ['alarms', 'alarm_history'])
+    run_stats.write_stats('output/run_stats.json', aws_cache.memo_counts)
+    with open('output/run_stats.json', encoding='UTF-8') as stats_file:
+        run_stats_json = json.load(stats_file)
+
+    alarms = aws_target.run(target, cw_describe_alarm_history.get_report_alarms)
+    history_stats = run_stats_json['cache']['by_object_type']['describe_alarm_history']
+    assert history_stats['entries_written'] == len(alarms)
+    # Each page written was a call
+    assert run_stats_json['api_calls']['cloudwatch.describe_alarm_history']['calls'] == \
+        history_stats['pages_written'] > len(alarms)
+    assert run_stats_json['cache']['by_object_type']['records']['entries_written'] == len(alarms)
+    assert sorted(run_stats_json['stages']) == ['cw_alarm_history', 'cw_alarms']
+    assert all(stage_stats['runs'] == 1 for stage_stats in run_stats_json['stages'].values())
+    assert set(run_stats_json['cache']['memo']) == {'hits', 'misses', 'evictions'}
+
+
+def test_nothing_is_recorded_unless_enabled(target, monkeypatch):
+    monkeypatch.setattr(run_stats, 'enabled', False)
+    client = target.client('cloudwatch')
+    assert run_stats.instrument('cloudwatch', client) is client
+    stages = run_stats.get_stats()['stages']
+    with run_stats.stage('cw_alarms'):
+        pass
+    assert run_stats.get_stats()['stages'] == stages
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+import json
+import random
+import pytz
+from report_eb_autoscaling_alarms import aws_target, cw_describe_alarm_history, history_records, state_durations
+
+STATE_NAMES = history_records.STATE_NAMES
+
+
+# The timedelta in each state of each alarm, one interval at a time, as cw_alarm_history summed them before
+# state_durations.
+def brute_force_sums(intervals, num_alarms):
+    sums = [{state_name: timedelta(0) for state_name in STATE_NAMES} for _ in range(num_alarms)]
+    for alarm_id, state, start_us, end_us in intervals:
+        sums[alarm_id][STATE_NAMES[state]] += timedelta(microseconds=end_us - start_us)
+    return sums
+
+
+def test_sum_by_alarm_matches_brute_force():
+    rnd = random.Random(1)
+    for trial in range(100):
+        num_alarms = rnd.randint(1, 6)
+        intervals = []
+        for _ in range(rnd.randint(0, 60)):
+            start_us = rnd.randint(0, 10 ** 12)
+            intervals.append((rnd.randrange(num_alarms), rnd.randrange(len(STATE_NAMES)), start_us,
+                              start_us + rnd.randint(1, 10 ** 10)))
+        durations = state_durations.StateDurations(num_alarms)
+        for interval in intervals:
+            durations.add_interval(*interval)
+        sums = durations.sum_by_alarm()
+        assert [{state_name: timedelta(microseconds=sums[alarm_id * len(STATE_NAMES) + state])
+                 for state, state_name in enumerate(STATE_NAMES)} for alarm_id in range(num_alarms)] == \
+            brute_force_sums(intervals, num_alarms), trial
+
+
+# The state times of an alarm from its raw StateUpdate history items, as the original calc_state_times computed them
+# (with now given rather than the current time).
+def calc_state_times(alarm, state_update_items, now):
+    timedelta_in_state = {state_name: timedelta(0) for state_name in STATE_NAMES}
+    latest_new_start_date = pytz.utc.localize(datetime(1900, 1, 1))
+    latest_state = None
+    for item in state_update_items:
+        history_data = json.loads(item['HistoryData'])
+        old_state, old_start_date = cw_describe_alarm_history.extract_state(history_data, 'oldState', '')
+        new_state, new_start_date = cw_describe_alarm_history.extract_state(history_data, 'newState', '')
+        if old_start_date and new_start_date:
+            timedelta_in_state[old_state] += new_start_date - old_start_date
+        if new_start_date and new_start_date > latest_new_start_date:
+            latest_new_start_date = new_start_date
+            latest_state = new_state
+    if not state_update_items:
+        latest_new_start_date = alarm['StateUpdatedTimestamp']
+        latest_state = alarm['StateValue']
+    if now >= latest_new_start_date:
+        timedelta_in_state[latest_state] += now - latest_new_start_date
+    total = sum(timedelta_in_state.values(), timedelta(0))
+    return [str(timedelta_in_state[state_name]) for state_name in STATE_NAMES] + \
+        ['{0:.2f}%'.format(100.0 * (timedelta_in_state[state_name] / total)) for state_name in STATE_NAMES]
+
+
+def test_alarm_history_summary_matches_the_original_state_times(target, replay_data):
+    now = pytz.utc.localize(datetime(2017, 2, 1, 12))
+
+    def summarize():
+        alarms = cw_describe_alarm_history.get_report_alarms()
+        alarm_records = (cw_describe_alarm_history.get_history_records(alarm['AlarmName']) for alarm in alarms)
+        return alarms, cw_describe_alarm_history.summarize_alarms_and_history(alarms, alarm_records, now)
+
+    alarms, summary_rows = aws_target.run(target, summarize)
+    assert summary_rows
+    for alarm, summary_row in zip(alarms, summary_rows):
+        items = replay_data.responses[('describe_alarm_history', alarm['AlarmName'])]
+        state_update_items = [item for item in items if item['HistoryItemType'] == 'StateUpdate']
+        assert [summary_row[column] for column in ['OKAbsTime', 'ALARMAbsTime', 'INSUFAbsTime', 'OKPctTime',
+                                                   'ALARMPctTime', 'INSUFPctTime']] == \
+            calc_state_times(alarm, state_update_items, now)
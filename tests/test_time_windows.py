@@ -0,0 +1,100 @@
+from datetime import datetime
+import argparse
+import random
+import pytest
+import pytz
+from report_eb_autoscaling_alarms import aws_target, cw_describe_alarm_history, history_records, state_durations, \
+    time_windows
+
+HOUR_US = 3600 * 1000000
+
+
+def random_durations(rnd, num_alarms, num_intervals):
+    durations = state_durations.StateDurations(num_alarms)
+    for _ in range(num_intervals):
+        start_us = rnd.randint(-10 * HOUR_US, 100 * HOUR_US)
+        durations.add_interval(rnd.randrange(num_alarms), rnd.randrange(state_durations.NUM_STATES), start_us,
+                               start_us + rnd.randint(0, 20 * HOUR_US))
+    return durations
+
+
+def clipped_sums(durations, window):
+    sums = [0] * (durations.num_alarms * state_durations.NUM_STATES)
+    for group, start_us, end_us in zip(durations.groups, durations.start_us, durations.end_us):
+        if window.since_us is not None:
+            start_us = max(start_us, window.since_us)
+        if window.until_us is not None:
+            end_us = min(end_us, window.until_us)
+        sums[group] += max(0, end_us - start_us)
+    return sums
+
+
+def test_state_index_sums_intervals_clipped_to_the_window():
+    rnd = random.Random(1)
+    for trial in range(200):
+        durations = random_durations(rnd, rnd.randint(1, 5), rnd.randint(0, 40))
+        state_index = state_durations.StateIndex(durations)
+        since_us = rnd.choice([None, rnd.randint(-20 * HOUR_US, 120 * HOUR_US)])
+        until_us = rnd.choice([None, rnd.randint(since_us or -20 * HOUR_US, 130 * HOUR_US)])
+        window = time_windows.Window('', since_us, until_us)
+        assert list(state_index.sum_by_alarm(window)) == clipped_sums(durations, window), trial
+
+
+def test_state_index_of_an_open_window_sums_everything():
+    durations = random_durations(random.Random(2), 4, 100)
+    assert state_durations.StateIndex(durations).sum_by_alarm(time_windows.Window('')) == durations.sum_by_alarm()
+
+
+def test_event_index_counts_events_in_half_open_windows():
+    rnd = random.Random(3)
+    event_index = time_windows.EventIndex()
+    times = {group: [rnd.randint(0, 1000) for _ in range(50)] for group in ['Launching', ('Failed', 0)]}
+    for group, group_times in times.items():
+        for time_us in group_times:
+            event_index.add(group, time_us)
+    event_index.sort()
+    assert list(event_index.groups()) == list(times)
+    for since_us, until_us in [(None, None), (100, 200), (200, 200), (None, 500), (990, None), (0, 1)]:
+        window = time_windows.Window('', since_us, until_us)
+        for group, group_times in times.items():
+            in_window = [time_us for time_us in group_times
+                         if (since_us is None or time_us >= since_us) and (until_us is None or time_us < until_us)]
+            assert event_index.count(group, window) == len(in_window)
+            assert event_index.earliest(group, window) == (min(in_window) if in_window else None)
+    assert event_index.count('Terminating', time_windows.Window('')) == 0
+
+
+def test_parse_time_and_windows():
+    now = pytz.utc.localize(datetime(2017, 3, 8, 12, 0))
+    assert time_windows.parse_time('24h', now) == \
+        history_records.to_epoch_us(pytz.utc.localize(datetime(2017, 3, 7, 12)))
+    assert time_windows.parse_time('2017-03-01T12:00') == \
+        history_records.to_epoch_us(pytz.utc.localize(datetime(2017, 3, 1, 12)))
+    assert time_windows.parse_time('2017-03-01T12:00+01:00') == \
+        history_records.to_epoch_us(pytz.utc.localize(datetime(2017, 3, 1, 11)))
+    assert time_windows.parse_duration('15m') == 15 * 60 * 1000000
+    with pytest.raises(argparse.ArgumentTypeError):
+        time_windows.parse_duration('15x')
+    with pytest.raises(argparse.ArgumentTypeError):
+        time_windows.parse_time('yesterday-ish')
+
+    window = time_windows.parse_window('deploy=2017-03-01T12:00..2017-03-08T09:30')
+    assert window.name == 'deploy'
+    assert window.output_name('cw_alarm_history') == 'cw_alarm_history-deploy'
+    assert window.until_us - window.since_us == (6 * 24 + 21) * HOUR_US + 30 * 60 * 1000000
+    assert time_windows.parse_window('7d').name == '7d'
+    assert time_windows.parse_window('2017-03-01..').until_us is None
+    assert time_windows.make_windows() is None
+    assert [window.name for window in time_windows.make_windows(0, None, [window])] == ['', 'deploy']
+
+
+def test_summary_of_an_open_window_is_the_whole_history(target):
+    def summarize(windows):
+        alarms = cw_describe_alarm_history.get_report_alarms()
+        alarm_records = (cw_describe_alarm_history.get_history_records(alarm['AlarmName']) for alarm in alarms)
+        now = pytz.utc.localize(datetime(2017, 2, 1))
+        return cw_describe_alarm_history.summarize_alarms_and_history(alarms, alarm_records, now, windows)
+
+    summary_rows = aws_target.run(target, summarize, None)
+    window_rows = aws_target.run(target, summarize, [time_windows.Window('')])
+    assert [alarm_rows[0] for alarm_rows in window_rows] == summary_rows